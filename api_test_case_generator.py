@@ -5,10 +5,23 @@ import json
 import re
 import time
 import logging
+from concurrent.futures import as_completed
 from llm_connector import OpenAIConnector
-
-# Configure logging to display timestamps, log level, and messages
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from domain_test_case_store import DomainTestCaseStore
+from case_selection import select_previous_cases
+from deduplication import DuplicateIndex
+from spec_slicer import get_spec_slicer
+from humanize_manifest import content_hash
+from run_state import get_run_state
+from metrics import metric_labels
+
+# Approximate number of prompt tokens spent on previously generated test cases per request
+previous_cases_token_budget = 4000
+# Handling of near-duplicate test cases: "drop" them, "flag" them in the written file, or "off"
+dedup_mode = "drop"
+# Spec slices up to this many estimated tokens are sent inline with a plain chat completion;
+# larger ones fall back to attaching the whole API documentation via the Assistants API
+inline_spec_token_limit = 16000
 
 
 # System prompt for the LLM, describing the requirements for test case generation
@@ -51,6 +64,12 @@ Before providing the output, ensure that: you would be able to gernerate the who
 Always respond only with a valid JSON array.
 """  
 
+# System prompt for requests that carry the relevant part of the API documentation inline
+inline_system_prompt = system_prompt.replace(
+    "- A JSON file representing API documentation (as attachment).",
+    "- An excerpt of the API documentation with the focus endpoint and all schemas it references."
+)
+
 def extract_json_array(text):
     """
     Attempts to extract and parse a JSON array from a string.
@@ -77,45 +96,169 @@ def extract_json_array(text):
                 pass
     raise ValueError("No valid JSON array could be extracted.")
 
-def get_previous_test_cases(output_dir):
+def save_test_cases(parsed_list, output_dir, file_prefix, difficulties, store=None, dedup=None, on_saved=None):
     """
-    Loads all previously generated test cases from a directory.
+    Writes each generated test case to its own timestamped JSON file.
 
     Args:
-        output_dir (str): Path to the directory containing test case JSON files.
+        parsed_list (list): Test cases returned by the LLM.
+        output_dir (str): Directory the files are written to.
+        file_prefix (str): Endpoint/method prefix used for the file names.
+        difficulties (list): Known difficulty levels used to number the files.
+        store (DomainTestCaseStore, optional): Index of the domain the written test cases are added to.
+        dedup (DuplicateIndex, optional): Duplicate index of the domain; near-duplicates are handled per dedup_mode.
+        on_saved (callable, optional): Called as on_saved(subdir, file_name, file_path, test_case) after each write.
+    """
+    # Track the number of test cases per difficulty
+    count = {level: 0 for level in difficulties}
+    for parsed in parsed_list:
+        # Drop or flag test cases that duplicate an existing or an earlier one
+        duplicate = dedup.check(parsed) if dedup is not None and dedup_mode != "off" else None
+        if duplicate is not None:
+            reason, similar_to = duplicate
+            if dedup_mode == "drop":
+                logging.info(f"Dropped test case in {output_dir} ({reason} of {similar_to})")
+                continue
+            parsed["near_duplicate"] = {"reason": reason, "similar_to": similar_to}
+
+        diff = parsed.get("difficulty", "Unknown")
+        idx = count.get(diff, 0) + 1
+        count[diff] = idx
+
+        # Generate a timestamped filename for each test case
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        filename = f"{file_prefix}_{diff}_{idx}_{timestamp}.json"
+        output_path = os.path.join(output_dir, filename)
+        with open(output_path, "w") as outfile:
+            json.dump(parsed, outfile, indent=2)
+        get_run_state().record(
+            "API", os.path.basename(output_dir), filename, "generated", parsed,
+            raw_hash=content_hash(json.dumps(parsed, indent=2))
+        )
+        if store is not None:
+            store.add(parsed, filename)
+        if dedup is not None:
+            dedup.add(parsed, filename)
+        logging.info(f"Generated: {output_path}")
+        if on_saved is not None:
+            on_saved(os.path.basename(output_dir), filename, output_path, parsed)
+
+def generate_domain_test_cases(connector, base_dir, output_dir, subdir, test_cases_per_difficulty, difficulties, on_saved=None):
+    """
+    Generates the test cases for all endpoints of a single business entity.
 
-    Returns:
-        list: A list of previously generated test cases (as dicts).
+    Endpoints of one domain are processed one after another so that every prompt
+    sees the test cases generated for the previous endpoints; the domains
+    themselves run concurrently on the connector's worker pool.
     """
-    test_cases = []
-    if os.path.exists(output_dir):
-        for file in os.listdir(output_dir):
-            if file.endswith(".json"):
-                try:
-                    with open(os.path.join(output_dir, file), 'r') as f:
-                        test_case = json.load(f)
-                        if isinstance(test_case, list):
-                            test_cases.extend(test_case)
-                        else:
-                            test_cases.append(test_case)
-                except Exception:
+    filenames = os.listdir(base_dir)
+    # Identify the relevant files by naming convention
+    db_file = next((f for f in filenames if f.startswith("DB_") and f.endswith(".json")), None)
+    api_file = next((f for f in filenames if f.startswith("API_") and f.endswith(".json")), None)
+    txt_file = next((f for f in filenames if f.endswith(".txt")), None)
+
+    if not (db_file and api_file and txt_file):
+        return
+
+    with open(os.path.join(base_dir, db_file), 'r') as dbf, \
+         open(os.path.join(base_dir, txt_file), 'r') as txtf:
+        db_content = dbf.read()
+        semantic_description = txtf.read()
+
+    try:
+        # Load API documentation to extract endpoints and methods
+        slicer = get_spec_slicer(os.path.join(base_dir, api_file))
+        api_json = slicer.spec
+        paths = api_json.get("paths", {})
+        # Previously generated test cases are loaded once and extended as new ones are written
+        store = DomainTestCaseStore(output_dir)
+        dedup = DuplicateIndex.from_cases(store.cases, store.file_names)
+        for path, methods in paths.items():
+            for method in methods:
+                # Skip non-HTTP method keys and GET requests (if desired)
+                if method.lower() in ["parameters", "get"]:
                     continue
-    return test_cases
 
-def generate_test_cases(test_cases_per_difficulty=1):
+                # Prepare a unique identifier for the endpoint
+                endpoint_path = path.replace("/", "_").strip("_")
+                # Quote the cases most similar to the focus endpoint and summarize the rest
+                previous_cases_json = select_previous_cases(
+                    store, f"{method.upper()} {path}", token_budget=previous_cases_token_budget
+                )
+                total_test_cases = test_cases_per_difficulty * len(difficulties)
+
+                # Construct the user prompt for the LLM
+                user_prompt = f"""
+                Database Structure:
+                {db_content}
+
+                Semantic Description:
+                {semantic_description}
+
+                Previously Generated Test Cases:
+                {previous_cases_json}
+
+                Focus Endpoint: {path} using {method.upper()}
+
+                Generate {total_test_cases} test cases distributed evenly across the following difficulty levels: {difficulties}.
+                """
+
+                try:
+                    # Query the LLM to generate test cases, inlining only the relevant part of the spec if it is small enough
+                    spec_slice = slicer.slice_json(path, method)
+                    if len(spec_slice) // 4 <= inline_spec_token_limit:
+                        request = dict(
+                            system_prompt=inline_system_prompt,
+                            user_prompt=f"{user_prompt}\n\nAPI Documentation (focus endpoint and referenced schemas):\n{spec_slice}",
+                            model="gpt-4o-mini"
+                        )
+                        response = connector.query_without_file(**request)
+                    else:
+                        request = dict(
+                            system_prompt=system_prompt,
+                            user_prompt=user_prompt,
+                            file_path=os.path.join(base_dir, api_file),
+                            model="gpt-4o-mini"
+                        )
+                        response = connector.query_with_file(**request)
+                    try:
+                        parsed_list = extract_json_array(response)
+                    except ValueError:
+                        # Request the test cases again next time instead of replaying the unusable response
+                        connector.invalidate(**request)
+                        raise
+                    save_test_cases(parsed_list, output_dir, f"{endpoint_path}_{method.upper()}", difficulties, store, dedup, on_saved)
+
+                except Exception as e:
+                    logging.error(f"Error processing {subdir} - {path} ({method}): {e}")
+    except Exception as e:
+        logging.error(f"Failed to process {subdir}: {e}")
+
+def generate_test_cases(test_cases_per_difficulty=1, max_concurrency=None, on_saved=None, connector=None):
     """
     Main function to generate test cases for all API endpoints found in the documentation.
     For each endpoint and HTTP method, it:
       - Loads the database structure, API documentation, and semantic description.
+      - Slices the API documentation down to the endpoint and the schemas it references.
       - Retrieves previously generated test cases for the endpoint.
       - Constructs a prompt and queries the LLM to generate new test cases.
       - Saves each generated test case as a separate JSON file, organized by endpoint and difficulty.
+
+    Business entities are processed concurrently with at most max_concurrency
+    requests in flight (defaults to the connector's configured limit).
+    on_saved is handed to save_test_cases, e.g. to stream every written test
+    case into the next pipeline stage. connector, if given, is used instead of
+    a new OpenAIConnector and left open.
     """
-    connector = OpenAIConnector()
+    # A connector handed in is shared with other stages and closed by its owner
+    owns_connector = connector is None
+    if owns_connector:
+        connector = OpenAIConnector(max_concurrency=max_concurrency)
     root_input_dir = "system_documentation"  # Directory containing input files for each API
     root_output_dir = os.path.join("raw_testcases", "API")  # Output directory for generated test cases
     difficulties = ["Easy", "Medium", "Hard", "Extra Hard"]
 
+    futures = {}
     # Iterate over each subdirectory (representing an API or business entity)
     for subdir in os.listdir(root_input_dir):
         base_dir = os.path.join(root_input_dir, subdir)
@@ -125,77 +268,21 @@ def generate_test_cases(test_cases_per_difficulty=1):
         output_dir = os.path.join(root_output_dir, subdir)
         os.makedirs(output_dir, exist_ok=True)
 
-        filenames = os.listdir(base_dir)
-        # Identify the relevant files by naming convention
-        db_file = next((f for f in filenames if f.startswith("DB_") and f.endswith(".json")), None)
-        api_file = next((f for f in filenames if f.startswith("API_") and f.endswith(".json")), None)
-        txt_file = next((f for f in filenames if f.endswith(".txt")), None)
-
-        if db_file and api_file and txt_file:
-            with open(os.path.join(base_dir, db_file), 'r') as dbf, \
-                 open(os.path.join(base_dir, api_file), 'r') as apif, \
-                 open(os.path.join(base_dir, txt_file), 'r') as txtf:
-                db_content = dbf.read()
-                semantic_description = txtf.read()
+        # Attribute the LLM calls of this entity to it in the metrics
+        with metric_labels(domain=subdir):
+            future = connector.submit(
+                generate_domain_test_cases,
+                connector, base_dir, output_dir, subdir, test_cases_per_difficulty, difficulties, on_saved
+            )
+        futures[future] = subdir
 
+    try:
+        for future in as_completed(futures):
             try:
-                # Load API documentation to extract endpoints and methods
-                api_json = json.load(open(os.path.join(base_dir, api_file)))
-                paths = api_json.get("paths", {})
-                for path, methods in paths.items():
-                    for method in methods:
-                        # Skip non-HTTP method keys and GET requests (if desired)
-                        if method.lower() in ["parameters", "get"]:
-                            continue
-
-                        # Prepare a unique identifier for the endpoint
-                        endpoint_path = path.replace("/", "_").strip("_")
-                        previous_cases = get_previous_test_cases(output_dir)
-                        previous_cases_json = json.dumps(previous_cases, indent=2)
-                        total_test_cases = test_cases_per_difficulty * len(difficulties)
-
-                        # Construct the user prompt for the LLM
-                        user_prompt = f"""
-                        Database Structure:
-                        {db_content}
-
-                        Semantic Description:
-                        {semantic_description}
-
-                        Previously Generated Test Cases:
-                        {previous_cases_json}
-
-                        Focus Endpoint: {path} using {method.upper()}
-
-                        Generate {total_test_cases} test cases distributed evenly across the following difficulty levels: {difficulties}.
-                        """
-
-                        try:
-                            # Query the LLM to generate test cases
-                            response = connector.query_with_file(
-                                system_prompt=system_prompt,
-                                user_prompt=user_prompt,
-                                file_path=os.path.join(base_dir, api_file),
-                                model="gpt-4o-mini"
-                            )
-                            parsed_list = extract_json_array(response)
-
-                            # Track the number of test cases per difficulty
-                            count = {level: 0 for level in difficulties}
-                            for parsed in parsed_list:
-                                diff = parsed.get("difficulty", "Unknown")
-                                idx = count.get(diff, 0) + 1
-                                count[diff] = idx
-
-                                # Generate a timestamped filename for each test case
-                                timestamp = time.strftime("%Y%m%d_%H%M%S")
-                                filename = f"{endpoint_path}_{method.upper()}_{diff}_{idx}_{timestamp}.json"
-                                output_path = os.path.join(output_dir, filename)
-                                with open(output_path, "w") as outfile:
-                                    json.dump(parsed, outfile, indent=2)
-                                logging.info(f"Generated: {output_path}")
-
-                        except Exception as e:
-                            logging.error(f"Error processing {subdir} - {path} ({method}): {e}")
+                future.result()
+                logging.info(f"Finished {futures[future]}")
             except Exception as e:
-                logging.error(f"Failed to process {subdir}: {e}")
+                logging.error(f"Failed to process {futures[future]}: {e}")
+    finally:
+        if owns_connector:
+            connector.close()
@@ -1,14 +1,66 @@
 # api_test_case_modifier.py
 import os
 import json
+from concurrent.futures import as_completed
 from llm_connector import OpenAIConnector
+from humanize_batching import batch_response_format, build_batches, humanize_batch
+from humanize_manifest import HumanizeManifest, content_hash, prompt_fingerprint
+from run_state import get_run_state
+from consistency_check import check_consistency
 
 # Define the base path where the raw test cases are stored
 base_path = "raw_testcases/API"
 # Define the path where the updated (humanized) test cases will be saved
 updated_base_path = "modified_input_testcases/API"
+# Folder the validator moves successful test cases to
+validated_base_path = "validated_testcases/API"
+# Model used to humanize the test cases
+model = "gpt-4o-mini"
+
+# Instruction for the LLM to humanize the input text
+rewrite_rules = """
+    You will receive json objects containting test cases. 
+    Each test case contains
+    1. difficulty: describing the difficulty of the test case
+    2. input: the input of the test case
+    2. output: the expected output of the test case - an API call
+    Rewrite the input of the testcase to a more humanly written way. This includes:
+    - be colloquial
+    - modify other of the input to make it more humanly written. e.g. changing country codes to full country names, changing timestamps to a more human-readable format, etc.
+    - modify value names to be more humanly written. e.g. changing "user_id" to "the user with the id" or currency codes to "currency"
+    However, it is crucial to keep it consistent with the output. This includes that you must never change any ID/UUID. 
+"""
+
+# Response format for a single test case
+system_prompt = rewrite_rules + """
+    Only return the value of the "input" of the json object. Respond only with the plain sentence, without quotation marks, formatting, or any extra characters at the beginning or end.
+    """
+
+# Response format for a keyed batch of test cases
+batch_system_prompt = rewrite_rules + batch_response_format
+
+def save_humanized_test_case(subfolder, file_name, data):
+    """
+    Writes a humanized test case to the mirrored location under updated_base_path.
 
-def humanize_testcases():
+    Returns:
+        str: Path of the written file.
+    """
+    # Prepare the destination folder and file path
+    updated_subfolder_path = os.path.join(updated_base_path, subfolder)
+    os.makedirs(updated_subfolder_path, exist_ok=True)
+    updated_file_path = os.path.join(updated_subfolder_path, file_name)
+
+    # Write the updated test case JSON
+    with open(updated_file_path, "w", encoding="utf-8") as updated_file:
+        json.dump(data, updated_file, indent=4, ensure_ascii=False)
+    get_run_state().record(
+        "API", subfolder, file_name, "humanized", data,
+        humanized_hash=content_hash(json.dumps(data, indent=4, ensure_ascii=False))
+    )
+    return updated_file_path
+
+def humanize_testcases(max_concurrency=None, batch_size=20, batch_token_budget=6000, force=False):
     """
     Iterates through all JSON test case files in the base_path directory structure.
     For each file, it rewrites the 'input' field of the test case to a more
@@ -17,100 +69,121 @@ def humanize_testcases():
 
     The transformation preserves critical data integrity (like IDs or UUIDs)
     and aims for better readability and natural phrasing of test case prompts.
+
+    Test cases are packed into batches of up to batch_size cases or
+    batch_token_budget estimated prompt tokens that are rewritten with one
+    request each; cases the batch response does not cover are retried one by
+    one. Batches are submitted concurrently (at most max_concurrency requests
+    in flight) and each result is written as soon as it arrives. A batch_size
+    of 1 sends every test case on its own.
+
+    The run is incremental: a manifest in updated_base_path records the hash of
+    every raw test case and the prompts/model it was humanized with, so only new
+    or changed test cases are sent to the LLM unless force is set. Humanized
+    test cases whose raw source disappeared are reported. Without a manifest
+    (e.g. on the first run after upgrading), it is seeded from the raw test
+    cases that already have a humanized counterpart.
     """
-    connector = OpenAIConnector()  # Initialize LLM connector
+    manifest = HumanizeManifest(updated_base_path)
+    prompt_hash = prompt_fingerprint(model, system_prompt, batch_system_prompt)
+    # Test cases humanized before the manifest existed are not rewritten again
+    seeded = manifest.seed_if_new(base_path, (updated_base_path, validated_base_path), prompt_hash)
+    if seeded:
+        print(f"Recorded {seeded} test cases humanized before the manifest existed")
+    items = []
+    raw_rel_paths = set()
+    skipped = 0
     for subfolder in os.listdir(base_path):
         subfolder_path = os.path.join(base_path, subfolder)
         if os.path.isdir(subfolder_path):
             for file_name in os.listdir(subfolder_path):
                 if file_name.endswith(".json"):
                     file_path = os.path.join(subfolder_path, file_name)
+                    rel_path = f"{subfolder}/{file_name}"
+                    raw_rel_paths.add(rel_path)
                     try:
                         # Load the raw test case JSON data
-                        with open(file_path, "r", encoding="utf-8") as file:
-                            data = json.load(file)
-
-                        # Format the input for the LLM
-                        user_prompt = json.dumps(data, ensure_ascii=False)
-
-                        # Instruction for the LLM to humanize the input text
-                        system_prompt = """
-                            You will receive json objects containting test cases. 
-                            Each test case contains
-                            1. difficulty: describing the difficulty of the test case
-                            2. input: the input of the test case
-                            2. output: the expected output of the test case - an API call
-                            Rewrite the input of the testcase to a more humanly written way. This includes:
-                            - be colloquial
-                            - modify other of the input to make it more humanly written. e.g. changing country codes to full country names, changing timestamps to a more human-readable format, etc.
-                            - modify value names to be more humanly written. e.g. changing "user_id" to "the user with the id" or currency codes to "currency"
-                            However, it is crucial to keep it consistent with the output. This includes that you must never change any ID/UUID. 
-                            Only return the value of the "input" of the json object. Respond only with the plain sentence, without quotation marks, formatting, or any extra characters at the beginning or end.
-                            """
-
-                        # Send the prompt to the LLM and receive the rewritten input
-                        rewritten_input = connector.query_without_file(system_prompt, user_prompt)
-
-                        # Replace the original 'input' field with the humanized one
-                        data["input"] = rewritten_input
-
-                        # Prepare the destination folder and file path
-                        updated_subfolder_path = os.path.join(updated_base_path, subfolder)
-                        os.makedirs(updated_subfolder_path, exist_ok=True)
-                        updated_file_path = os.path.join(updated_subfolder_path, file_name)
-
-                        # Write the updated test case JSON
-                        with open(updated_file_path, "w", encoding="utf-8") as updated_file:
-                            json.dump(data, updated_file, indent=4, ensure_ascii=False)
+                        with open(file_path, "rb") as file:
+                            raw = file.read()
+                        raw_hash = content_hash(raw)
+
+                        # Skip test cases that were already humanized from the same content
+                        if not force and manifest.is_current(rel_path, raw_hash, prompt_hash):
+                            skipped += 1
+                            continue
+
+                        data = json.loads(raw.decode("utf-8"))
+                        items.append((subfolder, file_name, file_path, raw_hash, data))
 
                     except Exception as e:
                         # Handle unexpected exceptions and log the error
                         print(f"Error processing file {file_path}: {e}")
 
-def compare_json_files(file1, file2):
-    """
-    Compares two JSON files by loading their content and ignoring the 'input' field.
-
-    Args:
-        file1 (str): Path to the first JSON file.
-        file2 (str): Path to the second JSON file.
-
-    Returns:
-        bool: True if the files match in all fields except 'input', False otherwise.
-    """
-    with open(file1, 'r', encoding='utf-8') as f1, open(file2, 'r', encoding='utf-8') as f2:
-        data1 = json.load(f1)
-        data2 = json.load(f2)
-
-    # Remove the 'input' field from both dictionaries
-    data1.pop("input", None)
-    data2.pop("input", None)
-
-    # Compare remaining fields
-    return data1 == data2
-
-def evaluate_folders(folder1=base_path, folder2=updated_base_path):
+    # Report humanized test cases that no longer have a raw source
+    for rel_path in manifest.stale_outputs(raw_rel_paths):
+        print(f"Stale humanized test case without raw source: {os.path.join(updated_base_path, rel_path)}")
+    print(f"Humanizing {len(items)} new or changed test cases, {skipped} up to date")
+    if not items:
+        manifest.save()
+        return
+
+    connector = OpenAIConnector(max_concurrency=max_concurrency)  # Initialize LLM connector
+    # Send the batches to the LLM, the rewritten inputs are collected below
+    futures = [
+        connector.submit(humanize_batch, connector, batch, system_prompt, batch_system_prompt, model)
+        for batch in build_batches(items, max_items=batch_size, max_tokens=batch_token_budget)
+    ]
+
+    try:
+        for future in as_completed(futures):
+            for (subfolder, file_name, file_path, raw_hash, data), rewritten_input, error in future.result():
+                try:
+                    if error is not None:
+                        raise error
+
+                    # Replace the original 'input' field with the humanized one
+                    data["input"] = rewritten_input
+                    save_humanized_test_case(subfolder, file_name, data)
+                    manifest.record(f"{subfolder}/{file_name}", raw_hash, prompt_hash)
+
+                except Exception as e:
+                    # Handle unexpected exceptions and log the error
+                    print(f"Error processing file {file_path}: {e}")
+    finally:
+        manifest.save()
+        connector.close()
+
+def evaluate_folders(folder1=base_path, folder2=updated_base_path, workers=None):
     """
     Compares all JSON files in folder1 and folder2 to verify whether only the 'input'
-    field has changed. Reports missing files or structural differences.
+    field has changed. Reports missing files, structural differences and
+    humanized files without a raw source.
+
+    The comparison uses canonical hashes cached in a sidecar manifest, so
+    unchanged pairs are not read again (see check_consistency).
 
     Args:
         folder1 (str): Path to the original test cases directory.
         folder2 (str): Path to the updated (humanized) test cases directory.
+        workers (int, optional): Number of worker processes used for hashing.
+
+    Returns:
+        dict: Structured report, also stored in folder2 (see check_consistency).
     """
-    for subdir, _, files in os.walk(folder1):
-        # Compute relative and corresponding path in second folder
-        rel_path = os.path.relpath(subdir, folder1)
-        corresponding_subdir = os.path.join(folder2, rel_path)
-
-        for file in files:
-            if file.endswith('.json'):
-                file1 = os.path.join(subdir, file)
-                file2 = os.path.join(corresponding_subdir, file)
-
-                # Report missing updated test case
-                if not os.path.exists(file2):
-                    print(f"File missing in second folder: {file2}")
-                # Report structural differences beyond the 'input' field
-                elif not compare_json_files(file1, file2):
-                    print(f"Files differ beyond 'input': {file1} vs {file2}")
+    report = check_consistency(folder1, folder2, workers=workers)
+
+    # Report missing updated test cases
+    for rel_path in report["missing"]:
+        print(f"File missing in second folder: {os.path.join(folder2, rel_path)}")
+    # Report structural differences beyond the 'input' field
+    for rel_path in report["differs"]:
+        print(f"Files differ beyond 'input': {os.path.join(folder1, rel_path)} vs {os.path.join(folder2, rel_path)}")
+    for rel_path in report["orphaned"]:
+        print(f"File without raw source: {os.path.join(folder2, rel_path)}")
+    for path in report["unreadable"]:
+        print(f"Unreadable file: {path}")
+    print(
+        f"Checked {report['checked']} test cases ({report['rehashed']} files hashed): {len(report['missing'])} missing, "
+        f"{len(report['differs'])} differ, {len(report['orphaned'])} orphaned"
+    )
+    return report
@@ -1,90 +1,445 @@
 import os
 import json
+import time
+import random
 import requests
 import shutil
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from system_documentation.name_to_url import name_to_url
+from offline_api_validator import OfflineValidator
+from mock_server import point_name_to_url_at
+from run_state import get_run_state
+from metrics import metrics
 
 TESTCASE_FOLDER = "modified_input_testcases/API"
 VALIDATED_FOLDER = "validated_testcases/API"
 
-def execute_test_cases():
-    for subfolder in os.listdir(TESTCASE_FOLDER):
-        subfolder_path = os.path.join(TESTCASE_FOLDER, subfolder)
-        if not os.path.isdir(subfolder_path):
-            continue
+SUPPORTED_METHODS = ("GET", "POST", "PUT", "DELETE", "PATCH")
+# Maximum number of requests in flight in total and per mock host
+MAX_CONCURRENCY = 32
+MAX_PER_HOST = 8
+# Responses and exceptions that are retried instead of being logged as validation failures
+TRANSIENT_STATUS_CODES = (429, 502, 503, 504)
+TRANSIENT_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Consecutive transient failures after which a host's circuit opens, and its cooldown in seconds
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+# How often test cases skipped by an open circuit are queued again
+MAX_REQUEUE_ROUNDS = 3
+# Base URL of a local mock server (see mock_server.py) replacing all hosts of name_to_url, if set
+MOCK_SERVER_URL = os.getenv("mock_server_url")
+# Handling of test cases failing the offline check against the API documentation:
+# "off" skips the check, "report" logs the findings but still sends the request,
+# "enforce" marks them as failed without sending them
+OFFLINE_MODES = ("off", "report", "enforce")
+OFFLINE_MODE = "report"
 
+def create_session(pool_size):
+    """
+    Creates a keep-alive session whose connection pool holds pool_size connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of sending a request to a host whose circuit is open.
+    """
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    After threshold consecutive transient failures the circuit opens and no
+    requests are let through for cooldown seconds. Afterwards a single probe
+    request is allowed (half-open); its success closes the circuit, its
+    failure opens it for another cooldown. A probe ending in any other
+    exception only gives up the probe (see release), so the next request
+    probes again.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns whether a request may be sent now.
+        """
+        with self._lock:
+            if self.failures < self.threshold:
+                return True
+            if time.monotonic() < self.open_until or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """
+        Ends a request that neither succeeded nor failed transiently without changing the circuit's state.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+
+    def remaining_cooldown(self):
+        with self._lock:
+            return max(0.0, self.open_until - time.monotonic()) if self.failures >= self.threshold else 0.0
+
+class HostConnections:
+    """
+    Keep-alive session, concurrency slot and circuit breaker of every base URL, created on first use.
+    """
+
+    def __init__(self, max_per_host=MAX_PER_HOST):
+        self.max_per_host = max_per_host
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url):
+        """
+        Returns (session, host_limit, breaker) of base_url.
+        """
+        with self._lock:
+            if base_url not in self._hosts:
+                self._hosts[base_url] = (
+                    create_session(self.max_per_host),
+                    threading.BoundedSemaphore(self.max_per_host),
+                    CircuitBreaker()
+                )
+            return self._hosts[base_url]
+
+    def breaker(self, base_url):
+        return self.get(base_url)[2]
+
+    def close(self):
+        with self._lock:
+            for session, _, _ in self._hosts.values():
+                session.close()
+            self._hosts.clear()
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Returns the number of seconds to wait before retry number attempt (starting at 0).
+
+    A Retry-After header (seconds or HTTP date) is honored; otherwise the delay
+    is drawn uniformly up to an exponentially growing cap ("full jitter").
+    """
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                return min(BACKOFF_MAX, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def is_transient(response=None, error=None):
+    """
+    Returns whether a response or exception is a transient failure rather than a validation result.
+    """
+    if error is not None:
+        return isinstance(error, TRANSIENT_EXCEPTIONS + (CircuitOpenError,))
+    return response is not None and response.status_code in TRANSIENT_STATUS_CODES
+
+def send_request(session, host_limit, breaker, method, url, body, max_retries=MAX_RETRIES):
+    """
+    Sends one test case request on the host's session while holding the host's concurrency slot.
+
+    Transient failures are retried up to max_retries times with backoff (see
+    retry_delay); the wait happens outside the concurrency slot. The last
+    transient response is returned, or the last transient exception raised,
+    once the retries are used up.
+
+    Raises:
+        CircuitOpenError: If the host's circuit is open.
+    """
+    host = urlsplit(url).netloc
+    for attempt in range(max_retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {url}")
+        retry_after = None
+        try:
+            with host_limit:
+                with metrics.timer("http_request_seconds", host=host, method=method.upper()):
+                    response = session.request(method.upper(), url, json=body, timeout=REQUEST_TIMEOUT)
+        except TRANSIENT_EXCEPTIONS as e:
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            reason = type(e).__name__
+        except Exception:
+            # E.g. a broken response body or a redirect loop: no verdict on the host, but a probe must not stay pending
+            breaker.release()
+            raise
+        else:
+            if response.status_code not in TRANSIENT_STATUS_CODES:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt == max_retries:
+                return response
+            retry_after = response.headers.get("Retry-After")
+            reason = str(response.status_code)
+            response.close()
+        metrics.count("http_retries_total", host=host, reason=reason)
+        time.sleep(retry_delay(attempt, retry_after))
+
+def write_test_case(file_path, test_case):
+    """
+    Rewrites a test case file in place. A file deleted in the meantime is not recreated.
+    """
+    if not os.path.exists(file_path):
+        print(f"Not writing removed test case {file_path}")
+        return
+    with open(file_path, "w") as file:
+        json.dump(test_case, file, indent=2)
+
+def mark_validated(subfolder, file_name, file_path, test_case):
+    """
+    Moves a successful test case to VALIDATED_FOLDER, dropping an error log of an earlier run.
+    """
+    get_run_state().record("API", subfolder, file_name, "validated", test_case, attempt=True)
+    # Remove error logs if present
+    if "error_log" in test_case or "transient_error_log" in test_case:
+        test_case.pop("error_log", None)
+        test_case.pop("transient_error_log", None)
+        write_test_case(file_path, test_case)
+    verified_subfolder = os.path.join(VALIDATED_FOLDER, subfolder)
+    os.makedirs(verified_subfolder, exist_ok=True)
+    if os.path.exists(file_path):
+        shutil.move(file_path, os.path.join(verified_subfolder, file_name))
+    else:
+        print(f"Not moving removed test case {file_path}")
+
+def record_result(subfolder, file_name, file_path, test_case, method, url, response=None, error=None, offline_errors=None):
+    """
+    Writes the outcome of a test case: successful ones are moved to VALIDATED_FOLDER,
+    failed ones get an error_log in place. Transient failures (see is_transient)
+    get a transient_error_log instead and stay untouched otherwise, so they are
+    simply executed again by the next run. The outcome is recorded in the run state.
+
+    Returns:
+        str: "validated", "failed" or "transient".
+    """
+    if is_transient(response, error):
+        reason = str(error) if error is not None else f"status code {response.status_code}"
+        print(f"Transient failure for {file_path}: {reason}")
+        test_case["transient_error_log"] = {
+            "reason": reason
+        }
+        write_test_case(file_path, test_case)
+        get_run_state().record("API", subfolder, file_name, "transient", test_case, error=test_case["transient_error_log"], attempt=True)
+        return "transient"
+
+    test_case.pop("transient_error_log", None)
+    if offline_errors:
+        print(f"Offline validation failed for {file_path}: {offline_errors[0]}")
+        test_case["error_log"] = {
+            "offline_errors": offline_errors
+        }
+        write_test_case(file_path, test_case)
+        get_run_state().record("API", subfolder, file_name, "failed", test_case, error=test_case["error_log"], attempt=True)
+        return "failed"
+
+    if error is not None:
+        print(f"Error with {file_path}: {error}")
+        test_case["error_log"] = {
+            "exception": str(error)
+        }
+        write_test_case(file_path, test_case)
+        get_run_state().record("API", subfolder, file_name, "failed", test_case, error=test_case["error_log"], attempt=True)
+        return "failed"
+
+    print(f"Executed {method} {url}: {response.status_code}")
+
+    if response.status_code in (200, 201, 204):
+        mark_validated(subfolder, file_name, file_path, test_case)
+        return "validated"
+    else:
+        # Log error in the test case file
+        try:
+            response_json = response.json()
+            formatted_response = json.dumps(response_json, indent=2, ensure_ascii=False)
+        except Exception:
+            formatted_response = response.text
+        test_case["error_log"] = {
+            "status_code": response.status_code,
+            "response_text": formatted_response
+        }
+        write_test_case(file_path, test_case)
+        get_run_state().record(
+            "API", subfolder, file_name, "failed", test_case,
+            error=test_case["error_log"], duration=response.elapsed.total_seconds(), attempt=True
+        )
+        return "failed"
+
+def report_offline_findings(file_path, offline_errors):
+    """
+    Logs the offline findings of a test case that is sent anyway (offline mode "report").
+    """
+    print(f"Offline check reported {len(offline_errors)} finding(s) for {file_path}, sending anyway: {offline_errors[0]}")
+    metrics.count("offline_findings_total")
+
+def execute_test_case(subfolder, file_name, file_path, test_case, hosts, offline_validator=None, max_retries=MAX_RETRIES,
+                      enforce_offline=False, network=True, requeue=False):
+    """
+    Checks and executes a single test case and records its result (see record_result).
+
+    Used for every test case by execute_test_cases and by the streaming
+    pipeline. Offline findings only fail the test case with enforce_offline,
+    otherwise they are reported and the request is sent. With network
+    disabled, test cases passing the offline check are validated without a
+    request. With requeue, a test case whose host circuit is open is not
+    recorded but returned as "requeue", so the caller can send it again later.
+
+    Returns:
+        str: "validated", "failed", "transient" or "requeue".
+    """
+    try:
+        method = test_case["output"]["method"]
         base_url = name_to_url.get(subfolder)
-        if not base_url:
-            print(f"Base URL not found for subfolder: {subfolder}")
-            continue
+        url = f"{base_url}{test_case['output']['endpoint']}"
+    except Exception as e:
+        return record_result(subfolder, file_name, file_path, test_case, None, None, error=e)
+    if str(method).upper() not in SUPPORTED_METHODS:
+        return record_result(subfolder, file_name, file_path, test_case, method, url, error=ValueError(f"Unsupported method: {method}"))
+    if offline_validator is not None:
+        is_valid, offline_errors = offline_validator.validate(subfolder, test_case["output"])
+        if not is_valid and enforce_offline:
+            return record_result(subfolder, file_name, file_path, test_case, method, url, offline_errors=offline_errors)
+        if not is_valid:
+            report_offline_findings(file_path, offline_errors)
+    if not network:
+        mark_validated(subfolder, file_name, file_path, test_case)
+        return "validated"
+    if not base_url:
+        return record_result(subfolder, file_name, file_path, test_case, method, url, error=ValueError(f"Base URL not found for subfolder: {subfolder}"))
+    try:
+        response, error = send_request(*hosts.get(base_url), method, url, test_case["output"].get("body", None), max_retries), None
+    except CircuitOpenError as e:
+        if requeue:
+            return "requeue"
+        response, error = None, e
+    except Exception as e:
+        response, error = None, e
+    return record_result(subfolder, file_name, file_path, test_case, method, url, response=response, error=error)
 
-        for file_name in os.listdir(subfolder_path):
-            if file_name.endswith(".json"):
-                file_path = os.path.join(subfolder_path, file_name)
-                try:
-                    with open(file_path, "r") as file:
-                        test_case = json.load(file)
-                    method = test_case["output"]["method"]
-                    endpoint = test_case["output"]["endpoint"]
-                    body = test_case["output"].get("body", None)
-                    url = f"{base_url}{endpoint}"
-
-                    if method.upper() == "GET":
-                        response = requests.get(url, json=body)
-                    elif method.upper() == "POST":
-                        response = requests.post(url, json=body)
-                    elif method.upper() == "PUT":
-                        response = requests.put(url, json=body)
-                    elif method.upper() == "DELETE":
-                        response = requests.delete(url, json=body)
-                    elif method.upper() == "PATCH":
-                        response = requests.patch(url, json=body)
-                    else:
-                        print(f"Unsupported method: {method}")
-                        continue
-
-                    print(f"Executed {method} {url}: {response.status_code}")
-
-                    if response.status_code in (200, 201, 204):
-                        # Remove error log if present
-                        if "error_log" in test_case:
-                            del test_case["error_log"]
-                            with open(file_path, "w") as file:
-                                json.dump(test_case, file, indent=2)
-                        verified_subfolder = os.path.join(VALIDATED_FOLDER, subfolder)
-                        os.makedirs(verified_subfolder, exist_ok=True)
-                        shutil.move(file_path, os.path.join(verified_subfolder, file_name))
-                    else:
-                        # Log error in the test case file
-                        try:
-                            response_json = response.json()
-                            formatted_response = json.dumps(response_json, indent=2, ensure_ascii=False)
-                        except Exception:
-                            formatted_response = response.text
-                        test_case["error_log"] = {
-                            "status_code": response.status_code,
-                            "response_text": formatted_response
-                        }
-                        with open(file_path, "w") as file:
-                            json.dump(test_case, file, indent=2)
+def execute_test_cases(max_concurrency=MAX_CONCURRENCY, max_per_host=MAX_PER_HOST, offline=OFFLINE_MODE, network=True,
+                       mock_server_url=MOCK_SERVER_URL, max_retries=MAX_RETRIES):
+    """
+    Executes all API test cases against the mock host of their business entity.
+
+    The test cases to execute are the ones the run state lists as humanized,
+    failed or transient (see RunStateStore). The folders are synced into the
+    run state first (see RunStateStore.sync_folders), so test cases written by
+    earlier runs and hand edits in TESTCASE_FOLDER are picked up.
+
+    Unless offline is "off", every test case is first checked locally against
+    the API documentation (path, method and request body schema, see
+    OfflineValidator). With "report" (the default) the findings are only
+    logged and the request is sent anyway, since the documentation is
+    stricter than the hosts (e.g. for $batch bodies); with "enforce" test
+    cases failing the check get an error_log and are not sent. The network
+    call is the second tier: with network disabled, the offline check is
+    enforced and test cases passing it are validated without any request.
+
+    Every test case runs through execute_test_case. Every base URL in
+    name_to_url gets one keep-alive session that is reused for all of its test
+    cases. Test cases run concurrently, limited to max_concurrency in total and
+    max_per_host requests per base URL, and each result is written back as
+    soon as its response arrives.
+
+    Transient failures (429/502/503/504, connection errors and timeouts) are
+    retried with backoff and never count as validation failures. Every base URL
+    has a CircuitBreaker: while it is open, the remaining test cases of that
+    host are not sent but queued again once its cooldown has passed, up to
+    MAX_REQUEUE_ROUNDS times. Test cases that still fail transiently get a
+    transient_error_log and stay in TESTCASE_FOLDER for the next run.
 
+    With mock_server_url (default: the mock_server_url environment variable),
+    name_to_url is rewritten to send every request to that local mock server.
+
+    Returns:
+        Counter: Number of test cases per outcome ("validated", "failed", "transient").
+    """
+    if offline not in OFFLINE_MODES:
+        raise ValueError(f"Unknown offline mode {offline!r}, expected one of {OFFLINE_MODES}")
+    if mock_server_url:
+        point_name_to_url_at(mock_server_url, name_to_url)
+    enforce_offline = offline == "enforce" or not network
+    offline_validator = OfflineValidator() if offline != "off" or not network else None
+    outcomes = Counter()
+    hosts = HostConnections(max_per_host)
+    run_state = get_run_state()
+    run_state.sync_folders("API")
+    # Test cases that are not validated yet, straight from the run state
+    pending = [
+        (subfolder, file_name, os.path.join(TESTCASE_FOLDER, subfolder, file_name), test_case)
+        for subfolder, file_name, test_case in run_state.test_cases("API")
+    ]
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for round_number in range(MAX_REQUEUE_ROUNDS + 1):
+            if not pending:
+                break
+            if round_number > 0:
+                wait = max(hosts.breaker(name_to_url[entry[0]]).remaining_cooldown() for entry in pending)
+                print(f"Re-queuing {len(pending)} test cases after {wait:.1f}s (round {round_number})")
+                time.sleep(wait)
+
+            requeue = round_number < MAX_REQUEUE_ROUNDS
+            futures = {
+                executor.submit(
+                    execute_test_case, *entry, hosts, offline_validator, max_retries, enforce_offline, network, requeue
+                ): entry
+                for entry in pending
+            }
+            pending = []
+
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    outcome = future.result()
                 except Exception as e:
-                    print(f"Error with {file_path}: {e}")
-                    # Log exception in the test case file
-                    try:
-                        with open(file_path, "r") as file:
-                            test_case = json.load(file)
-                        test_case["error_log"] = {
-                            "exception": str(e)
-                        }
-                        with open(file_path, "w") as file:
-                            json.dump(test_case, file, indent=2)
-                    except Exception as inner_e:
-                        print(f"Failed to log error in {file_path}: {inner_e}")
+                    print(f"Failed to log result in {entry[2]}: {e}")
+                    continue
+                if outcome == "requeue":
+                    pending.append(entry)
+                else:
+                    outcomes[outcome] += 1
+
+    hosts.close()
+    print(f"Validated: {outcomes['validated']}, failed: {outcomes['failed']}, transient: {outcomes['transient']}")
+    return outcomes
 
 def count_remaining_files():
-    for subfolder in os.listdir(TESTCASE_FOLDER):
-        path = os.path.join(TESTCASE_FOLDER, subfolder)
-        if os.path.isdir(path):
-            count = len([f for f in os.listdir(path) if f.endswith(".json")])
-            print(f"{subfolder}: {count} remaining files")
+    for subfolder, count in get_run_state().counts_by_domain("API").items():
+        print(f"{subfolder}: {count} remaining files")
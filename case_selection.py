@@ -0,0 +1,118 @@
+import re
+from collections import Counter, defaultdict
+
+from domain_test_case_store import minhasher
+from similarity import shingles, estimate_containment
+
+# Default number of prompt tokens reserved for previously generated test cases
+DEFAULT_TOKEN_BUDGET = 4000
+# Default maximum number of test cases quoted in full
+DEFAULT_TOP_K = 20
+# Maximum number of lines of the digest of the remaining test cases
+MAX_DIGEST_LINES = 40
+
+def estimate_tokens(text):
+    """
+    Rough token estimate (about four characters per token).
+    """
+    return len(text) // 4 + 1
+
+def digest_key(test_case):
+    """
+    Groups test cases for the digest: API calls by method and endpoint, SQL queries by the tables they read.
+    """
+    output = test_case.get("output", {}) if isinstance(test_case, dict) else {}
+    if not isinstance(output, dict):
+        return "other"
+    if "method" in output or "endpoint" in output:
+        return f"{str(output.get('method', '')).upper()} {output.get('endpoint', '')}".strip()
+    if "sql" in output:
+        tables = sorted(set(re.findall(r'\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)', str(output["sql"]), re.IGNORECASE)))
+        return f"SQL on {', '.join(tables)}" if tables else "SQL"
+    return "other"
+
+def build_digest(test_cases):
+    """
+    Summarizes test cases as one line per group with the number of cases per difficulty.
+    """
+    groups = defaultdict(Counter)
+    for test_case in test_cases:
+        difficulty = test_case.get("difficulty", "Unknown") if isinstance(test_case, dict) else "Unknown"
+        groups[digest_key(test_case)][difficulty] += 1
+
+    lines = []
+    ordered = sorted(groups.items(), key=lambda item: (-sum(item[1].values()), item[0]))
+    for key, difficulties in ordered[:MAX_DIGEST_LINES]:
+        counts = ", ".join(f"{difficulty} {count}" for difficulty, count in sorted(difficulties.items()))
+        lines.append(f"- {key}: {sum(difficulties.values())} ({counts})")
+    if len(ordered) > MAX_DIGEST_LINES:
+        lines.append(f"- ... and {len(ordered) - MAX_DIGEST_LINES} more groups")
+    return "\n".join(lines)
+
+def select_previous_cases(store, focus_text, token_budget=DEFAULT_TOKEN_BUDGET, top_k=DEFAULT_TOP_K, compact=False):
+    """
+    Renders the previously generated test cases of a domain for a prompt within a fixed token budget.
+
+    The test cases most similar to the focus (estimated by MinHash containment
+    of the focus text's character shingles) are quoted in full as a JSON array,
+    as long as they fit the budget and top_k is not exceeded. All remaining test
+    cases are summarized in a compact digest, so the prompt size stays flat no
+    matter how many test cases the domain already has.
+
+    Args:
+        store (DomainTestCaseStore): Previously generated test cases of the domain.
+        focus_text (str): Text describing the focus, e.g. "POST /BankAccounts" or the domain's tables.
+        token_budget (int): Approximate number of tokens available for the rendered cases.
+        top_k (int): Maximum number of test cases quoted in full.
+        compact (bool): Render the cases as minified JSON records, one per line, instead of an indented array.
+
+    Returns:
+        str: JSON array (compact: JSON lines) of the selected test cases, followed by the digest if cases were left out.
+    """
+    if len(store) == 0:
+        return "[]"
+    if compact:
+        serialized = store.compact_serialized
+        def render(indexes):
+            return "\n".join(serialized(index) for index in indexes) if indexes else "[]"
+    else:
+        serialized = store.serialized
+        def render(indexes):
+            return "[\n" + ",\n".join(serialized(index) for index in indexes) + "\n]" if indexes else "[]"
+    everything = store.to_compact_json() if compact else store.to_json()
+    if estimate_tokens(everything) <= token_budget:
+        return everything
+
+    focus_shingles = shingles(focus_text)
+    focus_signature = minhasher.signature(focus_shingles)
+    scored = []
+    for index in range(len(store)):
+        signature, size = store.sketch(index)
+        score = estimate_containment(focus_signature, len(focus_shingles), signature, size)
+        # Later test cases win ties so the most recent context is preferred
+        scored.append((score, index))
+    scored.sort(reverse=True)
+
+    # Keep a share of the budget for the digest of the left-out test cases
+    remaining = token_budget - min(token_budget // 4, MAX_DIGEST_LINES * 20)
+    selected = []
+    for _, index in scored:
+        if len(selected) >= top_k:
+            break
+        tokens = estimate_tokens(serialized(index))
+        if tokens > remaining:
+            continue
+        selected.append(index)
+        remaining -= tokens
+
+    selected.sort()
+    selected_set = set(selected)
+    rendered = render(selected)
+    left_out = [store.cases[index] for index in range(len(store)) if index not in selected_set]
+    if not left_out:
+        return rendered
+    return (
+        f"{rendered}\n\n"
+        f"Digest of {len(left_out)} further previously generated test cases (avoid repeating these as well):\n"
+        f"{build_digest(left_out)}"
+    )
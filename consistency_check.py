@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+# Sidecar files stored at the root of the humanized output folder
+MANIFEST_FILE_NAME = ".consistency_manifest.json"
+REPORT_FILE_NAME = ".consistency_report.json"
+
+# Fields that may legitimately differ between a raw and a humanized test case:
+# the rewritten input and the logs the validators add
+IGNORED_FIELDS = ("input", "error_log", "transient_error_log")
+
+def canonical_hash(test_case):
+    """
+    Returns the SHA-256 hex digest of a test case without its IGNORED_FIELDS,
+    serialized with sorted keys so formatting and key order do not matter.
+    """
+    if isinstance(test_case, dict):
+        test_case = {key: value for key, value in test_case.items() if key not in IGNORED_FIELDS}
+    serialized = json.dumps(test_case, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+def _hash_file(path):
+    try:
+        with open(path, "rb") as f:
+            return canonical_hash(json.loads(f.read().decode("utf-8")))
+    except (OSError, ValueError):
+        return None
+
+def _hash_files(paths):
+    return [_hash_file(path) for path in paths]
+
+def scan_json_files(folder):
+    """
+    Returns {relative path: (mtime_ns, size)} of all JSON files below folder, skipping sidecar files.
+    """
+    files = {}
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            entries = os.scandir(os.path.join(folder, rel_dir))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir():
+                    pending.append(rel_path)
+                elif entry.name.endswith(".json") and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    files[rel_path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def _load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def check_consistency(folder1, folder2, workers=None, chunk_size=256):
+    """
+    Checks that every humanized test case in folder2 equals its raw source in folder1 apart from IGNORED_FIELDS.
+
+    Both trees are compared by canonical hashes. The hashes are kept in a
+    sidecar manifest in folder2 together with each file's modification time
+    and size, so only new or changed files are read again. Files to hash are
+    spread in chunks over a pool of worker processes (workers defaults to the
+    CPU count; with one worker or few files everything runs in this process).
+
+    The report is also written to folder2 as REPORT_FILE_NAME.
+
+    Returns:
+        dict: {"checked", "rehashed", "missing", "differs", "orphaned", "unreadable"} where
+        missing lists raw test cases without a humanized version, differs pairs whose
+        hashes differ, orphaned humanized test cases without a raw source and unreadable
+        files that could not be parsed; all as sorted relative paths.
+    """
+    manifest_path = os.path.join(folder2, MANIFEST_FILE_NAME)
+    manifest = _load_manifest(manifest_path)
+    trees = {"source": (folder1, scan_json_files(folder1)), "target": (folder2, scan_json_files(folder2))}
+
+    # Reuse the hashes of files whose modification time and size did not change
+    hashes = {}
+    to_hash = []
+    for side, (folder, files) in trees.items():
+        known = manifest.get(side, {})
+        hashes[side] = {}
+        for rel_path, stat in files.items():
+            entry = known.get(rel_path)
+            if entry is not None and tuple(entry[:2]) == stat:
+                hashes[side][rel_path] = entry[2]
+            else:
+                to_hash.append((side, rel_path, os.path.join(folder, rel_path)))
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(to_hash) <= chunk_size:
+        results = _hash_files([path for _, _, path in to_hash])
+    else:
+        chunks = [to_hash[i:i + chunk_size] for i in range(0, len(to_hash), chunk_size)]
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_results in executor.map(_hash_files, [[path for _, _, path in chunk] for chunk in chunks]):
+                results.extend(chunk_results)
+    for (side, rel_path, _), file_hash in zip(to_hash, results):
+        hashes[side][rel_path] = file_hash
+
+    source, target = hashes["source"], hashes["target"]
+    report = {
+        "checked": len(source),
+        "rehashed": len(to_hash),
+        "missing": sorted(rel_path for rel_path in source if rel_path not in target),
+        "differs": sorted(
+            rel_path for rel_path in source
+            if rel_path in target and None not in (source[rel_path], target[rel_path]) and source[rel_path] != target[rel_path]
+        ),
+        "orphaned": sorted(rel_path for rel_path in target if rel_path not in source),
+        "unreadable": sorted(
+            os.path.join(trees[side][0], rel_path) for side in hashes for rel_path, file_hash in hashes[side].items() if file_hash is None
+        ),
+    }
+
+    os.makedirs(folder2, exist_ok=True)
+    _write_json(manifest_path, {
+        side: {rel_path: [*trees[side][1][rel_path], file_hash] for rel_path, file_hash in side_hashes.items() if file_hash is not None}
+        for side, side_hashes in hashes.items()
+    })
+    _write_json(os.path.join(folder2, REPORT_FILE_NAME), report)
+    return report
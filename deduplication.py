@@ -0,0 +1,129 @@
+import re
+import json
+import hashlib
+import threading
+from collections import defaultdict
+
+from similarity import MinHasher, shingles, estimate_jaccard
+
+# What happens to near-duplicates: dropped before writing, written with a marker, or ignored
+DEDUP_MODES = ("drop", "flag", "off")
+
+# Inputs at or above this estimated Jaccard similarity count as near-duplicates
+DEFAULT_INPUT_THRESHOLD = 0.85
+
+# LSH layout: 64 signature positions split into 16 bands of 4 rows. Pairs above
+# roughly 0.5 similarity share a band with high probability, so candidates for
+# the 0.85 threshold are almost never missed while unrelated cases never meet.
+NUM_PERM = 64
+LSH_BANDS = 16
+
+_SQL_TOKEN = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|\w+|[^\s\w]")
+
+def normalize_sql(sql):
+    """
+    Normalizes an SQL query into a token stream that ignores case, whitespace,
+    identifier quoting and a trailing semicolon, while string literals keep their case.
+    """
+    tokens = []
+    for token in _SQL_TOKEN.findall(sql.strip().rstrip(";")):
+        if token.startswith("'"):
+            tokens.append(token)
+        elif token.startswith('"'):
+            tokens.append(token.strip('"').lower())
+        else:
+            tokens.append(token.lower())
+    return " ".join(tokens)
+
+def canonical_output(output):
+    """
+    Returns a canonical string of a test case output: the normalized token
+    stream for SQL and method, endpoint and key-sorted body for API calls.
+    """
+    if isinstance(output, dict) and "sql" in output:
+        return "sql:" + normalize_sql(str(output["sql"]))
+    if isinstance(output, dict) and ("method" in output or "endpoint" in output):
+        return "api:" + json.dumps(
+            {
+                "method": str(output.get("method", "")).upper(),
+                "endpoint": str(output.get("endpoint", "")).rstrip("/"),
+                "body": output.get("body"),
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False
+        )
+    return "raw:" + json.dumps(output, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+class DuplicateIndex:
+    """
+    Detects near-duplicate test cases of one domain.
+
+    A test case is a duplicate if its canonical output equals that of an indexed
+    case, or if its input is a near-duplicate of an indexed input. Outputs are
+    looked up by hash, inputs by locality-sensitive hashing on MinHash
+    signatures, so checking a case only touches the few candidates sharing an
+    LSH band instead of every indexed case.
+    """
+
+    def __init__(self, input_threshold=DEFAULT_INPUT_THRESHOLD):
+        self.input_threshold = input_threshold
+        self._minhasher = MinHasher(num_perm=NUM_PERM, seed=7)
+        self._rows = NUM_PERM // LSH_BANDS
+        self._output_hashes = {}
+        self._signatures = {}
+        self._buckets = [defaultdict(list) for _ in range(LSH_BANDS)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_cases(cls, test_cases, file_names=None, **kwargs):
+        """
+        Builds an index over already existing test cases, keyed by their file names
+        (e.g. DomainTestCaseStore.file_names) or, without them, by their position.
+        """
+        index = cls(**kwargs)
+        for position, test_case in enumerate(test_cases):
+            index.add(test_case, file_names[position] if file_names is not None else f"existing #{position + 1}")
+        return index
+
+    def _fingerprint(self, test_case):
+        output_hash = hashlib.sha256(canonical_output(test_case.get("output")).encode("utf-8")).hexdigest()
+        signature = self._minhasher.signature(shingles(str(test_case.get("input", ""))))
+        return output_hash, signature
+
+    def _bands(self, signature):
+        return [tuple(signature[band * self._rows:(band + 1) * self._rows]) for band in range(LSH_BANDS)]
+
+    def check(self, test_case):
+        """
+        Returns (reason, key) of the indexed case test_case duplicates, or None.
+        """
+        output_hash, signature = self._fingerprint(test_case)
+        with self._lock:
+            if output_hash in self._output_hashes:
+                return "identical output", self._output_hashes[output_hash]
+            candidates = set()
+            for band, bucket in zip(self._bands(signature), self._buckets):
+                candidates.update(bucket.get(band, ()))
+            best = None
+            for key in candidates:
+                similarity = estimate_jaccard(signature, self._signatures[key])
+                if similarity >= self.input_threshold and (best is None or similarity > best[0]):
+                    best = (similarity, key)
+        if best is not None:
+            return f"near-duplicate input ({best[0]:.2f})", best[1]
+        return None
+
+    def add(self, test_case, key):
+        """
+        Indexes a test case under key (e.g. its file name).
+        """
+        output_hash, signature = self._fingerprint(test_case)
+        with self._lock:
+            self._output_hashes.setdefault(output_hash, key)
+            self._signatures[key] = signature
+            for band, bucket in zip(self._bands(signature), self._buckets):
+                bucket[band].append(key)
+
+    def __len__(self):
+        return len(self._signatures)
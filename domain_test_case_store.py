@@ -0,0 +1,141 @@
+import os
+import json
+import textwrap
+import threading
+
+from similarity import MinHasher, shingles
+
+# Shared so that signatures of all stores are comparable
+minhasher = MinHasher()
+
+def load_test_cases(output_dir):
+    """
+    Loads all previously generated test cases from a directory.
+
+    Args:
+        output_dir (str): Path to the directory containing test case JSON files.
+
+    Returns:
+        list: A list of (file name, test case) tuples; the cases of a file holding
+        a JSON array are named "<file name>[<position>]".
+    """
+    test_cases = []
+    if os.path.exists(output_dir):
+        for file in sorted(os.listdir(output_dir)):
+            if file.endswith(".json"):
+                try:
+                    with open(os.path.join(output_dir, file), 'r') as f:
+                        test_case = json.load(f)
+                        if isinstance(test_case, list):
+                            test_cases.extend((f"{file}[{position}]", case) for position, case in enumerate(test_case))
+                        else:
+                            test_cases.append((file, test_case))
+                except Exception:
+                    continue
+    return test_cases
+
+class DomainTestCaseStore:
+    """
+    In-memory index of the test cases generated for one business domain.
+
+    The domain folder is read once on creation; afterwards new test cases are
+    appended with add() as they are written, so repeated prompts for the same
+    domain never rescan the directory. Every test case is serialized only once
+    per format (indented, and minified on first use) and the JSON dumps used in
+    prompts are assembled from these pieces. file_names holds the file name of
+    every test case, in the same order as cases.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.cases = []
+        self.file_names = []
+        self._chunks = []
+        self._serialized = None
+        self._compact_chunks = []
+        self._compact_serialized = None
+        self._sketches = []
+        self._lock = threading.Lock()
+        for file_name, test_case in load_test_cases(output_dir):
+            self._append(test_case, file_name)
+
+    def _append(self, test_case, file_name):
+        self.cases.append(test_case)
+        self.file_names.append(file_name)
+        # Indent by one level so the chunks join into the same output as json.dumps(cases, indent=2)
+        self._chunks.append(textwrap.indent(json.dumps(test_case, indent=2), "  "))
+        self._compact_chunks.append(None)
+        self._sketches.append(None)
+        self._serialized = None
+        self._compact_serialized = None
+
+    def add(self, test_case, file_name):
+        """
+        Adds a newly written test case to the index.
+        """
+        with self._lock:
+            self._append(test_case, file_name)
+
+    def to_json(self):
+        """
+        Returns all test cases as a JSON array, formatted like json.dumps(cases, indent=2).
+        """
+        with self._lock:
+            if self._serialized is None:
+                self._serialized = "[\n" + ",\n".join(self._chunks) + "\n]" if self._chunks else "[]"
+            return self._serialized
+
+    def serialized(self, index):
+        """
+        Returns the cached JSON of a single test case, indented as an array element.
+        """
+        return self._chunks[index]
+
+    def compact_serialized(self, index):
+        """
+        Returns the cached minified JSON of a single test case, computed on first use.
+        """
+        chunk = self._compact_chunks[index]
+        if chunk is None:
+            chunk = json.dumps(self.cases[index], ensure_ascii=False, separators=(",", ":"))
+            self._compact_chunks[index] = chunk
+        return chunk
+
+    def to_compact_json(self):
+        """
+        Returns all test cases as minified JSON records, one per line.
+        """
+        with self._lock:
+            count = len(self.cases)
+            if self._compact_serialized is not None:
+                return self._compact_serialized
+        serialized = "\n".join(self.compact_serialized(index) for index in range(count)) if count else "[]"
+        with self._lock:
+            if len(self.cases) == count:
+                self._compact_serialized = serialized
+        return serialized
+
+    def sketch(self, index):
+        """
+        Returns the MinHash signature and shingle count of a test case, computed on first use.
+        """
+        with self._lock:
+            sketch = self._sketches[index]
+        if sketch is None:
+            shingle_set = shingles(case_text(self.cases[index]))
+            sketch = (minhasher.signature(shingle_set), len(shingle_set))
+            with self._lock:
+                self._sketches[index] = sketch
+        return sketch
+
+    def __len__(self):
+        return len(self.cases)
+
+def case_text(test_case):
+    """
+    Text a test case is compared by: its expected output followed by its input.
+    """
+    if not isinstance(test_case, dict):
+        return json.dumps(test_case, sort_keys=True)
+    output = json.dumps(test_case.get("output", ""), sort_keys=True, ensure_ascii=False)
+    return f"{output} {test_case.get('input', '')}"
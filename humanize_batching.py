@@ -0,0 +1,122 @@
+import json
+import re
+
+# Response format used when several test cases are rewritten in one request
+batch_response_format = """
+    You will receive a JSON object that maps test case ids to test cases. Rewrite the input of every test case.
+    Return a JSON object that maps every received id to the rewritten input as a plain string, e.g. {"1": "...", "2": "..."}.
+    Never skip, merge or add ids. Respond only with the JSON object, without markdown formatting or any extra text.
+"""
+
+def estimate_tokens(text):
+    """
+    Rough token estimate (about four characters per token) used for batch budgeting.
+    """
+    return len(text) // 4 + 1
+
+def build_batches(items, max_items=20, max_tokens=6000):
+    """
+    Groups test cases into batches limited by count and by estimated prompt tokens.
+
+    Args:
+        items (list): Tuples whose last element is the test case dict.
+        max_items (int): Maximum number of test cases per batch.
+        max_tokens (int): Token budget for the serialized test cases of one batch.
+
+    Returns:
+        list: List of batches, each a list of items. A test case that exceeds the
+        token budget on its own forms a batch by itself.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for item in items:
+        tokens = estimate_tokens(json.dumps(item[-1], ensure_ascii=False))
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def build_batch_prompt(test_cases):
+    """
+    Serializes a batch of test cases into the keyed user prompt ("1", "2", ...).
+    """
+    return json.dumps({str(i): case for i, case in enumerate(test_cases, start=1)}, ensure_ascii=False)
+
+def parse_batch_response(text, count):
+    """
+    Extracts the rewritten inputs from a batch response.
+
+    Args:
+        text (str): Raw LLM response.
+        count (int): Number of test cases sent in the batch.
+
+    Returns:
+        dict: Mapping of the zero-based position in the batch to the rewritten input.
+        Positions that are missing or not a non-empty string are left out so the
+        caller can retry them individually.
+    """
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        match = re.search(r'\{.*\}', text, re.DOTALL)
+        if not match:
+            return {}
+        try:
+            parsed = json.loads(match.group())
+        except json.JSONDecodeError:
+            return {}
+    if not isinstance(parsed, dict):
+        return {}
+
+    rewritten = {}
+    for i in range(count):
+        value = parsed.get(str(i + 1))
+        if isinstance(value, str) and value.strip():
+            rewritten[i] = value.strip()
+    return rewritten
+
+def humanize_batch(connector, batch, system_prompt, batch_system_prompt, model="gpt-4o-mini"):
+    """
+    Rewrites the inputs of a batch of test cases with a single request and falls back
+    to one request per test case for entries the batch response did not cover.
+
+    Args:
+        connector (OpenAIConnector): Connector used for the requests.
+        batch (list): Items whose last element is the test case dict.
+        system_prompt (str): Prompt for rewriting a single test case.
+        batch_system_prompt (str): Prompt for rewriting a keyed batch of test cases.
+        model (str): Model used for all requests.
+
+    Returns:
+        list: One (item, rewritten_input, error) tuple per item of the batch.
+    """
+    test_cases = [item[-1] for item in batch]
+    rewritten = {}
+    if len(batch) > 1:
+        try:
+            batch_prompt = build_batch_prompt(test_cases)
+            response = connector.query_without_file(batch_system_prompt, batch_prompt, model=model)
+            rewritten = parse_batch_response(response, len(batch))
+            if not rewritten:
+                # Nothing could be extracted, so the cached response would only trigger the same retries again
+                connector.invalidate(batch_system_prompt, batch_prompt, model=model)
+        except Exception:
+            rewritten = {}
+
+    results = []
+    for i, item in enumerate(batch):
+        if i in rewritten:
+            results.append((item, rewritten[i], None))
+            continue
+        try:
+            user_prompt = json.dumps(test_cases[i], ensure_ascii=False)
+            results.append((item, connector.query_without_file(system_prompt, user_prompt, model=model), None))
+        except Exception as e:
+            results.append((item, None, e))
+    return results
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+
+from consistency_check import canonical_hash
+
+# Name of the manifest file stored at the root of the humanized output folder
+MANIFEST_FILE_NAME = ".humanize_manifest.json"
+
+def content_hash(data):
+    """
+    Returns the SHA-256 hex digest of bytes or str data.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def prompt_fingerprint(model, *prompts):
+    """
+    Identifies the prompts and model used for humanizing, so outputs are redone when either changes.
+    """
+    return content_hash(json.dumps([model, *prompts], ensure_ascii=False))
+
+class HumanizeManifest:
+    """
+    Records for every humanized test case the hash of its raw source and the
+    prompt fingerprint it was rewritten with.
+
+    Entries are keyed by the path relative to the raw/updated base folders
+    (e.g. "bank_account/<file>.json"). The manifest is stored as JSON at the
+    root of the updated folder, next to the domain subfolders.
+    """
+
+    def __init__(self, updated_base_path):
+        self.updated_base_path = updated_base_path
+        self.path = os.path.join(updated_base_path, MANIFEST_FILE_NAME)
+        self.entries = {}
+        self.exists = os.path.exists(self.path)
+        if self.exists:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def is_current(self, rel_path, raw_hash, prompt_hash):
+        """
+        Returns True if rel_path was already humanized from the same raw content with
+        the same prompts. The humanized file itself may since have been moved on by the
+        validator, so its presence is not required.
+        """
+        entry = self.entries.get(rel_path)
+        return (
+            entry is not None
+            and entry.get("raw_hash") == raw_hash
+            and entry.get("prompt_hash") == prompt_hash
+        )
+
+    def seed_if_new(self, raw_base_path, humanized_base_paths, prompt_hash):
+        """
+        Fills a manifest that did not exist on disk yet from the test cases humanized
+        before it was introduced, so they are not sent to the LLM again.
+
+        A raw test case counts as humanized if a file with the same relative path
+        exists in one of humanized_base_paths (e.g. the updated and the validated
+        folder) and equals it apart from the fields humanizing and validation
+        change (see consistency_check.canonical_hash). The prompts those files
+        were written with are unknown, so they are recorded with prompt_hash.
+
+        Returns:
+            int: Number of entries added.
+        """
+        if self.exists or not os.path.isdir(raw_base_path):
+            return 0
+        seeded = 0
+        for subfolder in os.listdir(raw_base_path):
+            subfolder_path = os.path.join(raw_base_path, subfolder)
+            if not os.path.isdir(subfolder_path):
+                continue
+            for file_name in os.listdir(subfolder_path):
+                if not file_name.endswith(".json"):
+                    continue
+                humanized_path = next(
+                    (path for path in (os.path.join(base, subfolder, file_name) for base in humanized_base_paths) if os.path.exists(path)),
+                    None
+                )
+                if humanized_path is None:
+                    continue
+                try:
+                    with open(os.path.join(subfolder_path, file_name), "rb") as f:
+                        raw = f.read()
+                    with open(humanized_path, "rb") as f:
+                        humanized = json.loads(f.read().decode("utf-8"))
+                    if canonical_hash(json.loads(raw.decode("utf-8"))) != canonical_hash(humanized):
+                        continue
+                except (OSError, ValueError):
+                    continue
+                self.record(f"{subfolder}/{file_name}", content_hash(raw), prompt_hash)
+                seeded += 1
+        return seeded
+
+    def record(self, rel_path, raw_hash, prompt_hash):
+        self.entries[rel_path] = {"raw_hash": raw_hash, "prompt_hash": prompt_hash}
+
+    def stale_outputs(self, raw_rel_paths):
+        """
+        Lists humanized test cases whose raw source no longer exists and forgets their entries.
+
+        Args:
+            raw_rel_paths (set): Relative paths of all current raw test cases.
+
+        Returns:
+            list: Relative paths of the stale humanized test cases.
+        """
+        stale = set(rel_path for rel_path in self.entries if rel_path not in raw_rel_paths)
+        if os.path.isdir(self.updated_base_path):
+            for subfolder in os.listdir(self.updated_base_path):
+                subfolder_path = os.path.join(self.updated_base_path, subfolder)
+                if not os.path.isdir(subfolder_path):
+                    continue
+                for file_name in os.listdir(subfolder_path):
+                    rel_path = f"{subfolder}/{file_name}"
+                    if file_name.endswith(".json") and rel_path not in raw_rel_paths:
+                        stale.add(rel_path)
+        for rel_path in stale:
+            self.entries.pop(rel_path, None)
+        return sorted(stale)
+
+    def save(self):
+        """
+        Writes the manifest atomically so an interrupted run never leaves a truncated file.
+        """
+        os.makedirs(self.updated_base_path, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.exists = True
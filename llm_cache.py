@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Cache modes: read and write, serve only from the cache, or bypass it entirely
+CACHE_MODES = ("readwrite", "replay", "off")
+
+class CacheMiss(RuntimeError):
+    """
+    Raised in replay mode when a request has no cached response.
+    """
+
+class ResponseCache:
+    """
+    Persistent cache of LLM responses backed by a single SQLite file.
+
+    Entries are keyed by a fingerprint of everything that influences the response
+    (model, system prompt, user prompt, attached file content and temperature).
+    When the stored responses exceed max_bytes, the least recently used entries
+    are evicted; the total size is tracked in memory, so only puts that cross
+    the limit query the table. All methods are safe to call from several threads.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, mode="readwrite"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}', expected one of {CACHE_MODES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        if mode != "off":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._connection.commit()
+            self._total_bytes = self._stored_bytes()
+
+    @property
+    def enabled(self):
+        return self._connection is not None
+
+    @staticmethod
+    def fingerprint(model, system_prompt, user_prompt, file_hash, temperature):
+        """
+        Returns the cache key for a request.
+
+        Args:
+            model (str): Model name.
+            system_prompt (str): System prompt sent with the request.
+            user_prompt (str): User prompt sent with the request.
+            file_hash (str | None): Content hash of the attached file, if any.
+            temperature (float): Sampling temperature.
+
+        Returns:
+            str: SHA-256 hex digest identifying the request.
+        """
+        payload = json.dumps(
+            [model, system_prompt, user_prompt, file_hash, temperature],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached response for key or None. Raises CacheMiss in replay mode.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._connection.commit()
+        if row is None:
+            if self.mode == "replay":
+                raise CacheMiss(f"No cached response for request {key[:12]} (replay mode)")
+            return None
+        return row[0]
+
+    def put(self, key, response):
+        """
+        Stores a response and evicts least recently used entries beyond max_bytes.
+        Does nothing in replay mode.
+        """
+        if not self.enabled or self.mode == "replay":
+            return
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            replaced = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._total_bytes += size - (replaced[0] if replaced else 0)
+            self.stores += 1
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def invalidate(self, key):
+        """
+        Removes the cached response for key, e.g. one the caller could not use, so
+        the request is sent again (or reported as a CacheMiss in replay mode)
+        instead of being answered with the same response.
+
+        Returns:
+            bool: True if a response was removed.
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._connection.commit()
+            self._total_bytes -= row[0]
+            self.invalidations += 1
+        return True
+
+    def _stored_bytes(self):
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        # Other processes may share the file, so the exact total is read before evicting
+        total = self._stored_bytes()
+        self._total_bytes = total
+        if total <= self.max_bytes:
+            return
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+        self._total_bytes = total
+
+    def stats(self):
+        """
+        Returns the hit/miss counters of this session.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
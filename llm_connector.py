@@ -1,18 +1,115 @@
 import openai
 import time
+import logging
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
 
+from llm_cache import ResponseCache
+from metrics import metrics
+
 load_dotenv()
 api_key = os.getenv("openai_api_key")
+# Upper bound for the number of LLM requests that are in flight at the same time
+default_max_concurrency = int(os.getenv("openai_max_concurrency", "8"))
+# Maximum number of seconds a single assistant run may take
+default_run_timeout = float(os.getenv("openai_run_timeout", "300"))
+# Stream assistant runs instead of polling their status
+default_stream_runs = os.getenv("openai_stream_runs", "true").lower() in ("1", "true", "yes")
+# Location, size limit and mode ("readwrite", "replay" or "off") of the response cache
+default_cache_path = os.getenv("openai_cache_path", os.path.join(".cache", "llm_responses.sqlite3"))
+default_cache_max_bytes = int(os.getenv("openai_cache_max_bytes", str(512 * 1024 * 1024)))
+default_cache_mode = os.getenv("openai_cache_mode", "readwrite")
+
+# Run states after which the run will not make any more progress on its own
+run_final_states = ("completed", "failed", "cancelled", "expired", "incomplete", "requires_action")
+# Adaptive polling: start fast for short runs, back off for long ones
+poll_initial_delay = 0.2
+poll_backoff_factor = 1.5
+poll_max_delay = 5.0
 
 class OpenAIConnector:
-    def __init__(self):
+    def __init__(self, max_concurrency=None, run_timeout=None, stream_runs=None, cache=None):
         self.api_key = api_key
         openai.api_key = self.api_key
         self.temperature = 0.0
+        self.run_timeout = run_timeout or default_run_timeout
+        self.stream_runs = default_stream_runs if stream_runs is None else stream_runs
+        self.max_concurrency = max(1, max_concurrency or default_max_concurrency)
+        # Guards every request so that direct calls from worker threads respect the limit as well
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # Session registry of uploaded files, vector stores and assistants keyed by content hash
+        self._registry = {}
+        self._registry_key_locks = {}
+        self._registry_lock = threading.Lock()
+        self._file_hashes = {}
+        # Persistent response cache, shared by all calls of this connector
+        self.cache = cache if cache is not None else ResponseCache(
+            default_cache_path,
+            max_bytes=default_cache_max_bytes,
+            mode=default_cache_mode
+        )
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix="llm"
+                )
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules an arbitrary callable on the connector's worker pool.
+        fn runs in a copy of the caller's context, so metric labels set around
+        the call (see metrics.metric_labels) apply to its requests as well.
+
+        Returns:
+            concurrent.futures.Future: Future resolving to the return value of fn.
+        """
+        context = contextvars.copy_context()
+        return self._get_executor().submit(context.run, fn, *args, **kwargs)
+
+    def submit_without_file(self, system_prompt, user_prompt, model="gpt-4o-mini"):
+        """
+        Concurrent variant of query_without_file. Returns a Future with the response text.
+        """
+        return self.submit(self.query_without_file, system_prompt, user_prompt, model=model)
+
+    def submit_with_file(self, system_prompt, user_prompt, file_path, model="gpt-4o-mini"):
+        """
+        Concurrent variant of query_with_file. Returns a Future with the response text.
+        """
+        return self.submit(self.query_with_file, system_prompt, user_prompt, file_path, model=model)
+
+    def shutdown(self, wait=True):
+        """
+        Waits for outstanding requests and releases the worker pool.
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
 
     def query_without_file(self, system_prompt, user_prompt, model="gpt-4o-mini"):
+        key = self.cache.fingerprint(model, system_prompt, user_prompt, None, self.temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.count("llm_cache_hits_total", api="chat", model=model)
+            return cached
+        with self._semaphore:
+            response = self._query_without_file(system_prompt, user_prompt, model)
+        self.cache.put(key, response)
+        return response
+
+    def _query_without_file(self, system_prompt, user_prompt, model):
+        start = time.perf_counter()
         try:
             response = openai.chat.completions.create(
             model=model,
@@ -22,26 +119,59 @@ class OpenAIConnector:
             ],
             temperature=self.temperature,
             )
+            record_usage(model, getattr(response, "usage", None), api="chat")
             return response.choices[0].message.content
         except Exception as e:
+            metrics.count("llm_errors_total", api="chat", model=model)
             raise RuntimeError(f"Failed to query completion API: {e}")
+        finally:
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, api="chat", model=model)
+
+    def invalidate(self, system_prompt, user_prompt, file_path=None, model="gpt-4o-mini"):
+        """
+        Drops the cached response of a request whose response turned out to be unusable
+        (e.g. no JSON could be extracted), so it is not served from the cache again.
+        Takes the same arguments as query_without_file/query_with_file.
+        """
+        file_hash = self._file_hash(file_path) if file_path is not None else None
+        key = self.cache.fingerprint(model, system_prompt, user_prompt, file_hash, self.temperature)
+        if self.cache.invalidate(key):
+            metrics.count("llm_cache_invalidations_total", model=model)
 
-    def query_with_file(self, system_prompt, user_prompt, file_path, model="gpt-40-mini"):
+    def query_with_file(self, system_prompt, user_prompt, file_path, model="gpt-4o-mini"):
+        file_hash = self._file_hash(file_path)
+        key = self.cache.fingerprint(model, system_prompt, user_prompt, file_hash, self.temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.count("llm_cache_hits_total", api="assistant", model=model)
+            return cached
+        with self._semaphore:
+            response = self._query_with_file(system_prompt, user_prompt, file_path, file_hash, model)
+        self.cache.put(key, response)
+        return response
+
+    def _file_hash(self, file_path):
+        """
+        Returns the content hash of file_path, recomputed only when the file changes on disk.
+        """
+        stat = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        with self._registry_lock:
+            file_hash = self._file_hashes.get(memo_key)
+        if file_hash is None:
+            file_hash = file_content_hash(file_path)
+            with self._registry_lock:
+                self._file_hashes[memo_key] = file_hash
+        return file_hash
+
+    def _query_with_file(self, system_prompt, user_prompt, file_path, file_hash, model):
         thread = None
-        assistant = None
-        uploaded_file = None
+        start = time.perf_counter()
         try:
-            # Upload the file for file_search tool
-            with open(file_path, "rb") as f:
-                uploaded_file = openai.files.create(file=f, purpose="assistants")
-
-            # Create assistant with file_search tool (NO file_ids)
-            assistant = openai.beta.assistants.create(
-                name="TestCaseGenerator",
-                instructions=system_prompt,
-                model=model,
-                tools=[{"type": "file_search"}]
-            )
+            # Upload the file once per content hash and reuse the matching assistant
+            uploaded_file_id = self._get_uploaded_file(file_path, file_hash)
+            vector_store_id = self._get_vector_store(uploaded_file_id, file_hash)
+            assistant_id = self._get_assistant(system_prompt, model, vector_store_id)
 
             # Create a thread
             thread = openai.beta.threads.create()
@@ -53,41 +183,227 @@ class OpenAIConnector:
                 content=user_prompt
             )
 
-            # Start the run — no file_ids passed here either
-            run = openai.beta.threads.runs.create(
-                thread_id=thread.id,
-                assistant_id=assistant.id,
-                temperature=self.temperature
-            )
-
-            # Wait for run to complete
-            while run.status not in ["completed", "failed"]:
-                time.sleep(1)
-                run = openai.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+            # Start the run — the file is attached through the assistant's vector store
+            run_start = time.perf_counter()
+            deadline = time.monotonic() + self.run_timeout
+            run = None
+            if self.stream_runs:
+                run = self._stream_run(thread.id, assistant_id, deadline)
+            if run is None:
+                run = openai.beta.threads.runs.create(
+                    thread_id=thread.id,
+                    assistant_id=assistant_id,
+                    temperature=self.temperature
+                )
+            run = self._wait_for_run(thread.id, run, deadline)
+            metrics.observe("llm_assistant_run_seconds", time.perf_counter() - run_start, model=model, status=run.status)
+            record_usage(model, getattr(run, "usage", None), api="assistant")
 
-            if run.status == "failed":
-                raise RuntimeError("Assistant run failed")
+            if run.status != "completed":
+                last_error = getattr(run, "last_error", None)
+                raise RuntimeError(f"Assistant run ended with status '{run.status}': {last_error}")
 
             # Fetch and return result
             messages = openai.beta.threads.messages.list(thread_id=thread.id)
             return messages.data[0].content[0].text.value
 
         except Exception as e:
+            metrics.count("llm_errors_total", api="assistant", model=model)
             raise RuntimeError(f"Failed to query assistant API: {e}")
         finally:
-            # Clean up: delete thread, assistant, and uploaded file if they were created
+            metrics.observe("llm_request_seconds", time.perf_counter() - start, api="assistant", model=model)
+            # Clean up the per-call thread; shared resources are released in close()
             try:
                 if thread is not None:
                     openai.beta.threads.delete(thread.id)
             except Exception:
                 pass
-            try:
-                if assistant is not None:
-                    openai.beta.assistants.delete(assistant.id)
-            except Exception:
-                pass
-            try:
-                if uploaded_file is not None:
-                    openai.files.delete(uploaded_file.id)
-            except Exception:
-                pass
+
+    def _stream_run(self, thread_id, assistant_id, deadline):
+        """
+        Starts the run as an event stream and consumes it until the run reaches a final state.
+
+        If the stream fails before any run event arrived, the run may still have
+        been created on the server. The thread is then checked for it, and an
+        existing run is handed to the polling loop instead of starting the
+        prompt a second time.
+
+        Returns:
+            The last run object seen on the stream, or None if streaming is unavailable
+            or no run was created, so that the caller starts one and polls it.
+        """
+        stream_run = getattr(openai.beta.threads.runs, "stream", None)
+        if stream_run is None:
+            return None
+
+        run = None
+        try:
+            with stream_run(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                temperature=self.temperature,
+                timeout=max(deadline - time.monotonic(), 1)
+            ) as stream:
+                for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step"):
+                        run = event.data
+                        if run.status in run_final_states:
+                            return run
+                    if time.monotonic() > deadline:
+                        break
+        except Exception as e:
+            if run is None:
+                run = self._find_thread_run(thread_id)
+                if run is None:
+                    return None
+                logging.warning(f"Run stream failed before its first event ({e}), polling run {run.id} found on the thread")
+                return run
+            logging.warning(f"Run stream for {run.id} was interrupted, falling back to polling")
+        # The stream ended early (timeout or dropped connection): the polling loop takes over
+        return run
+
+    def _find_thread_run(self, thread_id):
+        """
+        Returns the latest run of the per-call thread, or None if it has none.
+        If the runs cannot be listed, the error is raised rather than risking a duplicate run.
+        """
+        runs = openai.beta.threads.runs.list(thread_id=thread_id, order="desc", limit=1)
+        return runs.data[0] if runs.data else None
+
+    def _wait_for_run(self, thread_id, run, deadline):
+        """
+        Polls the run with an adaptive backoff until it reaches a final state.
+
+        Short runs are picked up almost immediately while long runs are only checked
+        every few seconds. Runs that need tool output are cancelled, since the
+        assistant has no function tools, and runs exceeding the deadline are
+        cancelled and reported as a timeout.
+        """
+        delay = poll_initial_delay
+        while run.status not in run_final_states:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._cancel_run(thread_id, run.id)
+                raise TimeoutError(f"Assistant run {run.id} did not finish within {self.run_timeout} seconds")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * poll_backoff_factor, poll_max_delay)
+            metrics.count("llm_assistant_polls_total")
+            run = openai.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+        if run.status == "requires_action":
+            self._cancel_run(thread_id, run.id)
+        return run
+
+    def _cancel_run(self, thread_id, run_id):
+        try:
+            openai.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        except Exception:
+            pass
+
+    def _registered(self, key, create):
+        """
+        Returns the session resource stored under key, creating it on first use.
+        Concurrent callers asking for the same key wait for a single creation.
+        """
+        with self._registry_lock:
+            if key in self._registry:
+                return self._registry[key]
+            key_lock = self._registry_key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._registry_lock:
+                if key in self._registry:
+                    return self._registry[key]
+            resource_id = create()
+            with self._registry_lock:
+                self._registry[key] = resource_id
+            return resource_id
+
+    def _get_uploaded_file(self, file_path, file_hash):
+        def create():
+            with open(file_path, "rb") as f:
+                return openai.files.create(file=f, purpose="assistants").id
+        return self._registered(("file", file_hash), create)
+
+    def _get_vector_store(self, file_id, file_hash):
+        def create():
+            vector_stores = vector_stores_api()
+            vector_store = vector_stores.create(name=f"TestCaseGenerator-{file_hash[:12]}")
+            # Wait for indexing once so that every later run can search the file immediately
+            vector_stores.files.create_and_poll(vector_store_id=vector_store.id, file_id=file_id)
+            return vector_store.id
+        return self._registered(("vector_store", file_hash), create)
+
+    def _get_assistant(self, system_prompt, model, vector_store_id):
+        def create():
+            return openai.beta.assistants.create(
+                name="TestCaseGenerator",
+                instructions=system_prompt,
+                model=model,
+                tools=[{"type": "file_search"}],
+                tool_resources={"file_search": {"vector_store_ids": [vector_store_id]}}
+            ).id
+        prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        return self._registered(("assistant", prompt_hash, model, vector_store_id), create)
+
+    def cleanup(self):
+        """
+        Deletes all assistants, vector stores and uploaded files created during this session.
+        """
+        with self._registry_lock:
+            registry, self._registry = self._registry, {}
+            self._registry_key_locks = {}
+        # Delete dependants first: assistants reference vector stores, which reference files
+        for kind, delete in (
+            ("assistant", openai.beta.assistants.delete),
+            ("vector_store", lambda resource_id: vector_stores_api().delete(resource_id)),
+            ("file", openai.files.delete),
+        ):
+            for key, resource_id in registry.items():
+                if key[0] != kind:
+                    continue
+                try:
+                    delete(resource_id)
+                except Exception:
+                    pass
+
+    def close(self):
+        """
+        Shuts down the worker pool and releases all session resources.
+        """
+        self.shutdown()
+        self.cleanup()
+        if self.cache.enabled:
+            logging.info(f"LLM response cache: {self.cache.stats()}")
+        self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def file_content_hash(file_path):
+    """
+    Returns the SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def record_usage(model, usage, **labels):
+    """
+    Records the token usage of a chat completion or an assistant run, if the API reported it.
+    """
+    if usage is None:
+        return
+    metrics.record_llm_usage(model, getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0), **labels)
+
+def vector_stores_api():
+    """
+    Returns the vector store resource, which moved out of the beta namespace in newer SDK versions.
+    """
+    vector_stores = getattr(openai, "vector_stores", None)
+    return vector_stores if vector_stores is not None else openai.beta.vector_stores
@@ -1,83 +1,192 @@
+import sys
 import time
-import os
-import glob
-
-# Import functions from the individual modules of the test case pipeline
-from api_test_case_generator import generate_test_cases as generate_api_test_cases
-from api_test_case_modifier import humanize_testcases as humanize_api_testcases, evaluate_folders as evaluate_api_folders
-from api_test_case_validator import execute_test_cases as validate_api_test_cases, count_remaining_files as count_remaining_api_files
-
-from sql_test_case_generator import generate_test_cases as generate_sql_test_cases
-from sql_test_case_modifier import humanize_testcases as humanize_sql_testcase, evaluate_folders as evaluate_sql_folders        
-from sql_test_case_validator import validate_test_cases as validate_sql_test_cases, count_remaining_files as count_sql_remaining_files
+import logging
+import argparse
+import importlib
+
+from metrics import metrics, metric_labels
+
+# Module and function of every pipeline step per test case kind, followed by the check run after it.
+# The modules are only imported when their step runs (see load), so e.g. a validation run never imports openai.
+STEPS = {
+    ("API", "generate"): (("api_test_case_generator", "generate_test_cases"), None),
+    ("API", "humanize"): (("api_test_case_modifier", "humanize_testcases"), ("api_test_case_modifier", "evaluate_folders")),
+    ("API", "validate"): (("api_test_case_validator", "execute_test_cases"), ("api_test_case_validator", "count_remaining_files")),
+    ("SQL", "generate"): (("sql_test_case_generator", "generate_test_cases"), None),
+    ("SQL", "humanize"): (("sql_test_case_modifier", "humanize_testcases"), ("sql_test_case_modifier", "evaluate_folders")),
+    ("SQL", "validate"): (("sql_test_case_validator", "validate_test_cases"), ("sql_test_case_validator", "count_remaining_files")),
+}
+# Test cases generated per difficulty level if not given on the command line
+DEFAULT_TEST_CASES_PER_DIFFICULTY = {"API": 1, "SQL": 4}
+DEFAULT_HUMANIZE_BATCH_SIZE = 20
+
+# Seconds spent importing every module loaded through load(), including the modules it imports
+import_times = {}
+
+def load(module_name, attribute=None):
+    """
+    Imports a pipeline module on first use and returns it or one of its attributes.
+    """
+    if module_name not in sys.modules:
+        start = time.perf_counter()
+        importlib.import_module(module_name)
+        import_times[module_name] = time.perf_counter() - start
+    module = sys.modules[module_name]
+    return getattr(module, attribute) if attribute else module
 
 
 def main():
 
+    # Maximum number of LLM requests in flight at the same time (None = connector default)
+    max_llm_concurrency = None
+    # Number of test cases rewritten per LLM request in the humanize step (1 = one request per test case)
+    humanize_batch_size = DEFAULT_HUMANIZE_BATCH_SIZE
+    # Stream every generated test case through humanization and validation instead of running the steps one after another
+    streaming = False
+
     # Define flags to control the execution of each step in the pipeline
-    number_of_api_test_cases_per_difficulty = 1
+    number_of_api_test_cases_per_difficulty = DEFAULT_TEST_CASES_PER_DIFFICULTY["API"]
     to_generate_api_test_cases = False
     to_modify_api_test_cases = False
     to_validate_api_test_cases = False
 
-    number_of_sql_test_cases_per_difficulty = 4
+    number_of_sql_test_cases_per_difficulty = DEFAULT_TEST_CASES_PER_DIFFICULTY["SQL"]
     to_generate_sql_test_cases = True
     to_modify_sql_test_cases = True
     to_validate_sql_test_cases = True
 
     start = time.time()
 
+    # Steps 1-3 as one streaming pass over bounded queues (only when new test cases are generated)
+    stream_api = streaming and to_generate_api_test_cases
+    stream_sql = streaming and to_generate_sql_test_cases
+    if stream_api:
+        print(f"API Steps 1-3: Streaming Test Cases // {time.time()}")
+        run_stream("API", number_of_api_test_cases_per_difficulty, max_concurrency=max_llm_concurrency, batch_size=humanize_batch_size)
+
     # Step 1: Generate initial API test cases from system and API documentation
-    if to_generate_api_test_cases:
+    elif to_generate_api_test_cases:
         print(f"API Step 1: Generating Test Cases // {time.time()}")
-        generate_api_test_cases(number_of_api_test_cases_per_difficulty)
+        run_step("API", "generate", number_of_api_test_cases_per_difficulty, max_concurrency=max_llm_concurrency)
 
     # Step 2: Humanize the test cases to improve readability for QA and stakeholders
-    if to_modify_api_test_cases:
+    if to_modify_api_test_cases and not stream_api:
         print(f"API Step 2: Humanizing Test Cases // {time.time()}")
-        humanize_api_testcases()
-        evaluate_api_folders()
+        run_step("API", "humanize", max_concurrency=max_llm_concurrency, batch_size=humanize_batch_size)
 
     # Step 3: Execute the test cases against live API endpoints and validate responses
-    if to_validate_api_test_cases:
+    if to_validate_api_test_cases and not stream_api:
         print(f"API Step 3: Executing and Validating Test Cases // {time.time()}")
-        validate_api_test_cases()
-        count_remaining_api_files()
+        run_step("API", "validate")
 
     api_total_time = time.time() - start
     print(f"\nTotal execution time for API test cases: {api_total_time:.2f} seconds.")
 
-    if to_generate_sql_test_cases:
+    if stream_sql:
+        print(f"SQL Steps 1-3: Streaming Test Cases // {time.time()}")
+        run_stream("SQL", number_of_sql_test_cases_per_difficulty, max_concurrency=max_llm_concurrency, batch_size=humanize_batch_size)
+
+    elif to_generate_sql_test_cases:
         print(f"SQL Step 1: Generating Test Cases // {time.time()}")
-        generate_sql_test_cases(number_of_sql_test_cases_per_difficulty)
-    
-    if to_modify_sql_test_cases:
+        run_step("SQL", "generate", number_of_sql_test_cases_per_difficulty, max_concurrency=max_llm_concurrency)
+
+    if to_modify_sql_test_cases and not stream_sql:
         print(f"SQL Step 2: Humanizing Test Cases // {time.time()}")
-        humanize_sql_testcase()
-        evaluate_sql_folders()
+        run_step("SQL", "humanize", max_concurrency=max_llm_concurrency, batch_size=humanize_batch_size)
 
-    if to_validate_sql_test_cases:
+    if to_validate_sql_test_cases and not stream_sql:
         print(f"SQL Step 3: Executing and Validating Test Cases // {time.time()}")
-        validate_sql_test_cases()
-        count_sql_remaining_files()
+        run_step("SQL", "validate")
 
     sql_total_time = time.time() - start
     print(f"\nTotal execution time for SQL test cases: {sql_total_time:.2f} seconds.")
 
-def count_json_files_in_subfolders(parent_folder):
-    total = 0
-    for root, dirs, files in os.walk(parent_folder):
-        json_files = glob.glob(os.path.join(root, "*.json"))
-        total += len(json_files)
-    return total
-
+def run_step(kind, stage, *args, **kwargs):
+    """
+    Runs one pipeline step with its kind and stage as metric labels and records its duration in stage_seconds.
+    The check belonging to the step (folder evaluation or remaining files) runs afterwards.
+    """
+    (module_name, function_name), check = STEPS[(kind, stage)]
+    step = load(module_name, function_name)
+    with metric_labels(kind=kind, stage=stage), metrics.timer("stage_seconds", kind=kind, stage=stage):
+        result = step(*args, **kwargs)
+    if check is not None:
+        load(*check)()
+    return result
+
+def run_stream(kind, test_cases_per_difficulty, **kwargs):
+    """
+    Generates, humanizes and validates test cases of one kind in a single streaming pass.
+    """
+    result = load("streaming_pipeline", "run_pipeline")(kind.lower(), test_cases_per_difficulty, **kwargs)
+    load(*STEPS[(kind, "validate")][1])()
+    return result
+
+def count_validated_test_cases(kind):
+    return load("run_state", "get_run_state")().counts(kind).get("validated", 0)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate, humanize and validate API and SQL test cases. Without a command, the steps configured in main() run."
+    )
+    parser.add_argument("--import-times", action="store_true", help="report the time spent importing the pipeline modules")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="run the steps configured in main()")
+    for command, help_text in (
+        ("generate", "generate raw test cases"),
+        ("humanize", "rewrite the inputs of the raw test cases"),
+        ("validate", "validate the humanized test cases"),
+        ("stream", "generate, humanize and validate in one streaming pass"),
+    ):
+        subparser = commands.add_parser(command, help=help_text)
+        subparser.add_argument("kinds", nargs="+", choices=("api", "sql"), help="test case kinds to process")
+        if command in ("generate", "stream"):
+            subparser.add_argument("-n", "--per-difficulty", type=int, help="test cases per difficulty level (API 1, SQL 4 by default)")
+        if command in ("generate", "humanize", "stream"):
+            subparser.add_argument("--max-concurrency", type=int, help="maximum number of LLM requests in flight")
+        if command in ("humanize", "stream"):
+            subparser.add_argument("--batch-size", type=int, default=DEFAULT_HUMANIZE_BATCH_SIZE, help="test cases per humanize request")
+        if command == "humanize":
+            subparser.add_argument("--force", action="store_true", help="humanize test cases that are up to date as well")
+    return parser.parse_args(argv)
+
+def cli(argv=None):
+    """
+    Entry point of the command line, e.g. "python main.py validate sql" or "python main.py --import-times generate api -n 2".
+    """
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    start = time.perf_counter()
+
+    if args.command in (None, "run"):
+        main()
+        kinds = ["API", "SQL"]
+    else:
+        kinds = [kind.upper() for kind in args.kinds]
+        for kind in kinds:
+            per_difficulty = getattr(args, "per_difficulty", None) or DEFAULT_TEST_CASES_PER_DIFFICULTY[kind]
+            if args.command == "generate":
+                run_step(kind, "generate", per_difficulty, max_concurrency=args.max_concurrency)
+            elif args.command == "humanize":
+                run_step(kind, "humanize", max_concurrency=args.max_concurrency, batch_size=args.batch_size, force=args.force)
+            elif args.command == "validate":
+                run_step(kind, "validate")
+            else:
+                run_stream(kind, per_difficulty, max_concurrency=args.max_concurrency, batch_size=args.batch_size)
+
+    # Latency histograms, token usage, cost and throughput of this run
+    json_path, prometheus_path = metrics.export()
+    print(f"Metrics written to {json_path} and {prometheus_path}")
+    for kind in kinds:
+        print(f"Number of validated {kind} test cases (run state): {count_validated_test_cases(kind)}")
+
+    if args.import_times:
+        total = sum(import_times.values())
+        print(f"\nImported {len(import_times)} pipeline modules in {total * 1000:.1f} ms (total run {time.perf_counter() - start:.2f} s):")
+        for module_name, seconds in sorted(import_times.items(), key=lambda item: -item[1]):
+            print(f"  {module_name}: {seconds * 1000:.1f} ms")
 
 
 # Entry point for the script when run directly
 if __name__ == "__main__":
-    main()
-    api_json_count = count_json_files_in_subfolders("validated_testcases/API")
-    sql_json_count = count_json_files_in_subfolders("validated_testcases/SQL")
-
-    print(f"Number of JSON files in validated_testcases/API: {api_json_count}")
-    print(f"Number of JSON files in validated_testcases/SQL: {sql_json_count}")
+    cli()
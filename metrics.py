@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Folder the metrics of a run are exported to
+METRICS_FOLDER = "metrics"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# USD per one million prompt / completion tokens, used for the cost estimate
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# Labels such as stage and domain that apply to everything recorded in the current context
+_context_labels = contextvars.ContextVar("metric_labels", default={})
+
+@contextmanager
+def metric_labels(**labels):
+    """
+    Adds labels to every metric recorded inside the block, including work
+    submitted to OpenAIConnector.submit from inside it.
+    """
+    token = _context_labels.set({**_context_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _context_labels.reset(token)
+
+def _label_key(labels):
+    merged = {**_context_labels.get(), **labels}
+    return tuple(sorted((name, str(value)) for name, value in merged.items() if value is not None))
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus layout.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls into.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+class MetricsRegistry:
+    """
+    Thread-safe collection of counters and histograms of one run.
+
+    Every series is identified by its name and its labels; the labels of
+    enclosing metric_labels blocks are added automatically. The registry can be
+    exported as a JSON summary and in the Prometheus text format (e.g. for the
+    node exporter's textfile collector).
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def count(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observes the duration of the block in the histogram name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_llm_usage(self, model, prompt_tokens, completion_tokens, **labels):
+        """
+        Counts the tokens of one LLM call and their estimated cost.
+        """
+        self.count("llm_prompt_tokens_total", prompt_tokens or 0, model=model, **labels)
+        self.count("llm_completion_tokens_total", completion_tokens or 0, model=model, **labels)
+        prices = MODEL_PRICES.get(model)
+        if prices is not None:
+            cost = ((prompt_tokens or 0) * prices[0] + (completion_tokens or 0) * prices[1]) / 1_000_000
+            self.count("llm_cost_usd_total", cost, model=model, **labels)
+
+    def summary(self):
+        """
+        Returns all series as a JSON-serializable dict, with the test case
+        throughput per kind and stage derived from test_cases_total and stage_seconds.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: histogram for key, histogram in self._histograms.items()}
+            result = {"started_at": self.started_at, "duration": time.time() - self.started_at, "counters": {}, "histograms": {}}
+            for (name, label_key), value in sorted(counters.items()):
+                result["counters"].setdefault(name, []).append({"labels": dict(label_key), "value": value})
+            for (name, label_key), histogram in sorted(histograms.items()):
+                result["histograms"].setdefault(name, []).append({
+                    "labels": dict(label_key),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else None,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "max": histogram.max,
+                })
+
+        stage_seconds = {}
+        for entry in result["histograms"].get("stage_seconds", []):
+            key = (entry["labels"].get("kind"), entry["labels"].get("stage"))
+            stage_seconds[key] = stage_seconds.get(key, 0) + entry["sum"]
+        processed = {}
+        for entry in result["counters"].get("test_cases_total", []):
+            key = (entry["labels"].get("kind"), entry["labels"].get("stage"))
+            processed[key] = processed.get(key, 0) + entry["value"]
+        result["throughput"] = [
+            {"kind": kind, "stage": stage, "test_cases": count, "seconds": stage_seconds.get((kind, stage)),
+             "per_second": count / stage_seconds[(kind, stage)] if stage_seconds.get((kind, stage)) else None}
+            for (kind, stage), count in sorted(processed.items(), key=lambda item: tuple(str(part) for part in item[0]))
+        ]
+        return result
+
+    def to_prometheus(self):
+        """
+        Renders all series in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, label_key), value in counters:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{_format_labels(label_key)} {value}")
+            for (name, label_key), histogram in histograms:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, total in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(label_key, [('le', le)])} {total}")
+                lines.append(f"{name}_sum{_format_labels(label_key)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(label_key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, folder=METRICS_FOLDER):
+        """
+        Writes metrics.json and metrics.prom to folder, replacing the files of the previous run atomically.
+
+        Returns:
+            tuple: Paths of the JSON summary and the Prometheus file.
+        """
+        os.makedirs(folder, exist_ok=True)
+        json_path = os.path.join(folder, "metrics.json")
+        prometheus_path = os.path.join(folder, "metrics.prom")
+        for path, content in ((json_path, json.dumps(self.summary(), indent=2)), (prometheus_path, self.to_prometheus())):
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        return json_path, prometheus_path
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+# Registry shared by all modules of the pipeline
+metrics = MetricsRegistry()
@@ -0,0 +1,307 @@
+import json
+import random
+import asyncio
+import logging
+import argparse
+import threading
+from urllib.parse import urlsplit
+
+from offline_api_validator import OfflineValidator, DOCUMENTATION_FOLDER
+
+REASON_PHRASES = {
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+# Upper bound for request bodies accepted by the mock server
+MAX_BODY_BYTES = 10 * 1024 * 1024
+# Nesting depth up to which response bodies are synthesized from schemas
+MAX_EXAMPLE_DEPTH = 3
+
+def example_from_schema(slicer, schema, depth=0):
+    """
+    Builds an example value for a schema, preferring the examples of the documentation.
+    """
+    if not isinstance(schema, dict):
+        return None
+    if "$ref" in schema:
+        try:
+            schema = slicer.resolve(schema["$ref"])
+        except KeyError:
+            return None
+    if "example" in schema:
+        return schema["example"]
+    if "allOf" in schema:
+        merged = None
+        for sub_schema in schema["allOf"]:
+            value = example_from_schema(slicer, sub_schema, depth)
+            merged = {**merged, **value} if isinstance(merged, dict) and isinstance(value, dict) else value
+        return merged
+    for keyword in ("anyOf", "oneOf"):
+        if schema.get(keyword):
+            return example_from_schema(slicer, schema[keyword][0], depth)
+    if "enum" in schema and schema["enum"]:
+        return schema["enum"][0]
+
+    schema_type = schema.get("type")
+    if schema_type == "object" or "properties" in schema:
+        if depth >= MAX_EXAMPLE_DEPTH:
+            return {}
+        return {
+            name: example_from_schema(slicer, property_schema, depth + 1)
+            for name, property_schema in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [] if depth >= MAX_EXAMPLE_DEPTH else [example_from_schema(slicer, schema.get("items"), depth + 1)]
+    if schema_type == "integer":
+        return 0
+    if schema_type == "number":
+        return 0.0
+    if schema_type == "boolean":
+        return False
+    if schema_type == "string":
+        return {
+            "uuid": "00000000-0000-0000-0000-000000000000",
+            "date": "2024-01-01",
+            "date-time": "2024-01-01T00:00:00Z",
+        }.get(schema.get("format"), "string")
+    return None
+
+def odata_error(status, message, details=None):
+    return {"error": {"code": str(status), "message": message, "details": [{"message": d} for d in details or []]}}
+
+class MockApiServer:
+    """
+    Local stand-in for the Postman mock hosts, generated from the API_*.json specs.
+
+    Every business entity is served under its folder name, e.g.
+    http://127.0.0.1:8765/bank_account/BankAccounts. Requests are matched
+    against the spec's path templates and methods, request bodies are checked
+    with the offline validator, and successful calls answer with the first
+    documented 2xx status and a body built from the documented response schema.
+    OData JSON $batch requests are answered request by request.
+
+    latency (plus a random jitter) delays every response, and error_rate is the
+    probability of answering with one of error_statuses and a Retry-After header,
+    so that clients can be benchmarked under reproducible conditions.
+    """
+
+    def __init__(self, documentation_folder=DOCUMENTATION_FOLDER, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_statuses=(429, 503), seed=None, strict_properties=False):
+        self.validator = OfflineValidator(documentation_folder, strict_properties=strict_properties)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.random = random.Random(seed)
+        self._examples = {}
+        self._writers = set()
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    def _success_response(self, domain, slicer, path, method, operation):
+        key = (domain, path, method)
+        if key not in self._examples:
+            responses = operation.get("responses", {})
+            status = min((int(code) for code in responses if code.isdigit() and code.startswith("2")), default=200)
+            response = responses.get(str(status), {})
+            if "$ref" in response:
+                response = slicer.resolve(response["$ref"])
+            json_content = response.get("content", {}).get("application/json")
+            body = None
+            if status != 204 and json_content is not None:
+                body = json_content.get("example", example_from_schema(slicer, json_content.get("schema")))
+            self._examples[key] = (status, body)
+        return self._examples[key]
+
+    def respond(self, domain, method, endpoint, body):
+        """
+        Computes the response of one request.
+
+        Returns:
+            tuple: (status, headers, JSON body or None)
+        """
+        spec_validator = self.validator.spec_validator(domain)
+        if spec_validator is None:
+            return 404, {}, odata_error(404, f"Unknown service {domain}")
+        path, methods = spec_validator.match(endpoint)
+        if path is None:
+            return 404, {}, odata_error(404, f"Unknown resource {endpoint}")
+        if method not in methods:
+            return 405, {"Allow": ", ".join(sorted(methods))}, odata_error(405, f"Method {method} not allowed for {path}")
+
+        if path.endswith("/$batch") and isinstance(body, dict) and isinstance(body.get("requests"), list):
+            responses = []
+            for i, request in enumerate(body["requests"]):
+                request = request if isinstance(request, dict) else {}
+                url = urlsplit(str(request.get("url", request.get("endpoint", "")))).path
+                status, _, response_body = self.respond(domain, str(request.get("method", "")).upper(), url, request.get("body"))
+                entry = {"id": str(request.get("id", i + 1)), "status": status}
+                if response_body is not None:
+                    entry["body"] = response_body
+                responses.append(entry)
+            return 200, {}, {"responses": responses}
+
+        errors = spec_validator.validate(method, endpoint, body)
+        if errors:
+            return 400, {}, odata_error(400, errors[0], errors)
+        status, response_body = self._success_response(domain, spec_validator.slicer, path, method, methods[method])
+        return status, {}, response_body
+
+    async def _handle_request(self, method, target, headers, raw_body):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        if self.error_rate and self.random.random() < self.error_rate:
+            status = self.random.choice(self.error_statuses)
+            return status, {"Retry-After": "1"}, odata_error(status, "Injected error")
+
+        path = urlsplit(target).path
+        domain, _, endpoint = path.lstrip("/").partition("/")
+        body = None
+        if raw_body:
+            try:
+                body = json.loads(raw_body.decode("utf-8"))
+            except (UnicodeDecodeError, ValueError):
+                if "multipart/mixed" in headers.get("content-type", ""):
+                    # Multipart batches are accepted without looking into the parts
+                    return 200, {}, {"responses": []}
+                return 400, {}, odata_error(400, "Request body is not valid JSON")
+        return self.respond(domain, method, "/" + endpoint, body)
+
+    async def _handle_connection(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", "0") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, response_headers, response_body = 413, {}, odata_error(413, "Request body too large")
+                    keep_alive = False
+                else:
+                    raw_body = await reader.readexactly(length) if length else b""
+                    try:
+                        status, response_headers, response_body = await self._handle_request(method.upper(), target, headers, raw_body)
+                    except Exception as e:
+                        logging.exception(f"Mock server failed on {method} {target}")
+                        status, response_headers, response_body = 500, {}, odata_error(500, str(e))
+                    keep_alive = headers.get("connection", "").lower() != "close"
+
+                payload = b"" if response_body is None else json.dumps(response_body).encode("utf-8")
+                head = [f"HTTP/1.1 {status} {REASON_PHRASES.get(status, '')}", f"Content-Length: {len(payload)}"]
+                if payload:
+                    head.append("Content-Type: application/json")
+                head.extend(f"{name}: {value}" for name, value in response_headers.items())
+                head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        """
+        Serves until cancelled.
+        """
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_background(self, host="127.0.0.1", port=0):
+        """
+        Starts the server on its own event loop thread and returns its base URL.
+        Port 0 picks a free port.
+        """
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def start():
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+            started.set()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(start())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="mock-api-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        bound_host, bound_port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{bound_host}:{bound_port}"
+
+    def stop(self):
+        """
+        Stops a server started with start_in_background.
+        """
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            # Idle keep-alive connections would otherwise outlive the loop
+            for writer in list(self._writers):
+                writer.close()
+            await asyncio.sleep(0)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+def point_name_to_url_at(base_url, mapping=None):
+    """
+    Rewrites name_to_url so that every business entity is served by the mock server at base_url.
+    """
+    if mapping is None:
+        from system_documentation.name_to_url import name_to_url as mapping
+    for domain in mapping:
+        mapping[domain] = f"{base_url.rstrip('/')}/{domain}"
+    return mapping
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Local mock server for the API test cases")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay of every response in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra delay of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/503")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockApiServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    logging.info(f"Serving the API mocks on http://{args.host}:{args.port}/<business entity>")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,235 @@
+import os
+import re
+from datetime import date, datetime
+
+from spec_slicer import get_spec_slicer, HTTP_METHODS
+
+DOCUMENTATION_FOLDER = "system_documentation"
+
+_UUID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+_JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "object": (dict,),
+    "array": (list,),
+}
+
+def _is_valid_format(value, value_format):
+    if value_format == "uuid":
+        return bool(_UUID_PATTERN.match(value))
+    if value_format == "date":
+        try:
+            date.fromisoformat(value)
+            return True
+        except ValueError:
+            return False
+    if value_format == "date-time":
+        try:
+            datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return True
+        except ValueError:
+            return False
+    return True
+
+class SchemaChecker:
+    """
+    Checks JSON values against the OpenAPI schema subset used by the API documentation:
+    type, nullable, enum, format, length and range limits, pattern, required,
+    properties, items, allOf, anyOf and oneOf. $ref is resolved through the
+    spec's memoized SpecSlicer.
+
+    With strict_properties, properties that an object schema does not declare
+    are reported, since the OData services reject unknown fields.
+    """
+
+    def __init__(self, slicer, strict_properties=False):
+        self.slicer = slicer
+        self.strict_properties = strict_properties
+
+    def check(self, value, schema, location="body"):
+        """
+        Returns a list of error messages; an empty list means the value matches the schema.
+        """
+        errors = []
+        self._check(value, schema, location, errors)
+        return errors
+
+    def _check(self, value, schema, location, errors):
+        if not isinstance(schema, dict):
+            return
+        if "$ref" in schema:
+            try:
+                schema = self.slicer.resolve(schema["$ref"])
+            except KeyError:
+                errors.append(f"{location}: unresolvable reference {schema['$ref']}")
+                return
+
+        for sub_schema in schema.get("allOf", []):
+            self._check(value, sub_schema, location, errors)
+        for keyword in ("anyOf", "oneOf"):
+            if keyword in schema:
+                alternatives = [self.check(value, sub_schema, location) for sub_schema in schema[keyword]]
+                if not any(not alternative for alternative in alternatives):
+                    errors.append(f"{location}: does not match any of the {keyword} schemas")
+
+        if value is None:
+            if not schema.get("nullable", False) and "type" in schema:
+                errors.append(f"{location}: must not be null")
+            return
+
+        expected_type = schema.get("type")
+        if expected_type in _JSON_TYPES:
+            # bool is a subclass of int but never a valid number in JSON schema
+            if not isinstance(value, _JSON_TYPES[expected_type]) or (isinstance(value, bool) and expected_type != "boolean"):
+                errors.append(f"{location}: expected {expected_type}, got {type(value).__name__}")
+                return
+
+        if "enum" in schema and value not in schema["enum"]:
+            errors.append(f"{location}: {value!r} is not one of {schema['enum']}")
+
+        if isinstance(value, str):
+            if "maxLength" in schema and len(value) > schema["maxLength"]:
+                errors.append(f"{location}: longer than {schema['maxLength']} characters")
+            if "minLength" in schema and len(value) < schema["minLength"]:
+                errors.append(f"{location}: shorter than {schema['minLength']} characters")
+            if "format" in schema and not _is_valid_format(value, schema["format"]):
+                errors.append(f"{location}: {value!r} is not a valid {schema['format']}")
+            if "pattern" in schema and not re.search(schema["pattern"], value):
+                errors.append(f"{location}: {value!r} does not match pattern {schema['pattern']}")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if "minimum" in schema and value < schema["minimum"]:
+                errors.append(f"{location}: {value} is below the minimum {schema['minimum']}")
+            if "maximum" in schema and value > schema["maximum"]:
+                errors.append(f"{location}: {value} is above the maximum {schema['maximum']}")
+        elif isinstance(value, dict):
+            properties = schema.get("properties", {})
+            for name in schema.get("required", []):
+                if name not in value:
+                    errors.append(f"{location}: missing required property '{name}'")
+            for name, property_value in value.items():
+                if name in properties:
+                    self._check(property_value, properties[name], f"{location}.{name}", errors)
+                elif self.strict_properties and properties and not schema.get("additionalProperties", False):
+                    errors.append(f"{location}: unknown property '{name}'")
+        elif isinstance(value, list) and "items" in schema:
+            for i, item in enumerate(value):
+                self._check(item, schema["items"], f"{location}[{i}]", errors)
+
+class SpecValidator:
+    """
+    Validates API calls (method, endpoint, body) against one OpenAPI document.
+
+    All path templates are compiled once into regular expressions in which every
+    "{...}" segment (e.g. {ID} or {UUID}) matches one concrete path segment.
+    OData JSON $batch bodies are validated request by request.
+    """
+
+    def __init__(self, slicer, strict_properties=False):
+        self.slicer = slicer
+        self.checker = SchemaChecker(slicer, strict_properties)
+        self.operations = []
+        for path, path_item in slicer.spec.get("paths", {}).items():
+            pattern = "^" + re.sub(r"\\\{[^/]*?\\\}", "[^/]+", re.escape(path)) + "/?$"
+            methods = {method.upper(): operation for method, operation in path_item.items() if method.lower() in HTTP_METHODS}
+            literal_segments = sum(1 for segment in path.split("/") if segment and "{" not in segment)
+            self.operations.append((re.compile(pattern), path, methods, literal_segments))
+        # Prefer the most specific template when several match
+        self.operations.sort(key=lambda operation: -operation[3])
+
+    def match(self, endpoint):
+        """
+        Returns (path template, operations by method) of the endpoint, or (None, None).
+        """
+        endpoint = "/" + endpoint.split("?", 1)[0].lstrip("/")
+        for pattern, path, methods, _ in self.operations:
+            if pattern.match(endpoint):
+                return path, methods
+        return None, None
+
+    def validate(self, method, endpoint, body=None):
+        """
+        Returns the list of problems of an API call; an empty list means the call is valid.
+        """
+        if not isinstance(endpoint, str) or not endpoint:
+            return ["missing endpoint"]
+        method = str(method or "").upper()
+        path, methods = self.match(endpoint)
+        if path is None:
+            return [f"unknown endpoint {endpoint}"]
+        if method not in methods:
+            return [f"method {method} not allowed for {path} (allowed: {', '.join(sorted(methods)) or 'none'})"]
+        if path.endswith("/$batch"):
+            return self.validate_batch(body)
+
+        request_body = methods[method].get("requestBody")
+        if request_body is None:
+            return []
+        if "$ref" in request_body:
+            request_body = self.slicer.resolve(request_body["$ref"])
+        if body is None:
+            return ["missing request body"] if request_body.get("required") else []
+        json_content = request_body.get("content", {}).get("application/json")
+        if json_content is None:
+            return []
+        return self.checker.check(body, json_content.get("schema", {}))
+
+    def validate_batch(self, body):
+        """
+        Validates an OData JSON batch body ({"requests": [{"method", "url", "body"}, ...]}).
+        """
+        if not isinstance(body, dict) or not isinstance(body.get("requests"), list):
+            return ["$batch body must be an object with a 'requests' list"]
+        errors = []
+        for i, request in enumerate(body["requests"]):
+            if not isinstance(request, dict):
+                errors.append(f"requests[{i}]: must be an object")
+                continue
+            # Generated batches sometimes name the URL "endpoint" like the top-level call
+            url = request.get("url", request.get("endpoint"))
+            for error in self.validate(request.get("method"), url, request.get("body")):
+                errors.append(f"requests[{i}]: {error}")
+        return errors
+
+class OfflineValidator:
+    """
+    Validates API test case outputs without network access, using the
+    API_*.json documentation of each business entity. Spec validators are
+    compiled on first use and cached for the lifetime of the object.
+    """
+
+    def __init__(self, documentation_folder=DOCUMENTATION_FOLDER, strict_properties=False):
+        self.documentation_folder = documentation_folder
+        self.strict_properties = strict_properties
+        self._validators = {}
+
+    def spec_validator(self, domain):
+        """
+        Returns the SpecValidator of a business entity, or None if it has no API documentation.
+        """
+        if domain not in self._validators:
+            domain_folder = os.path.join(self.documentation_folder, domain)
+            api_file = None
+            if os.path.isdir(domain_folder):
+                api_file = next((f for f in os.listdir(domain_folder) if f.startswith("API_") and f.endswith(".json")), None)
+            self._validators[domain] = SpecValidator(
+                get_spec_slicer(os.path.join(domain_folder, api_file)),
+                strict_properties=self.strict_properties
+            ) if api_file else None
+        return self._validators[domain]
+
+    def validate(self, domain, output):
+        """
+        Checks a test case output ({"method", "endpoint", "body"}) of a business entity.
+
+        Returns:
+            tuple: (is_valid, errors) with the list of problems found.
+        """
+        validator = self.spec_validator(domain)
+        if validator is None:
+            return False, [f"no API documentation found for {domain}"]
+        if not isinstance(output, dict):
+            return False, ["output must be an object"]
+        errors = validator.validate(output.get("method"), output.get("endpoint"), output.get("body"))
+        return not errors, errors
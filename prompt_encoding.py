@@ -0,0 +1,90 @@
+import re
+import logging
+
+from case_selection import estimate_tokens
+from metrics import metrics
+
+# Explains the compact notation to the model; prepended to every encoded schema
+SCHEMA_LEGEND = (
+    "Notation: 'TABLE <name> -- <description>' starts a table, every following '  <column> <format> -- <description>' "
+    "line is one of its columns. '-- see <table>' means the column is documented identically in that table."
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+def _collapse(text):
+    return _WHITESPACE.sub(" ", str(text or "")).strip()
+
+def column_key(column):
+    """
+    Identifies a column by its name, format and description, so identical columns can be deduplicated.
+    """
+    return column.get("name"), column.get("format"), _collapse(column.get("description"))
+
+def encode_schema(schema, known_tables=None, seen_columns=None):
+    """
+    Renders a database structure ({"tables": [{"name", "description", "columns"}]}) as terse DDL-like lines.
+
+    Tables that are contained unchanged in known_tables (name -> table, e.g.
+    the combined structure already in the prompt) are only listed by name.
+    Columns that were already rendered with the same name, format and
+    description (tracked in seen_columns, column key -> table name) are reduced
+    to a reference to the table that describes them.
+
+    Args:
+        schema (dict): Database structure in the format of combined_db.json.
+        known_tables (dict, optional): Tables already present in the prompt by name.
+        seen_columns (dict, optional): Columns already rendered; updated in place.
+
+    Returns:
+        str: The encoded structure.
+    """
+    known_tables = known_tables or {}
+    seen_columns = {} if seen_columns is None else seen_columns
+    lines = []
+    referenced = []
+    for table in schema.get("tables", []):
+        name = table.get("name", "")
+        if known_tables.get(name) == table:
+            referenced.append(name)
+            continue
+        description = _collapse(table.get("description"))
+        lines.append(f"TABLE {name} -- {description}" if description else f"TABLE {name}")
+        for column in table.get("columns", []):
+            key = column_key(column)
+            column_format = column.get("format") or "string"
+            if key in seen_columns:
+                lines.append(f"  {column.get('name')} {column_format} -- see {seen_columns[key]}")
+                continue
+            seen_columns[key] = name
+            lines.append(f"  {column.get('name')} {column_format} -- {key[2]}" if key[2] else f"  {column.get('name')} {column_format}")
+    if referenced:
+        lines.append(f"Tables as described above: {', '.join(referenced)}")
+    return "\n".join(lines)
+
+def report_prompt_size(label, verbose_chars, compact_prompt, **labels):
+    """
+    Logs and records the size of a prompt before and after compact encoding.
+
+    Args:
+        label (str): Name of the prompt in the log, e.g. the business domain.
+        verbose_chars (int): Length the prompt would have with the documentation as read from the files.
+        compact_prompt (str): The prompt that is sent.
+
+    Returns:
+        dict: {"chars_before", "chars_after", "tokens_before", "tokens_after"}.
+    """
+    report = {
+        "chars_before": verbose_chars,
+        "chars_after": len(compact_prompt),
+        "tokens_before": verbose_chars // 4 + 1,
+        "tokens_after": estimate_tokens(compact_prompt),
+    }
+    saved = 1 - report["chars_after"] / report["chars_before"] if report["chars_before"] else 0.0
+    logging.info(
+        f"Prompt {label}: {report['chars_before']} -> {report['chars_after']} chars, "
+        f"~{report['tokens_before']} -> ~{report['tokens_after']} tokens ({saved:.0%} smaller)"
+    )
+    metrics.count("prompt_estimated_tokens_total", report["tokens_before"], encoding="verbose", **labels)
+    metrics.count("prompt_estimated_tokens_total", report["tokens_after"], encoding="compact", **labels)
+    return report
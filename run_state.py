@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+from humanize_manifest import content_hash
+from metrics import metrics
+
+# Location of the run-state database
+RUN_STATE_PATH = "run_state.sqlite3"
+
+# Folder of every stage in the exported layout
+STAGE_FOLDERS = {
+    "generated": "raw_testcases",
+    "humanized": "modified_input_testcases",
+    "failed": "modified_input_testcases",
+    "transient": "modified_input_testcases",
+    "validated": "validated_testcases",
+}
+STAGES = tuple(STAGE_FOLDERS)
+# Stages a test case still has to leave before it counts as done
+REMAINING_STAGES = ("humanized", "failed", "transient")
+# Folders of the layout in pipeline order; a test case found in several of them is in the last one
+FOLDER_STAGES = (("generated", "raw_testcases"), ("humanized", "modified_input_testcases"), ("validated", "validated_testcases"))
+_STAGE_RANKS = {"generated": 0, "humanized": 1, "failed": 1, "transient": 1, "validated": 2}
+# Pipeline step that moves a test case into every stage, used as the stage label of the metrics
+STAGE_STEPS = {
+    "generated": "generate",
+    "humanized": "humanize",
+    "failed": "validate",
+    "transient": "validate",
+    "validated": "validate",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS test_cases (
+    kind TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    test_case TEXT NOT NULL,
+    raw_hash TEXT,
+    humanized_hash TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, domain, file_name)
+);
+CREATE INDEX IF NOT EXISTS test_cases_stage ON test_cases (kind, stage, domain);
+CREATE TABLE IF NOT EXISTS stage_events (
+    kind TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    at REAL NOT NULL,
+    duration REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS stage_events_case ON stage_events (kind, domain, file_name);
+"""
+
+class RunStateStore:
+    """
+    Run state of all test cases in one SQLite database.
+
+    Every test case is a row keyed by (kind, domain, file_name) with its current
+    stage ("generated", "humanized", "validated", "failed" or "transient"), the
+    current JSON content, the hashes of the raw and the humanized version, the
+    number of validation attempts and the last error. Every stage transition is
+    appended to stage_events with its timestamp and, if known, its duration.
+
+    The database runs in WAL mode and every thread gets its own connection, so
+    concurrent workers can record results while others read. The folders
+    raw_testcases, modified_input_testcases and validated_testcases are an
+    export view of this state (see export_folders); import_folders builds the
+    state from folders written by earlier runs, and sync_folders reconciles
+    the two file by file before every validation run. Test cases removed with
+    remove() only remain in stage_events, with the stage "removed".
+    """
+
+    def __init__(self, path=RUN_STATE_PATH):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def record(self, kind, domain, file_name, stage, test_case, raw_hash=None, humanized_hash=None,
+               error=None, duration=None, attempt=False, count_metric=True):
+        """
+        Moves a test case to stage, storing its current content.
+
+        Args:
+            kind (str): "API" or "SQL".
+            domain (str): Business entity (subfolder name).
+            file_name (str): File name of the test case.
+            stage (str): New stage, one of STAGES.
+            test_case (dict): Current content of the test case.
+            raw_hash (str, optional): Hash of the raw test case; kept if not given.
+            humanized_hash (str, optional): Hash of the humanized test case; kept if not given.
+            error (dict, optional): Error log of a failed or transient attempt; cleared otherwise.
+            duration (float, optional): Seconds the stage took, e.g. the request latency.
+            attempt (bool): Whether this was a validation attempt that counts towards attempts.
+            count_metric (bool): Whether the transition counts towards the test_cases_total metric (off for imports).
+        """
+        if stage not in STAGE_FOLDERS:
+            raise ValueError(f"Unknown stage {stage!r}")
+        # Error logs are kept in their own column and only added back on export
+        test_case = {key: value for key, value in test_case.items() if key not in ("error_log", "transient_error_log")}
+        now = time.time()
+        error_json = json.dumps(error, ensure_ascii=False) if error is not None else None
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                """
+                INSERT INTO test_cases (kind, domain, file_name, stage, test_case, raw_hash, humanized_hash,
+                                        attempts, error, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, domain, file_name) DO UPDATE SET
+                    stage = excluded.stage,
+                    test_case = excluded.test_case,
+                    raw_hash = COALESCE(excluded.raw_hash, raw_hash),
+                    humanized_hash = COALESCE(excluded.humanized_hash, humanized_hash),
+                    attempts = attempts + excluded.attempts,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+                """,
+                (kind, domain, file_name, stage, json.dumps(test_case, ensure_ascii=False), raw_hash,
+                 humanized_hash, int(attempt), error_json, now, now)
+            )
+            connection.execute(
+                "INSERT INTO stage_events (kind, domain, file_name, stage, at, duration, error) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, domain, file_name, stage, now, duration, error_json)
+            )
+        if count_metric:
+            metrics.count("test_cases_total", kind=kind, domain=domain, stage=STAGE_STEPS[stage], outcome=stage)
+
+    def remove(self, kind, domain, file_name):
+        """
+        Forgets a test case, e.g. one whose file was deleted by hand; the removal is kept in stage_events.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM test_cases WHERE kind = ? AND domain = ? AND file_name = ?", (kind, domain, file_name)
+            )
+            connection.execute(
+                "INSERT INTO stage_events (kind, domain, file_name, stage, at) VALUES (?, ?, ?, 'removed', ?)",
+                (kind, domain, file_name, time.time())
+            )
+
+    def counts(self, kind=None):
+        """
+        Returns the number of test cases per stage, optionally for one kind only.
+        """
+        query = "SELECT stage, COUNT(*) FROM test_cases"
+        parameters = ()
+        if kind is not None:
+            query += " WHERE kind = ?"
+            parameters = (kind,)
+        return dict(self._connection().execute(query + " GROUP BY stage", parameters).fetchall())
+
+    def counts_by_domain(self, kind, stages=REMAINING_STAGES):
+        """
+        Returns the number of test cases of kind in the given stages per domain.
+        """
+        placeholders = ", ".join("?" for _ in stages)
+        rows = self._connection().execute(
+            f"SELECT domain, COUNT(*) FROM test_cases WHERE kind = ? AND stage IN ({placeholders}) GROUP BY domain ORDER BY domain",
+            (kind, *stages)
+        ).fetchall()
+        return dict(rows)
+
+    def test_cases(self, kind, stages=REMAINING_STAGES):
+        """
+        Yields (domain, file_name, test_case) of kind in the given stages, e.g. to resume validation.
+        """
+        placeholders = ", ".join("?" for _ in stages)
+        # Fetched up front so callers can record results while iterating
+        rows = self._connection().execute(
+            f"SELECT domain, file_name, test_case FROM test_cases WHERE kind = ? AND stage IN ({placeholders}) ORDER BY domain, file_name",
+            (kind, *stages)
+        ).fetchall()
+        for domain, file_name, test_case in rows:
+            yield domain, file_name, json.loads(test_case)
+
+    def history(self, kind, domain, file_name):
+        """
+        Returns the stage transitions of a test case as (stage, at, duration, error) tuples.
+        """
+        rows = self._connection().execute(
+            "SELECT stage, at, duration, error FROM stage_events WHERE kind = ? AND domain = ? AND file_name = ? ORDER BY at",
+            (kind, domain, file_name)
+        ).fetchall()
+        return [(stage, at, duration, json.loads(error) if error else None) for stage, at, duration, error in rows]
+
+    def export_folders(self, kind, root="."):
+        """
+        Writes the folder layout of kind (raw, humanized and validated test cases) from the recorded state.
+
+        Returns:
+            int: Number of files written.
+        """
+        written = 0
+        cursor = self._connection().execute(
+            "SELECT domain, file_name, stage, test_case, error FROM test_cases WHERE kind = ?", (kind,)
+        )
+        for domain, file_name, stage, test_case, error in cursor:
+            folder = os.path.join(root, STAGE_FOLDERS[stage], kind, domain)
+            os.makedirs(folder, exist_ok=True)
+            data = json.loads(test_case)
+            if error is not None:
+                data["transient_error_log" if stage == "transient" else "error_log"] = json.loads(error)
+            with open(os.path.join(folder, file_name), "w", encoding="utf-8") as file:
+                json.dump(data, file, indent=2, ensure_ascii=False)
+            written += 1
+        return written
+
+    def _folder_files(self, kind, root):
+        """
+        Returns {(domain, file_name): (folder stage, path)} of the folder layout of kind, the most advanced folder winning.
+        """
+        files = {}
+        for stage, folder in FOLDER_STAGES:
+            kind_folder = os.path.join(root, folder, kind)
+            if not os.path.isdir(kind_folder):
+                continue
+            for domain in os.listdir(kind_folder):
+                domain_folder = os.path.join(kind_folder, domain)
+                if not os.path.isdir(domain_folder):
+                    continue
+                for file_name in os.listdir(domain_folder):
+                    if file_name.endswith(".json"):
+                        files[(domain, file_name)] = (stage, os.path.join(domain_folder, file_name))
+        return files
+
+    def _record_file(self, kind, domain, file_name, stage, raw):
+        """
+        Records a test case file as found in the folder of stage; error logs decide between humanized, failed and transient.
+
+        Returns:
+            bool: Whether the file could be parsed and was recorded.
+        """
+        try:
+            data = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            return False
+        file_stage, error = stage, None
+        if "transient_error_log" in data:
+            file_stage, error = "transient", data.pop("transient_error_log")
+        elif "error_log" in data and stage == "humanized":
+            file_stage, error = "failed", data.pop("error_log")
+        hashes = {"raw_hash": content_hash(raw)} if stage == "generated" else {"humanized_hash": content_hash(raw)}
+        self.record(kind, domain, file_name, file_stage, data, error=error, count_metric=False, **hashes)
+        return True
+
+    def import_folders(self, kind, root="."):
+        """
+        Records all test cases found in the folder layout of kind, the most advanced folder winning.
+
+        Returns:
+            int: Number of test cases recorded.
+        """
+        imported = 0
+        for (domain, file_name), (stage, path) in self._folder_files(kind, root).items():
+            with open(path, "rb") as file:
+                imported += self._record_file(kind, domain, file_name, stage, file.read())
+        return imported
+
+    def sync_folders(self, kind, root="."):
+        """
+        Reconciles the folder layout of kind with the recorded state, test case by test case.
+
+        A file is recorded if its (kind, domain, file_name) is unknown, e.g. written
+        by a run before the run state existed, or if it sits in a more advanced
+        folder than the recorded stage. Humanized test cases that are still to be
+        validated are compared with the recorded content (ignoring error logs); if
+        the file was edited by hand, its content is recorded and it goes back to
+        "humanized" so the next validation picks the edit up. A test case still to
+        be validated whose file is no longer in modified_input_testcases (or a
+        more advanced folder) was deleted by hand and is removed from the state,
+        so it is neither validated nor written again.
+
+        Returns:
+            int: Number of test cases recorded or removed.
+        """
+        rows = {
+            (domain, file_name): (stage, test_case, humanized_hash)
+            for domain, file_name, stage, test_case, humanized_hash in self._connection().execute(
+                "SELECT domain, file_name, stage, test_case, humanized_hash FROM test_cases WHERE kind = ?", (kind,)
+            ).fetchall()
+        }
+        files = self._folder_files(kind, root)
+        removed = 0
+        for key, (stage, _, _) in list(rows.items()):
+            if stage in REMAINING_STAGES and files.get(key, ("generated",))[0] == "generated":
+                self.remove(kind, *key)
+                del rows[key]
+                removed += 1
+        if removed:
+            print(f"Removed {removed} {kind} test cases whose files were deleted from {self.path}")
+
+        synced = 0
+        for (domain, file_name), (stage, path) in files.items():
+            row = rows.get((domain, file_name))
+            if row is not None and _STAGE_RANKS[row[0]] > _STAGE_RANKS[stage]:
+                continue
+            if row is not None and _STAGE_RANKS[row[0]] == _STAGE_RANKS[stage] and stage != "humanized":
+                continue
+            with open(path, "rb") as file:
+                raw = file.read()
+            if row is None or _STAGE_RANKS[row[0]] < _STAGE_RANKS[stage]:
+                synced += self._record_file(kind, domain, file_name, stage, raw)
+                continue
+            # Humanized test case known to the run state: only a changed content counts
+            if content_hash(raw) == row[2]:
+                continue
+            try:
+                data = json.loads(raw.decode("utf-8"))
+            except ValueError:
+                continue
+            data.pop("error_log", None)
+            data.pop("transient_error_log", None)
+            if data != json.loads(row[1]):
+                self.record(kind, domain, file_name, "humanized", data, humanized_hash=content_hash(raw), count_metric=False)
+                synced += 1
+        if synced:
+            print(f"Recorded {synced} {kind} test cases from the folders into {self.path}")
+        return synced + removed
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_run_state(path=RUN_STATE_PATH):
+    """
+    Returns the shared RunStateStore of path.
+    """
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = RunStateStore(path)
+        return _stores[path]
+
+
+if __name__ == "__main__":
+    # python run_state.py import|sync|export|counts [API|SQL]
+    command = sys.argv[1] if len(sys.argv) > 1 else "counts"
+    kinds = sys.argv[2:] or ["API", "SQL"]
+    store = get_run_state()
+    for kind in kinds:
+        if command == "import":
+            print(f"{kind}: imported {store.import_folders(kind)} test cases")
+        elif command == "sync":
+            print(f"{kind}: recorded {store.sync_folders(kind)} test cases")
+        elif command == "export":
+            print(f"{kind}: exported {store.export_folders(kind)} test cases")
+        else:
+            print(f"{kind}: {store.counts(kind)}")
@@ -0,0 +1,72 @@
+import json
+from collections import deque
+
+# Columns shared by more than this share of all tables (e.g. ID, UUID, ChangeStateID)
+# are generic attributes rather than join keys and do not connect tables
+MAX_JOIN_COLUMN_SHARE = 0.25
+# Default number of join hops around a domain's tables kept in its prompt
+DEFAULT_JOIN_HOPS = 1
+
+class SchemaGraph:
+    """
+    Join graph of a database structure in the format of combined_db.json.
+
+    Tables are the nodes; two tables are connected if they share a column
+    name, which is how the SQL generation prompt defines joins. Columns that
+    appear in more than max_column_share of all tables are treated as generic
+    attributes and create no edges, otherwise every table would be one hop
+    away from every other one.
+
+    Example:
+        graph = SchemaGraph.from_file("system_documentation/combined_db.json")
+        schema = graph.prune(["BankAccount"], hops=1)
+    """
+
+    def __init__(self, schema, max_column_share=MAX_JOIN_COLUMN_SHARE):
+        self.schema = schema
+        self.tables = {table.get("name"): table for table in schema.get("tables", [])}
+        # Column name -> tables containing it
+        self.column_index = {}
+        for name, table in self.tables.items():
+            for column in table.get("columns", []):
+                self.column_index.setdefault(column.get("name"), set()).add(name)
+        max_tables = max(2, int(len(self.tables) * max_column_share))
+        self.join_columns = {
+            column: tables for column, tables in self.column_index.items() if 1 < len(tables) <= max_tables
+        }
+        # Table -> {neighbouring table: shared join columns}
+        self.adjacency = {name: {} for name in self.tables}
+        for column, tables in self.join_columns.items():
+            for table in tables:
+                for other in tables:
+                    if other != table:
+                        self.adjacency[table].setdefault(other, set()).add(column)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def neighborhood(self, tables, hops=DEFAULT_JOIN_HOPS):
+        """
+        Returns the tables within hops joins of any of the given tables (including them), by breadth-first search.
+        Unknown table names are ignored.
+        """
+        distances = {table: 0 for table in tables if table in self.tables}
+        pending = deque(distances)
+        while pending:
+            table = pending.popleft()
+            if distances[table] >= hops:
+                continue
+            for neighbour in self.adjacency[table]:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[table] + 1
+                    pending.append(neighbour)
+        return set(distances)
+
+    def prune(self, tables, hops=DEFAULT_JOIN_HOPS):
+        """
+        Returns the structure reduced to the neighborhood of the given tables, in the original table order.
+        """
+        keep = self.neighborhood(tables, hops)
+        return {**self.schema, "tables": [table for table in self.schema.get("tables", []) if table.get("name") in keep]}
@@ -0,0 +1,72 @@
+import re
+import array
+import hashlib
+
+# Signature value of empty sets; larger than any 32-bit hash so it never matches
+_EMPTY = 1 << 32
+
+def normalize_text(text):
+    """
+    Lowercases text and drops everything but letters and digits, so that
+    "bank_account", "BankAccount" and "/BankAccounts" share shingles.
+    """
+    return re.sub(r'[^a-z0-9]+', '', text.lower())
+
+def shingles(text, n=4):
+    """
+    Returns the set of character n-grams of the normalized text.
+    """
+    normalized = normalize_text(text)
+    if len(normalized) <= n:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+class MinHasher:
+    """
+    Computes MinHash signatures whose per-position agreement estimates the
+    Jaccard similarity of the underlying shingle sets.
+
+    Each of the num_perm hash functions is a 32-bit slice of one seeded
+    SHAKE-128 digest per shingle, so a signature costs a single hash call per
+    shingle and an element-wise minimum. Signatures are stable across runs.
+    """
+
+    def __init__(self, num_perm=64, seed=1):
+        self.num_perm = num_perm
+        self._seed = seed.to_bytes(8, "little")
+
+    def signature(self, shingle_set):
+        """
+        Returns the MinHash signature (tuple of num_perm ints) of a shingle set.
+        An empty set yields a signature that matches nothing.
+        """
+        if not shingle_set:
+            return tuple([_EMPTY] * self.num_perm)
+        digest_size = 4 * self.num_perm
+        rows = [
+            array.array("I", hashlib.shake_128(self._seed + s.encode("utf-8")).digest(digest_size))
+            for s in shingle_set
+        ]
+        return tuple(map(min, zip(*rows)))
+
+def estimate_jaccard(signature_a, signature_b):
+    """
+    Estimates the Jaccard similarity of two sets from their MinHash signatures.
+    """
+    if not signature_a or len(signature_a) != len(signature_b):
+        return 0.0
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b and a != _EMPTY)
+    return matches / len(signature_a)
+
+def estimate_containment(signature_a, size_a, signature_b, size_b):
+    """
+    Estimates which share of set A is contained in set B.
+
+    Unlike Jaccard, containment does not penalize B for being much larger than
+    A, which matters when a short focus text is compared to full test cases.
+    """
+    if not size_a:
+        return 0.0
+    jaccard = estimate_jaccard(signature_a, signature_b)
+    intersection = jaccard / (1 + jaccard) * (size_a + size_b)
+    return min(intersection / size_a, 1.0)
@@ -0,0 +1,158 @@
+import os
+import json
+import threading
+
+# Keys of a path item that describe HTTP operations
+HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+
+class SpecSlicer:
+    """
+    Cuts a single operation out of an OpenAPI document.
+
+    A slice contains the path item's shared parameters, the requested operation
+    and the transitive closure of every "#/components/..." object it references
+    through $ref, so it is self-contained and can be sent inline instead of the
+    whole document. $ref resolution is memoized per spec: the direct references
+    of every component are collected once and reused by all later slices.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self._resolved = {}
+        self._direct_refs = {}
+        self._slices = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, ref):
+        """
+        Returns the object a local $ref (e.g. "#/components/schemas/Foo") points to.
+
+        Raises:
+            KeyError: If the reference is not local or does not exist.
+        """
+        if ref in self._resolved:
+            return self._resolved[ref]
+        if not ref.startswith("#/"):
+            raise KeyError(f"Only local references are supported: {ref}")
+        target = self.spec
+        for part in ref[2:].split("/"):
+            part = part.replace("~1", "/").replace("~0", "~")
+            target = target[part]
+        self._resolved[ref] = target
+        return target
+
+    @staticmethod
+    def collect_refs(obj):
+        """
+        Returns all $ref values found anywhere inside obj.
+        """
+        refs = set()
+        stack = [obj]
+        while stack:
+            current = stack.pop()
+            if isinstance(current, dict):
+                ref = current.get("$ref")
+                if isinstance(ref, str):
+                    refs.add(ref)
+                stack.extend(current.values())
+            elif isinstance(current, list):
+                stack.extend(current)
+        return refs
+
+    def ref_closure(self, refs):
+        """
+        Returns refs together with everything they reference, directly or transitively.
+        """
+        closure = set()
+        pending = list(refs)
+        while pending:
+            ref = pending.pop()
+            if ref in closure:
+                continue
+            closure.add(ref)
+            if ref not in self._direct_refs:
+                try:
+                    self._direct_refs[ref] = self.collect_refs(self.resolve(ref))
+                except (KeyError, TypeError):
+                    self._direct_refs[ref] = set()
+            pending.extend(self._direct_refs[ref] - closure)
+        return closure
+
+    def operations(self):
+        """
+        Yields (path, method) for every HTTP operation of the spec.
+        """
+        for path, path_item in self.spec.get("paths", {}).items():
+            for method in path_item:
+                if method.lower() in HTTP_METHODS:
+                    yield path, method
+
+    def slice(self, path, method):
+        """
+        Returns a minimal OpenAPI document containing only the given operation.
+
+        Args:
+            path (str): Path as listed under "paths", e.g. "/BankAccounts({ID})".
+            method (str): HTTP method key of the operation, e.g. "post".
+
+        Returns:
+            dict: OpenAPI document with the operation and the components it references.
+        """
+        key = (path, method.lower())
+        with self._lock:
+            if key in self._slices:
+                return self._slices[key]
+
+            path_item = self.spec["paths"][path]
+            operation_key = next(m for m in path_item if m.lower() == method.lower())
+            sliced_path_item = {operation_key: path_item[operation_key]}
+            if "parameters" in path_item:
+                sliced_path_item["parameters"] = path_item["parameters"]
+
+            components = {}
+            for ref in sorted(self.ref_closure(self.collect_refs(sliced_path_item))):
+                parts = ref[2:].split("/")
+                if len(parts) != 3 or parts[0] != "components":
+                    continue
+                try:
+                    components.setdefault(parts[1], {})[parts[2]] = self.resolve(ref)
+                except KeyError:
+                    continue
+
+            spec_slice = {
+                "openapi": self.spec.get("openapi"),
+                "info": {
+                    "title": self.spec.get("info", {}).get("title"),
+                    "version": self.spec.get("info", {}).get("version"),
+                },
+                "paths": {path: sliced_path_item},
+                "components": components,
+            }
+            self._slices[key] = spec_slice
+            return spec_slice
+
+    def slice_json(self, path, method):
+        """
+        Returns the slice serialized compactly for use in a prompt.
+        """
+        return json.dumps(self.slice(path, method), separators=(",", ":"), ensure_ascii=False)
+
+
+_slicers = {}
+_slicers_lock = threading.Lock()
+
+def get_spec_slicer(api_path):
+    """
+    Returns a shared SpecSlicer for an OpenAPI file, reloaded only when the file changes.
+    """
+    stat = os.stat(api_path)
+    key = os.path.abspath(api_path)
+    with _slicers_lock:
+        cached = _slicers.get(key)
+        if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+    with open(api_path, "r", encoding="utf-8") as f:
+        slicer = SpecSlicer(json.load(f))
+    with _slicers_lock:
+        _slicers[key] = ((stat.st_mtime_ns, stat.st_size), slicer)
+    return slicer
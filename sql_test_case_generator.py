@@ -3,9 +3,42 @@ import json
 import re
 import time
 import logging
+from concurrent.futures import as_completed
 from llm_connector import OpenAIConnector
+from domain_test_case_store import DomainTestCaseStore
+from case_selection import select_previous_cases
+from deduplication import DuplicateIndex
+from humanize_manifest import content_hash
+from run_state import get_run_state
+from metrics import metric_labels
+from prompt_encoding import SCHEMA_LEGEND, encode_schema, report_prompt_size
+from schema_graph import SchemaGraph
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Approximate number of prompt tokens spent on previously generated test cases per request
+previous_cases_token_budget = 4000
+# Handling of near-duplicate test cases: "drop" them, "flag" them in the written file, or "off"
+dedup_mode = "drop"
+# Send schemas as DDL-like lines and previous test cases as minified records instead of pretty-printed JSON
+compact_prompts = True
+# Only send the combined tables within this many join hops of the domain's tables (None = all tables)
+join_hops = 1
+
+user_prompt_template = """
+Combined Database Structure ({combined_db_scope}):
+{combined_db}
+
+Database Structure for this business domain:
+{domain_db}
+
+Semantic Description for this business domain:
+{semantic_description}
+
+Previously Generated Test Cases:
+{previous_cases}
+
+Generate {total_test_cases} test cases distributed evenly across the following difficulty levels: {difficulties}.
+The test cases should focus on the business domain '{subdir}', but need to involve related business objects from the combined database.
+"""
 
 system_prompt = """
 You are a test case generator. You will be provided with:
@@ -53,23 +86,37 @@ def extract_json_array(text):
                 pass
     raise ValueError("No valid JSON array could be extracted.")
 
-def get_previous_test_cases(output_dir):
-    test_cases = []
-    if os.path.exists(output_dir):
-        for file in os.listdir(output_dir):
-            if file.endswith(".json"):
-                try:
-                    with open(os.path.join(output_dir, file), 'r') as f:
-                        test_case = json.load(f)
-                        if isinstance(test_case, list):
-                            test_cases.extend(test_case)
-                        else:
-                            test_cases.append(test_case)
-                except Exception:
-                    continue
-    return test_cases
-
-def generate_test_cases(test_cases_per_difficulty=1):
+def save_test_cases(parsed_list, output_dir, subdir, difficulties, store=None, dedup=None, on_saved=None):
+    count = {level: 0 for level in difficulties}
+    for parsed in parsed_list:
+        # Drop or flag test cases that duplicate an existing or an earlier one
+        duplicate = dedup.check(parsed) if dedup is not None and dedup_mode != "off" else None
+        if duplicate is not None:
+            reason, similar_to = duplicate
+            if dedup_mode == "drop":
+                logging.info(f"Dropped test case in {output_dir} ({reason} of {similar_to})")
+                continue
+            parsed["near_duplicate"] = {"reason": reason, "similar_to": similar_to}
+
+        diff = parsed.get("difficulty", "Unknown")
+        idx = count.get(diff, 0) + 1
+        count[diff] = idx
+
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        filename = f"{subdir}_{diff}_{idx}_{timestamp}.json"
+        output_path = os.path.join(output_dir, filename)
+        with open(output_path, "w") as outfile:
+            json.dump(parsed, outfile, indent=2)
+        get_run_state().record("SQL", subdir, filename, "generated", parsed, raw_hash=content_hash(json.dumps(parsed, indent=2)))
+        if store is not None:
+            store.add(parsed, filename)
+        if dedup is not None:
+            dedup.add(parsed, filename)
+        logging.info(f"Generated: {output_path}")
+        if on_saved is not None:
+            on_saved(subdir, filename, output_path, parsed)
+
+def generate_test_cases(test_cases_per_difficulty=1, max_concurrency=None, on_saved=None, connector=None):
     """
     Generates SQL test cases for each business domain based on database structure and semantic descriptions.
 
@@ -85,13 +132,14 @@ def generate_test_cases(test_cases_per_difficulty=1):
             - Loads the domain-specific database structure and semantic description.
             - Retrieves previously generated test cases for the domain.
             - Constructs a prompt for the AI model including all relevant information.
-            - Queries the AI model to generate new test cases.
-            - Parses and saves each generated test case as a JSON file, organized by difficulty and timestamp.
-        4. Handles and logs any errors encountered during processing.
+            - Submits the prompt to the AI model; domains are queried concurrently.
+        4. Parses and saves the generated test cases of each domain as soon as its response arrives,
+           organized by difficulty and timestamp.
+        5. Handles and logs any errors encountered during processing.
 
     Dependencies:
         - Requires the OpenAIConnector class for querying the AI model.
-        - Assumes the existence of helper functions: get_previous_test_cases and extract_json_array.
+        - Uses DomainTestCaseStore for the previously generated test cases and extract_json_array for parsing.
         - Uses the logging module for error and info logging.
 
     Raises:
@@ -99,8 +147,14 @@ def generate_test_cases(test_cases_per_difficulty=1):
 
     Note:
         The number of test cases per difficulty and the system prompt must be defined elsewhere in the code.
+        At most max_concurrency requests are in flight at once (defaults to the connector's configured limit).
+        on_saved, if given, is called as on_saved(subdir, file_name, file_path, test_case) for every written test case.
+        connector, if given, is used instead of a new OpenAIConnector and left open.
     """
-    connector = OpenAIConnector()
+    # A connector handed in is shared with other stages and closed by its owner
+    owns_connector = connector is None
+    if owns_connector:
+        connector = OpenAIConnector(max_concurrency=max_concurrency)
     root_input_dir = "system_documentation"
     root_output_dir = os.path.join("raw_testcases", "SQL")
     difficulties = ["Easy", "Medium", "Hard", "Extra Hard"]
@@ -109,7 +163,11 @@ def generate_test_cases(test_cases_per_difficulty=1):
     combined_db_path = os.path.join(root_input_dir, "combined_db.json")
     with open(combined_db_path, 'r') as cdbf:
         combined_db_content = cdbf.read()
+    combined_db = json.loads(combined_db_content)
+    # Join graph of the combined structure, built once for all domains
+    schema_graph = SchemaGraph(combined_db) if join_hops is not None else None
 
+    futures = {}
     for subdir in os.listdir(root_input_dir):
         base_dir = os.path.join(root_input_dir, subdir)
         if not os.path.isdir(base_dir) or subdir == "combined_db.json":
@@ -129,51 +187,85 @@ def generate_test_cases(test_cases_per_difficulty=1):
                 semantic_description = txtf.read()
 
             try:
-                previous_cases = get_previous_test_cases(output_dir)
-                previous_cases_json = json.dumps(previous_cases, indent=2)
+                store = DomainTestCaseStore(output_dir)
+                # Quote the cases most similar to the domain and its tables and summarize the rest
+                domain_db = json.loads(db_content)
+                domain_tables = [table.get("name", "") for table in domain_db.get("tables", [])]
+                focus_text = " ".join([subdir] + domain_tables)
+                previous_cases_text = select_previous_cases(
+                    store, focus_text, token_budget=previous_cases_token_budget, compact=compact_prompts
+                )
                 total_test_cases = test_cases_per_difficulty * len(difficulties)
 
-                user_prompt = f"""
-                Combined Database Structure (all business objects):
-                {combined_db_content}
-
-                Database Structure for this business domain:
-                {db_content}
-
-                Semantic Description for this business domain:
-                {semantic_description}
-
-                Previously Generated Test Cases:
-                {previous_cases_json}
-
-                Generate {total_test_cases} test cases distributed evenly across the following difficulty levels: {difficulties}.
-                The test cases should focus on the business domain '{subdir}', but need to involve related business objects from the combined database.
-                """
+                # Keep only the tables the domain's tables can be joined with (domains without tables get all of them)
+                related_db = combined_db
+                if schema_graph is not None and schema_graph.neighborhood(domain_tables, join_hops):
+                    related_db = schema_graph.prune(domain_tables, join_hops)
+                scope = "all business objects" if related_db is combined_db else f"business objects within {join_hops} join(s) of this domain"
+                if compact_prompts:
+                    # Domain tables are contained in the related structure and only referenced by name
+                    seen_columns = {}
+                    related_text = SCHEMA_LEGEND + "\n" + encode_schema(related_db, seen_columns=seen_columns)
+                    domain_text = encode_schema(
+                        domain_db,
+                        known_tables={table.get("name"): table for table in related_db.get("tables", [])},
+                        seen_columns=seen_columns
+                    )
+                    semantic_text = semantic_description.strip()
+                elif related_db is not combined_db:
+                    related_text = json.dumps(related_db, indent=4)
+                    domain_text, semantic_text = db_content, semantic_description
+                else:
+                    related_text, domain_text, semantic_text = combined_db_content, db_content, semantic_description
 
-                try:
-                    response = connector.query_with_file(
-                        system_prompt=system_prompt,
-                        user_prompt=user_prompt,
-                        file_path=os.path.join(base_dir, db_file),
-                        model="gpt-4o-mini"
+                user_prompt = user_prompt_template.format(
+                    combined_db_scope=scope,
+                    combined_db=related_text,
+                    domain_db=domain_text,
+                    semantic_description=semantic_text,
+                    previous_cases=previous_cases_text,
+                    total_test_cases=total_test_cases,
+                    difficulties=difficulties,
+                    subdir=subdir
+                )
+                if compact_prompts or related_db is not combined_db:
+                    # Size of the same prompt with the full documentation as read from the files; the previous
+                    # test cases are counted as sent, since both renderings fill the same token budget
+                    verbose_chars = (
+                        len(user_prompt) - len(scope) + len("all business objects")
+                        + len(combined_db_content) - len(related_text)
+                        + len(db_content) - len(domain_text)
+                        + len(semantic_description) - len(semantic_text)
                     )
-                    parsed_list = extract_json_array(response)
+                    report_prompt_size(subdir, verbose_chars, user_prompt, kind="SQL", domain=subdir)
 
-                    count = {level: 0 for level in difficulties}
-                    for parsed in parsed_list:
-                        diff = parsed.get("difficulty", "Unknown")
-                        idx = count.get(diff, 0) + 1
-                        count[diff] = idx
-
-                        timestamp = time.strftime("%Y%m%d_%H%M%S")
-                        filename = f"{subdir}_{diff}_{idx}_{timestamp}.json"
-                        output_path = os.path.join(output_dir, filename)
-                        with open(output_path, "w") as outfile:
-                            json.dump(parsed, outfile, indent=2)
-                        logging.info(f"Generated: {output_path}")
-
-                except Exception as e:
-                    logging.error(f"Error processing {subdir}: {e}")
+                # Attribute the LLM call of this domain to it in the metrics
+                request = dict(
+                    system_prompt=system_prompt,
+                    user_prompt=user_prompt,
+                    file_path=os.path.join(base_dir, db_file),
+                    model="gpt-4o-mini"
+                )
+                with metric_labels(domain=subdir):
+                    future = connector.submit_with_file(**request)
+                futures[future] = (subdir, output_dir, store, DuplicateIndex.from_cases(store.cases, store.file_names), request)
             except Exception as e:
                 logging.error(f"Failed to process {subdir}: {e}")
 
+    try:
+        for future in as_completed(futures):
+            subdir, output_dir, store, dedup, request = futures[future]
+            try:
+                response = future.result()
+                try:
+                    parsed_list = extract_json_array(response)
+                except ValueError:
+                    # Request the test cases again next time instead of replaying the unusable response
+                    connector.invalidate(**request)
+                    raise
+                save_test_cases(parsed_list, output_dir, subdir, difficulties, store, dedup, on_saved)
+            except Exception as e:
+                logging.error(f"Error processing {subdir}: {e}")
+    finally:
+        if owns_connector:
+            connector.close()
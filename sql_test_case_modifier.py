@@ -2,103 +2,161 @@
 import os
 import json
 import logging
+from concurrent.futures import as_completed
 from llm_connector import OpenAIConnector
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+from humanize_batching import batch_response_format, build_batches, humanize_batch
+from humanize_manifest import HumanizeManifest, content_hash, prompt_fingerprint
+from run_state import get_run_state
+from consistency_check import check_consistency
 
 base_path = "raw_testcases/SQL"
 updated_base_path = "modified_input_testcases/SQL"
+validated_base_path = "validated_testcases/SQL"
+model = "gpt-4o-mini"
+
+rewrite_rules = """
+    You will receive json objects containing SQL test cases. 
+    Each test case contains:
+    1. difficulty: describing the difficulty of the test case
+    2. input: the input of the test case (usually a description or requirement)
+    3. output: the expected output of the test case - an SQL query
+    Rewrite the input of the testcase to a more humanly written way. This includes:
+    - be colloquial and natural
+    - clarify abbreviations, table names, or column names if possible, but do not change any identifiers or values that are referenced in the SQL output
+    - make dates, numbers, and other values more human-readable where possible
+    - rephrase technical requirements into natural language, but keep them consistent with the SQL output
+    Never change any ID/UUID or any value that must match the SQL output.
+"""
+
+system_prompt = rewrite_rules + """
+    Only return the value of the "input" of the json object. Respond only with the plain sentence, without quotation marks, formatting, or any extra characters at the beginning or end.
+"""
+
+batch_system_prompt = rewrite_rules + batch_response_format
+
+def save_humanized_test_case(subfolder, file_name, data):
+    """
+    Writes a humanized test case to the mirrored location under updated_base_path.
+
+    Returns:
+        str: Path of the written file.
+    """
+    updated_subfolder_path = os.path.join(updated_base_path, subfolder)
+    os.makedirs(updated_subfolder_path, exist_ok=True)
+    updated_file_path = os.path.join(updated_subfolder_path, file_name)
+
+    with open(updated_file_path, "w", encoding="utf-8") as updated_file:
+        json.dump(data, updated_file, indent=4, ensure_ascii=False)
+    get_run_state().record(
+        "SQL", subfolder, file_name, "humanized", data,
+        humanized_hash=content_hash(json.dumps(data, indent=4, ensure_ascii=False))
+    )
+    logging.info(f"Updated file saved: {updated_file_path}")
+    return updated_file_path
 
-def humanize_testcases():
+def humanize_testcases(max_concurrency=None, batch_size=20, batch_token_budget=6000, force=False):
     """
     Iterates through all JSON test case files in the base_path directory structure.
     For each file, it rewrites the 'input' field of the test case to a more
     natural, human-friendly expression using an LLM. The modified test cases
     are saved in a corresponding mirrored structure under updated_base_path.
+    Test cases are rewritten in batches (limited by batch_size and by an estimated
+    batch_token_budget) with a single-case retry for entries a batch response misses.
+    Batches are dispatched concurrently and results are written as they complete.
+    Unless force is set, only raw test cases that are new or changed since the last run
+    (according to the manifest in updated_base_path) are humanized. A missing manifest
+    is seeded from the raw test cases that already have a humanized counterpart.
     """
-    connector = OpenAIConnector()
+    manifest = HumanizeManifest(updated_base_path)
+    prompt_hash = prompt_fingerprint(model, system_prompt, batch_system_prompt)
+    # Test cases humanized before the manifest existed are not rewritten again
+    seeded = manifest.seed_if_new(base_path, (updated_base_path, validated_base_path), prompt_hash)
+    if seeded:
+        logging.info(f"Recorded {seeded} test cases humanized before the manifest existed")
+    items = []
+    raw_rel_paths = set()
+    skipped = 0
     for subfolder in os.listdir(base_path):
         subfolder_path = os.path.join(base_path, subfolder)
         if os.path.isdir(subfolder_path):
             for file_name in os.listdir(subfolder_path):
                 if file_name.endswith(".json"):
                     file_path = os.path.join(subfolder_path, file_name)
+                    rel_path = f"{subfolder}/{file_name}"
+                    raw_rel_paths.add(rel_path)
                     try:
+                        with open(file_path, "rb") as file:
+                            raw = file.read()
+                        raw_hash = content_hash(raw)
+                        if not force and manifest.is_current(rel_path, raw_hash, prompt_hash):
+                            skipped += 1
+                            continue
+
                         logging.info(f"Processing file: {file_path}")
-                        with open(file_path, "r", encoding="utf-8") as file:
-                            data = json.load(file)
-
-                        user_prompt = json.dumps(data, ensure_ascii=False)
-                        system_prompt = """
-                            You will receive json objects containing SQL test cases. 
-                            Each test case contains:
-                            1. difficulty: describing the difficulty of the test case
-                            2. input: the input of the test case (usually a description or requirement)
-                            3. output: the expected output of the test case - an SQL query
-                            Rewrite the input of the testcase to a more humanly written way. This includes:
-                            - be colloquial and natural
-                            - clarify abbreviations, table names, or column names if possible, but do not change any identifiers or values that are referenced in the SQL output
-                            - make dates, numbers, and other values more human-readable where possible
-                            - rephrase technical requirements into natural language, but keep them consistent with the SQL output
-                            Never change any ID/UUID or any value that must match the SQL output.
-                            Only return the value of the "input" of the json object. Respond only with the plain sentence, without quotation marks, formatting, or any extra characters at the beginning or end.
-                        """
-
-                        rewritten_input = connector.query_without_file(system_prompt, user_prompt)
-                        data["input"] = rewritten_input
-
-                        updated_subfolder_path = os.path.join(updated_base_path, subfolder)
-                        os.makedirs(updated_subfolder_path, exist_ok=True)
-                        updated_file_path = os.path.join(updated_subfolder_path, file_name)
-
-                        with open(updated_file_path, "w", encoding="utf-8") as updated_file:
-                            json.dump(data, updated_file, indent=4, ensure_ascii=False)
-
-                        logging.info(f"Updated file saved: {updated_file_path}")
+                        data = json.loads(raw.decode("utf-8"))
+                        items.append((subfolder, file_name, file_path, raw_hash, data))
 
                     except Exception as e:
                         logging.error(f"Error processing file {file_path}: {e}", exc_info=True)
 
-def compare_json_files(file1, file2):
-    """
-    Compares two JSON files by loading their content and ignoring the 'input' field.
-    """
+    for rel_path in manifest.stale_outputs(raw_rel_paths):
+        logging.warning(f"Stale humanized test case without raw source: {os.path.join(updated_base_path, rel_path)}")
+    logging.info(f"Humanizing {len(items)} new or changed test cases, {skipped} up to date")
+    if not items:
+        manifest.save()
+        return
+
+    connector = OpenAIConnector(max_concurrency=max_concurrency)
+    futures = [
+        connector.submit(humanize_batch, connector, batch, system_prompt, batch_system_prompt, model)
+        for batch in build_batches(items, max_items=batch_size, max_tokens=batch_token_budget)
+    ]
+
     try:
-        with open(file1, 'r', encoding='utf-8') as f1, open(file2, 'r', encoding='utf-8') as f2:
-            data1 = json.load(f1)
-            data2 = json.load(f2)
-        data1.pop("input", None)
-        data2.pop("input", None)
-        return data1 == data2
-    except Exception as e:
-        logging.error(f"Error comparing files {file1} and {file2}: {e}", exc_info=True)
-        return False
-
-def evaluate_folders(folder1=base_path, folder2=updated_base_path):
+        for future in as_completed(futures):
+            for (subfolder, file_name, file_path, raw_hash, data), rewritten_input, error in future.result():
+                try:
+                    if error is not None:
+                        raise error
+                    data["input"] = rewritten_input
+                    save_humanized_test_case(subfolder, file_name, data)
+                    manifest.record(f"{subfolder}/{file_name}", raw_hash, prompt_hash)
+
+                except Exception as e:
+                    logging.error(f"Error processing file {file_path}: {e}", exc_info=True)
+    finally:
+        manifest.save()
+        connector.close()
+
+def evaluate_folders(folder1=base_path, folder2=updated_base_path, workers=None):
     """
     Compares all JSON files in folder1 and folder2 to verify whether only the 'input'
-    field has changed. Reports missing files or structural differences.
+    field has changed. Reports missing files, structural differences and humanized
+    files without a raw source, using hashes cached in a sidecar manifest
+    (see check_consistency). Returns the structured report.
     """
-    for subdir, _, files in os.walk(folder1):
-        rel_path = os.path.relpath(subdir, folder1)
-        corresponding_subdir = os.path.join(folder2, rel_path)
-
-        for file in files:
-            if file.endswith('.json'):
-                file1 = os.path.join(subdir, file)
-                file2 = os.path.join(corresponding_subdir, file)
-
-                if not os.path.exists(file2):
-                    logging.warning(f"File missing in second folder: {file2}")
-                elif not compare_json_files(file1, file2):
-                    logging.warning(f"Files differ beyond 'input': {file1} vs {file2}")
+    report = check_consistency(folder1, folder2, workers=workers)
+    for rel_path in report["missing"]:
+        logging.warning(f"File missing in second folder: {os.path.join(folder2, rel_path)}")
+    for rel_path in report["differs"]:
+        logging.warning(f"Files differ beyond 'input': {os.path.join(folder1, rel_path)} vs {os.path.join(folder2, rel_path)}")
+    for rel_path in report["orphaned"]:
+        logging.warning(f"File without raw source: {os.path.join(folder2, rel_path)}")
+    for path in report["unreadable"]:
+        logging.warning(f"Unreadable file: {path}")
+    logging.info(
+        f"Checked {report['checked']} test cases ({report['rehashed']} files hashed): {len(report['missing'])} missing, "
+        f"{len(report['differs'])} differ, {len(report['orphaned'])} orphaned"
+    )
+    return report
 
 if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
     humanize_testcases()
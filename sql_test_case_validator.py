@@ -1,20 +1,47 @@
 import os
+import re
 import json
 import shutil
+import sqlite3
+import hashlib
 import sqlparse
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+from deduplication import normalize_sql
+from run_state import get_run_state
 
 TESTCASE_FOLDER = "modified_input_testcases/SQL"
 VALIDATED_FOLDER = "validated_testcases/SQL"
+SCHEMA_FILE = "system_documentation/combined_db.json"
+
+# Column formats of the documentation mapped to SQLite column types
+FORMAT_TO_SQLITE_TYPE = {
+    "string": "TEXT",
+    "uuid": "TEXT",
+    "array": "TEXT",
+    "date": "DATE",
+    "boolean": "BOOLEAN",
+}
+
+# Error categories reported by SchemaValidator, mapped from SQLite error messages
+ERROR_PATTERNS = [
+    ("unknown_table", re.compile(r"no such table: (.+)")),
+    ("unknown_column", re.compile(r"no such column: (.+)")),
+    ("ambiguous_column", re.compile(r"ambiguous column name: (.+)")),
+    ("unknown_function", re.compile(r"no such function: (.+)")),
+    ("syntax_error", re.compile(r"(?:near \"?.*\"?: )?syntax error|incomplete input|unrecognized token")),
+]
+
+# Categories that do not reject a test case: the query may use functions or syntax of another SQL dialect
+NON_BLOCKING_CATEGORIES = {"unknown_function", "dialect_syntax"}
+
+# MySQL/Postgres interval literals SQLite cannot parse, e.g. "INTERVAL 1 MONTH" or "INTERVAL '30 days'"
+DIALECT_INTERVAL = re.compile(
+    r"\bINTERVAL\s+(?:'[^']*'|-?\d+(?:\.\d+)?)(?:\s+(?:YEAR|QUARTER|MONTH|WEEK|DAY|HOUR|MINUTE|SECOND)S?\b)?",
+    re.IGNORECASE
+)
 
 def validate_sql_syntax(sql_code):
     """
@@ -28,54 +55,256 @@ def validate_sql_syntax(sql_code):
         logging.error(f"Exception during SQL parsing: {e}")
         return False
 
-def validate_test_cases():
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class SchemaValidator:
+    """
+    Validates SQL queries against the documented database schema.
+
+    The tables and columns of combined_db.json are created once in an in-memory
+    SQLite database; every query is then compiled with EXPLAIN on the shared
+    connection, which resolves all table and column references without
+    executing anything.
+    """
+
+    def __init__(self, schema_file=SCHEMA_FILE):
+        with open(schema_file, "r", encoding="utf-8") as f:
+            tables = json.load(f).get("tables", [])
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+
+        # Tables documented in several domains are merged into one table with all their columns
+        merged = {}
+        for table in tables:
+            columns = merged.setdefault(table["name"], {})
+            for column in table.get("columns", []):
+                columns.setdefault(column["name"], FORMAT_TO_SQLITE_TYPE.get(column.get("format"), "TEXT"))
+        for table_name, columns in merged.items():
+            column_definitions = ", ".join(
+                f"{quote_identifier(name)} {column_type}" for name, column_type in columns.items()
+            )
+            self.connection.execute(f"CREATE TABLE {quote_identifier(table_name)} ({column_definitions})")
+        self.table_count = len(merged)
+
+    def validate(self, sql_code):
+        """
+        Checks a query against the schema.
+
+        Args:
+            sql_code (str): SQL query of a test case.
+
+        Returns:
+            tuple: (is_valid, category, message) where category is None for valid queries and
+            otherwise one of "empty", "multiple_statements", "not_select", "unknown_table",
+            "unknown_column", "ambiguous_column", "unknown_function", "dialect_syntax",
+            "syntax_error" or "other".
+        """
+        statements = [statement for statement in sqlparse.split(sql_code or "") if statement.strip()]
+        if not statements:
+            return False, "empty", "No SQL statement found"
+        if len(statements) > 1:
+            return False, "multiple_statements", f"Expected one statement, found {len(statements)}"
+        statement_type = sqlparse.parse(statements[0])[0].get_type()
+        if statement_type not in ("SELECT", "UNKNOWN"):
+            return False, "not_select", f"Expected a SELECT query, found {statement_type}"
+
+        statement = statements[0].strip().rstrip(";")
+        category, message = self._explain(statement)
+        if category == "syntax_error" and DIALECT_INTERVAL.search(statement):
+            # Check the rest of the query with the interval literals replaced by a number
+            dialect_category, dialect_message = self._explain(DIALECT_INTERVAL.sub("0", statement))
+            if dialect_category is None:
+                category = "dialect_syntax"
+            elif dialect_category != "syntax_error":
+                category, message = dialect_category, dialect_message
+        if category is None:
+            return True, None, None
+        return category in NON_BLOCKING_CATEGORIES, category, message
+
+    def _explain(self, statement):
+        """
+        Compiles a statement and returns (category, message) of the error, or (None, None).
+        """
+        try:
+            with self._lock:
+                self.connection.execute("EXPLAIN " + statement)
+        except sqlite3.Error as e:
+            message = str(e)
+            return next((name for name, pattern in ERROR_PATTERNS if pattern.search(message)), "other"), message
+        return None, None
+
+# Validator of a pool worker process, created once per process by _init_worker
+_worker_validator = None
+
+def _init_worker(schema_file):
+    global _worker_validator
+    _worker_validator = SchemaValidator(schema_file)
+
+def _validate_chunk(sql_codes):
+    return [_worker_validator.validate(sql_code) for sql_code in sql_codes]
+
+def sql_cache_key(sql_code):
+    """
+    Key under which validation results are shared: queries that only differ in
+    case, whitespace, identifier quoting or a trailing semicolon validate alike.
+    """
+    return hashlib.sha256(normalize_sql(sql_code or "").encode("utf-8")).hexdigest()
+
+def validate_sql_codes(sql_codes, schema_file=SCHEMA_FILE, workers=None, chunk_size=64):
+    """
+    Validates many SQL queries, each distinct normalized query only once.
+
+    Args:
+        sql_codes (iterable): SQL queries to validate.
+        schema_file (str): Schema documentation used by SchemaValidator.
+        workers (int, optional): Number of worker processes; defaults to the CPU count.
+            With one worker (or few queries) everything runs in this process.
+        chunk_size (int): Number of queries sent to a worker at once.
+
+    Returns:
+        dict: Mapping of sql_cache_key to the (is_valid, category, message) result.
+    """
+    unique = {}
+    for sql_code in sql_codes:
+        unique.setdefault(sql_cache_key(sql_code), sql_code)
+    keys = list(unique)
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(keys) <= chunk_size:
+        validator = SchemaValidator(schema_file)
+        return {key: validator.validate(unique[key]) for key in keys}
+
+    chunks = [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(schema_file,)) as executor:
+        for chunk, chunk_results in zip(chunks, executor.map(_validate_chunk, [[unique[key] for key in chunk] for chunk in chunks])):
+            results.update(zip(chunk, chunk_results))
+    return results
+
+def write_test_case(file_path, test_case):
+    """
+    Rewrites a test case file in place. A file deleted in the meantime is not recreated.
+    """
+    if not os.path.exists(file_path):
+        logging.warning(f"Not writing removed test case {file_path}")
+        return
+    with open(file_path, "w") as file:
+        json.dump(test_case, file, indent=2)
+
+def record_validation_result(subfolder, file_name, file_path, test_case, result):
+    """
+    Writes the validation result of one test case: the error_log of an invalid
+    query is stored in place, the one of a valid query is removed. The result
+    is recorded in the run state.
+
+    Args:
+        result (tuple): (is_valid, category, message) as returned by SchemaValidator.validate.
+
+    Returns:
+        str: Target path in VALIDATED_FOLDER the caller should move a valid test case to, or None.
+    """
+    is_valid, category, message = result
+    if is_valid:
+        if category is not None:
+            logging.warning(f"Accepted SQL in {file_path} despite {category}: {message}")
+        else:
+            logging.info(f"Valid SQL in {file_path}")
+        # Remove error log if present
+        if "error_log" in test_case:
+            del test_case["error_log"]
+            write_test_case(file_path, test_case)
+        get_run_state().record("SQL", subfolder, file_name, "validated", test_case, attempt=True)
+        return os.path.join(VALIDATED_FOLDER, subfolder, file_name)
+
+    logging.warning(f"Invalid SQL ({category}) in {file_path}: {message}")
+    test_case["error_log"] = {
+        "category": category,
+        "message": message
+    }
+    write_test_case(file_path, test_case)
+    get_run_state().record("SQL", subfolder, file_name, "failed", test_case, error=test_case["error_log"], attempt=True)
+    return None
+
+def validate_test_cases(schema_file=SCHEMA_FILE, workers=None, chunk_size=64):
     """
     Validates all SQL test cases found in the TESTCASE_FOLDER.
     For each subfolder (representing a SQL category), it:
       - Iterates through all JSON files (test cases) in the subfolder.
       - Reads each test case, extracts the SQL statement.
-      - Checks the SQL syntax using sqlparse.
-      - If the syntax is valid, moves the test case file
+      - Validates the SQL against the documented schema (see SchemaValidator).
+      - If the query is valid, moves the test case file
         to the corresponding subfolder in VALIDATED_FOLDER.
+      - Otherwise records the error category and message in the test case's error_log.
       - Logs validation status and errors for each test case.
+
+    Validation is fanned out in chunks over a pool of worker processes (see
+    validate_sql_codes), repeated queries are validated only once, and the
+    validated files are moved in one pass after all results are in.
+
+    The test cases to validate are the ones the run state lists as humanized
+    or failed (see RunStateStore). The folders are synced into the run state
+    first (see RunStateStore.sync_folders), so test cases written by earlier
+    runs and hand edits in TESTCASE_FOLDER are picked up and test cases deleted
+    from it are dropped.
     """
-    for subfolder in os.listdir(TESTCASE_FOLDER):
-        subfolder_path = os.path.join(TESTCASE_FOLDER, subfolder)
-        if not os.path.isdir(subfolder_path):
-            continue
-
-        for file_name in os.listdir(subfolder_path):
-            if file_name.endswith(".json"):
-                file_path = os.path.join(subfolder_path, file_name)
-                try:
-                    with open(file_path, "r") as file:
-                        test_case = json.load(file)
-                    sql_code = test_case["output"]["sql"]
-
-                    if validate_sql_syntax(sql_code):
-                        logging.info(f"Valid SQL in {file_path}")
-                        validated_subfolder = os.path.join(VALIDATED_FOLDER, subfolder)
-                        os.makedirs(validated_subfolder, exist_ok=True)
-                        shutil.move(file_path, os.path.join(validated_subfolder, file_name))
-                    else:
-                        logging.warning(f"Invalid SQL syntax in {file_path}")
-
-                except Exception as e:
-                    logging.error(f"Error processing {file_path}: {e}")
+    run_state = get_run_state()
+    run_state.sync_folders("SQL")
+    test_cases = []
+    for subfolder, file_name, test_case in run_state.test_cases("SQL"):
+        file_path = os.path.join(TESTCASE_FOLDER, subfolder, file_name)
+        try:
+            test_cases.append((subfolder, file_name, file_path, test_case, test_case["output"]["sql"]))
+        except Exception as e:
+            logging.error(f"Error processing {file_path}: {e}")
+
+    results = validate_sql_codes(
+        (sql_code for _, _, _, _, sql_code in test_cases),
+        schema_file=schema_file,
+        workers=workers,
+        chunk_size=chunk_size
+    )
+    logging.info(f"Validated {len(results)} distinct queries for {len(test_cases)} test cases")
+
+    moves = []
+    for subfolder, file_name, file_path, test_case, sql_code in test_cases:
+        try:
+            target = record_validation_result(subfolder, file_name, file_path, test_case, results[sql_cache_key(sql_code)])
+            if target is not None:
+                moves.append((file_path, target))
+        except Exception as e:
+            logging.error(f"Error processing {file_path}: {e}")
+
+    # Move all validated test cases in one pass
+    for target_folder in set(os.path.dirname(target) for _, target in moves):
+        os.makedirs(target_folder, exist_ok=True)
+    for source, target in moves:
+        try:
+            if os.path.exists(source):
+                shutil.move(source, target)
+            else:
+                logging.warning(f"Not moving removed test case {source}")
+        except Exception as e:
+            logging.error(f"Error moving {source}: {e}")
 
 def count_remaining_files():
     """
-    Counts and logs the number of remaining (unvalidated) test case JSON files
-    in each subfolder of TESTCASE_FOLDER.
+    Counts and logs the number of remaining (unvalidated) test cases of each
+    business domain, as recorded in the run state.
     """
-    for subfolder in os.listdir(TESTCASE_FOLDER):
-        path = os.path.join(TESTCASE_FOLDER, subfolder)
-        if os.path.isdir(path):
-            count = len([f for f in os.listdir(path) if f.endswith(".json")])
-            logging.info(f"{subfolder}: {count} remaining files")
+    for subfolder, count in get_run_state().counts_by_domain("SQL").items():
+        logging.info(f"{subfolder}: {count} remaining files")
 
 
 
 if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
     validate_test_cases()
     count_remaining_files()
\ No newline at end of file
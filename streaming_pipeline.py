@@ -0,0 +1,251 @@
+import os
+import time
+import queue
+import shutil
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import api_test_case_generator
+import api_test_case_modifier
+import api_test_case_validator
+import sql_test_case_generator
+import sql_test_case_modifier
+import sql_test_case_validator
+from llm_connector import OpenAIConnector
+from humanize_batching import build_batches, humanize_batch
+from humanize_manifest import HumanizeManifest, content_hash, prompt_fingerprint
+from offline_api_validator import OfflineValidator
+from mock_server import point_name_to_url_at
+from metrics import metrics, metric_labels
+
+# Generator, modifier and validator module of every test case kind
+STAGE_MODULES = {
+    "api": (api_test_case_generator, api_test_case_modifier, api_test_case_validator),
+    "sql": (sql_test_case_generator, sql_test_case_modifier, sql_test_case_validator),
+}
+# Maximum number of test cases waiting in front of the humanize and the validate stage
+DEFAULT_QUEUE_SIZE = 64
+# Seconds the humanize stage waits for further test cases before sending an incomplete batch
+DEFAULT_BATCH_WAIT = 2.0
+
+# Marks the end of a queue
+_DONE = object()
+
+class StreamingPipeline:
+    """
+    Runs generation, humanization and validation of one test case kind as
+    concurrent stages connected by bounded in-memory queues.
+
+    Every test case the generator writes is handed to the humanize stage right
+    away (through the generators' on_saved hook). The humanize stage packs
+    arriving test cases into batches of up to batch_size cases, sending a batch
+    once it is full or batch_wait seconds after its first case arrived, and
+    forwards every rewritten test case to the validate stage, which checks it
+    immediately. Full queues block the stage in front of them, so a slow stage
+    throttles the faster ones instead of piling up work in memory: at most
+    max_concurrency humanize batches are in flight, and a batch only finishes
+    once its test cases are in the validate queue.
+
+    Both LLM stages share one OpenAIConnector, so at most max_concurrency LLM
+    requests are in flight in total. Humanize batches run on their own
+    threads rather than the connector's worker pool, which the generator's
+    tasks may fill while they wait for room in the humanize queue.
+
+    The files in raw_testcases, modified_input_testcases and validated_testcases
+    are written exactly like in the phase-by-phase run and serve as checkpoints:
+    the humanize manifest is updated, so a later run of the single phases
+    continues where the pipeline stopped.
+    """
+
+    def __init__(self, kind, test_cases_per_difficulty=1, max_concurrency=None, batch_size=20,
+                 batch_token_budget=6000, batch_wait=DEFAULT_BATCH_WAIT, queue_size=DEFAULT_QUEUE_SIZE,
+                 validate_workers=None, mock_server_url=api_test_case_validator.MOCK_SERVER_URL):
+        if kind not in STAGE_MODULES:
+            raise ValueError(f"Unknown test case kind {kind!r}, expected one of {sorted(STAGE_MODULES)}")
+        self.kind = kind
+        self.generator, self.modifier, self.validator = STAGE_MODULES[kind]
+        self.test_cases_per_difficulty = test_cases_per_difficulty
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.batch_token_budget = batch_token_budget
+        self.batch_wait = batch_wait
+        self.validate_workers = validate_workers or (api_test_case_validator.MAX_PER_HOST if kind == "api" else 1)
+        self.mock_server_url = mock_server_url
+
+        self.humanize_queue = queue.Queue(maxsize=queue_size)
+        self.validate_queue = queue.Queue(maxsize=queue_size)
+        self.manifest = HumanizeManifest(self.modifier.updated_base_path)
+        self.prompt_hash = prompt_fingerprint(self.modifier.model, self.modifier.system_prompt, self.modifier.batch_system_prompt)
+        self.manifest.seed_if_new(
+            self.modifier.base_path, (self.modifier.updated_base_path, self.modifier.validated_base_path), self.prompt_hash
+        )
+        self.counts = {"generated": 0, "humanized": 0, "humanize_failed": 0, "validated": 0, "failed": 0, "transient": 0}
+        self._counts_lock = threading.Lock()
+        self._hosts = None
+        self._connector = None
+        self._start = None
+        self._first_validated = None
+
+    def _count(self, key):
+        with self._counts_lock:
+            self.counts[key] += 1
+            if key == "validated" and self._first_validated is None:
+                self._first_validated = time.monotonic() - self._start
+
+    def _on_generated(self, subdir, file_name, file_path, test_case):
+        with open(file_path, "rb") as file:
+            raw_hash = content_hash(file.read())
+        self._count("generated")
+        self.humanize_queue.put((subdir, file_name, raw_hash, test_case))
+
+    def _generate(self):
+        try:
+            self.generator.generate_test_cases(
+                self.test_cases_per_difficulty, on_saved=self._on_generated, connector=self._connector
+            )
+        except Exception as e:
+            logging.error(f"Generation stage failed: {e}", exc_info=True)
+        finally:
+            self.humanize_queue.put(_DONE)
+
+    def _humanize_and_forward(self, batch):
+        results = humanize_batch(self._connector, batch, self.modifier.system_prompt, self.modifier.batch_system_prompt, self.modifier.model)
+        for (subfolder, file_name, raw_hash, data), rewritten_input, error in results:
+            try:
+                if error is not None:
+                    raise error
+                data["input"] = rewritten_input
+                updated_file_path = self.modifier.save_humanized_test_case(subfolder, file_name, data)
+                self.manifest.record(f"{subfolder}/{file_name}", raw_hash, self.prompt_hash)
+            except Exception as e:
+                logging.error(f"Error humanizing {subfolder}/{file_name}: {e}")
+                self._count("humanize_failed")
+                continue
+            self._count("humanized")
+            self.validate_queue.put((subfolder, file_name, updated_file_path, data))
+
+    def _humanize(self):
+        max_in_flight = self._connector.max_concurrency
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"{self.kind}-humanize")
+        pending = []
+        deadline = None
+
+        def done(future):
+            in_flight.release()
+            if future.exception() is not None:
+                logging.error(f"Humanize batch failed: {future.exception()}")
+
+        def flush():
+            for batch in build_batches(pending, max_items=self.batch_size, max_tokens=self.batch_token_budget):
+                # Blocks while max_in_flight batches are running, so this stage stops taking test cases off its queue
+                in_flight.acquire()
+                future = executor.submit(contextvars.copy_context().run, self._humanize_and_forward, batch)
+                future.add_done_callback(done)
+            pending.clear()
+
+        try:
+            while True:
+                try:
+                    timeout = max(0.0, deadline - time.monotonic()) if pending else None
+                    item = self.humanize_queue.get(timeout=timeout)
+                except queue.Empty:
+                    flush()
+                    continue
+                if item is _DONE:
+                    flush()
+                    break
+                pending.append(item)
+                if len(pending) == 1:
+                    deadline = time.monotonic() + self.batch_wait
+                if len(pending) >= self.batch_size:
+                    flush()
+        finally:
+            executor.shutdown(wait=True)
+            self.manifest.save()
+            for _ in range(self.validate_workers):
+                self.validate_queue.put(_DONE)
+
+    def _validate(self):
+        if self.kind == "api":
+            offline_validator = OfflineValidator()
+        else:
+            schema_validator = self.validator.SchemaValidator(self.validator.SCHEMA_FILE)
+        while True:
+            item = self.validate_queue.get()
+            if item is _DONE:
+                break
+            subfolder, file_name, file_path, test_case = item
+            try:
+                if self.kind == "api":
+                    outcome = self.validator.execute_test_case(
+                        subfolder, file_name, file_path, test_case, self._hosts, offline_validator
+                    )
+                else:
+                    result = schema_validator.validate(test_case["output"]["sql"])
+                    target = self.validator.record_validation_result(subfolder, file_name, file_path, test_case, result)
+                    if target is not None:
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        shutil.move(file_path, target)
+                    outcome = "validated" if target is not None else "failed"
+                self._count(outcome)
+            except Exception as e:
+                logging.error(f"Error validating {file_path}: {e}")
+                self._count("failed")
+
+    def _run_stage(self, stage, target):
+        # Threads start with an empty context, so the stage labels are set in each of them
+        with metric_labels(kind=self.kind.upper(), stage=stage):
+            target()
+
+    def run(self):
+        """
+        Runs all three stages to completion.
+
+        Returns:
+            dict: Number of test cases per outcome, wall time and time to the first validated test case in seconds.
+        """
+        self._start = time.monotonic()
+        if self.kind == "api":
+            if self.mock_server_url:
+                point_name_to_url_at(self.mock_server_url, api_test_case_validator.name_to_url)
+            self._hosts = api_test_case_validator.HostConnections()
+        # One connector for both LLM stages, so they share its concurrency limit, cache and metrics
+        self._connector = OpenAIConnector(max_concurrency=self.max_concurrency)
+
+        stages = {
+            "generate": [threading.Thread(target=self._run_stage, args=("generate", self._generate), name=f"{self.kind}-generate")],
+            "humanize": [threading.Thread(target=self._run_stage, args=("humanize", self._humanize), name=f"{self.kind}-humanize")],
+            "validate": [
+                threading.Thread(target=self._run_stage, args=("validate", self._validate), name=f"{self.kind}-validate-{i}")
+                for i in range(self.validate_workers)
+            ],
+        }
+        for threads in stages.values():
+            for thread in threads:
+                thread.start()
+        try:
+            # The stages finish in order; each one's time is measured from the start of the pipeline
+            for stage, threads in stages.items():
+                for thread in threads:
+                    thread.join()
+                metrics.observe("stage_seconds", time.monotonic() - self._start, kind=self.kind.upper(), stage=stage)
+        finally:
+            self._connector.close()
+            if self._hosts is not None:
+                self._hosts.close()
+
+        summary = dict(self.counts)
+        summary["wall_time"] = round(time.monotonic() - self._start, 2)
+        summary["time_to_first_validated"] = None if self._first_validated is None else round(self._first_validated, 2)
+        logging.info(f"Streaming {self.kind.upper()} pipeline finished: {summary}")
+        return summary
+
+def run_pipeline(kind, test_cases_per_difficulty=1, **kwargs):
+    """
+    Generates, humanizes and validates test cases of one kind ("api" or "sql") in a single streaming pass.
+    See StreamingPipeline for the keyword arguments.
+    """
+    return StreamingPipeline(kind, test_cases_per_difficulty, **kwargs).run()
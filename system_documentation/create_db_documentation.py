@@ -1,5 +1,18 @@
-import json
 import os
+import json
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Folder holding one subfolder per business entity with its API_*.json specification
+DOCUMENTATION_FOLDER = os.path.dirname(os.path.abspath(__file__))
+COMBINED_FILE_NAME = "combined_db.json"
+# Spec hashes of the last build, so unchanged entities are not parsed again
+MANIFEST_FILE_NAME = ".db_documentation_manifest.json"
+# Bump when extract_tables_from_openapi changes its output, to rebuild every entity once
+EXTRACTOR_VERSION = 1
 
 
 def extract_tables_from_openapi(openapi_spec):
@@ -8,7 +21,7 @@ def extract_tables_from_openapi(openapi_spec):
     Filters for schemas used in GET methods and ensures only tables with
     more than one meaningful column are included.
     """
-    print("Extracting tables from OpenAPI specification...")
+    logger.debug("Extracting tables from OpenAPI specification...")
 
     # Extract schema definitions and API paths
     components = openapi_spec.get("components", {})
@@ -23,7 +36,7 @@ def extract_tables_from_openapi(openapi_spec):
             if method.lower() != "get":
                 continue  # Ignore non-GET methods
 
-            print(f"Analyzing GET method at path: {path}")
+            logger.debug(f"Analyzing GET method at path: {path}")
             responses = details.get("responses", {})
             for response in responses.values():
                 content = response.get("content", {})
@@ -32,30 +45,30 @@ def extract_tables_from_openapi(openapi_spec):
                     if "$ref" in schema:
                         # Reference to a named schema
                         ref_name = schema["$ref"].split("/")[-1]
-                        print(f"   Found schema reference: {ref_name}")
+                        logger.debug(f"   Found schema reference: {ref_name}")
                         get_schema_refs.add(ref_name)
                     elif "items" in schema and "$ref" in schema["items"]:
                         # Reference inside an array
                         ref_name = schema["items"]["$ref"].split("/")[-1]
-                        print(f"   Found items schema reference: {ref_name}")
+                        logger.debug(f"   Found items schema reference: {ref_name}")
                         get_schema_refs.add(ref_name)
 
-    print(f"Found GET schema references: {get_schema_refs}")
+    logger.debug(f"Found GET schema references: {get_schema_refs}")
 
     tables = []
 
     # Loop over all available schemas
     for schema_name, schema in schemas.items():
-        print(f"Processing schema: {schema_name}")
+        logger.debug(f"Processing schema: {schema_name}")
 
         # Skip schemas not used in GET methods
         if schema_name not in get_schema_refs:
-            print(" - Skipped (not used in a GET endpoint)")
+            logger.debug(" - Skipped (not used in a GET endpoint)")
             continue
 
         # Skip if schema isn't an object or lacks properties
         if schema.get("type") != "object" or not schema.get("properties"):
-            print(" - Skipped (not an object or has no properties)")
+            logger.debug(" - Skipped (not an object or has no properties)")
             continue
 
         columns = []  # Will store column metadata
@@ -63,7 +76,7 @@ def extract_tables_from_openapi(openapi_spec):
         # Process each property as a potential column
         for prop_name, prop in schema.get("properties", {}).items():
             if not isinstance(prop, dict) or not prop:
-                print(f"   - Skipped column '{prop_name}' (invalid or empty definition)")
+                logger.debug(f"   - Skipped column '{prop_name}' (invalid or empty definition)")
                 continue
 
             # Prefer title, fall back to description, append example if available
@@ -78,12 +91,12 @@ def extract_tables_from_openapi(openapi_spec):
                 "format": prop.get("format", prop.get("type", "string"))
             }
             columns.append(column)
-            print(f"   - Column added: {prop_name}")
+            logger.debug(f"   - Column added: {prop_name}")
 
         # Only include tables with more than one descriptive column
         non_empty_columns = [col for col in columns if col["description"] or col["format"]]
         if len(non_empty_columns) <= 1:
-            print(f" - Skipped (only {len(non_empty_columns)} non-empty column(s))")
+            logger.debug(f" - Skipped (only {len(non_empty_columns)} non-empty column(s))")
             continue
 
         table = {
@@ -92,46 +105,126 @@ def extract_tables_from_openapi(openapi_spec):
             "columns": non_empty_columns
         }
         tables.append(table)
-        print(f" - Table '{table['name']}' added with {len(non_empty_columns)} columns")
+        logger.debug(f" - Table '{table['name']}' added with {len(non_empty_columns)} columns")
 
-    print("Table extraction complete.")
+    logger.debug("Table extraction complete.")
     return {"tables": tables}
 
 
-# Root folder containing all API subdirectories
-root_dir = os.path.join(os.getcwd(), "system_documentation")
-print(f"Searching for API files under: {root_dir}")
-
-combined_tables = []  # Aggregate result of all tables across subfolders
-
-# Iterate through all subdirectories
-for subfolder in os.listdir(root_dir):
-    subfolder_path = os.path.join(root_dir, subfolder)
-    if not os.path.isdir(subfolder_path):
-        continue  # Skip files
-
-    print(f"Searching in subfolder: {subfolder_path}")
-
-    for file in os.listdir(subfolder_path):
-        if file.startswith("API_") and file.endswith(".json"):
-            api_path = os.path.join(subfolder_path, file)
-            print(f"Processing API file: {api_path}")
+def _spec_files(subfolder_path):
+    return sorted(file for file in os.listdir(subfolder_path) if file.startswith("API_") and file.endswith(".json"))
 
-            with open(api_path, "r") as f:
-                openapi_spec = json.load(f)
+def _spec_hash(subfolder_path, spec_files):
+    digest = hashlib.sha256(f"{EXTRACTOR_VERSION}\n".encode("utf-8"))
+    for file in spec_files:
+        digest.update(file.encode("utf-8") + b"\0")
+        with open(os.path.join(subfolder_path, file), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
 
-            db_structure = extract_tables_from_openapi(openapi_spec)
+def _extract_subfolder(subfolder_path, spec_files):
+    tables = []
+    for file in spec_files:
+        # The specifications are UTF-8 regardless of the platform's default encoding
+        with open(os.path.join(subfolder_path, file), "r", encoding="utf-8") as f:
+            tables.extend(extract_tables_from_openapi(json.load(f))["tables"])
+    return {"tables": tables}
 
-            # Save individual subfolder result
-            output_file = os.path.join(subfolder_path, f"DB_{subfolder}.json")
-            with open(output_file, "w") as f:
-                json.dump(db_structure, f, indent=4)
-            print(f"Saved extracted structure to: {output_file}")
+def _load_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-            combined_tables.extend(db_structure["tables"])
+def write_if_changed(path, data):
+    """
+    Writes data as indented JSON, atomically and only if the file does not already hold the same content.
 
-# Save combined result to root directory
-combined_output_path = os.path.join(root_dir, "combined_db.json")
-with open(combined_output_path, "w") as f:
-    json.dump({"tables": combined_tables}, f, indent=4)
-print(f"Saved combined structure to: {combined_output_path}")
+    Returns:
+        bool: Whether the file was written.
+    """
+    if _load_json(path) == data:
+        return False
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+    return True
+
+def build_db_documentation(root_dir=DOCUMENTATION_FOLDER, workers=None, force=False):
+    """
+    Builds DB_<entity>.json for every entity folder from its API_*.json specification and merges them into combined_db.json.
+
+    Entities whose specifications have the same hash as in the last build (and
+    whose DB file still exists) are skipped; their tables are taken from their
+    DB file when combined_db.json is merged. Changed specifications are parsed
+    in a pool of worker processes (workers defaults to the CPU count; a single
+    changed entity is parsed in this process). Files are only rewritten when
+    their content changes, so downstream caches keyed on them stay valid.
+
+    Args:
+        root_dir (str): Documentation folder with one subfolder per entity.
+        workers (int, optional): Number of worker processes.
+        force (bool): Parse every specification even if its hash is unchanged.
+
+    Returns:
+        dict: {"entities": int, "parsed": list, "written": list} with the number of
+        entities, the names of the entities parsed again and the paths of the files written.
+    """
+    manifest_path = os.path.join(root_dir, MANIFEST_FILE_NAME)
+    manifest = {} if force else (_load_json(manifest_path) or {})
+
+    entities = {}
+    changed = []
+    for subfolder in sorted(os.listdir(root_dir)):
+        subfolder_path = os.path.join(root_dir, subfolder)
+        if not os.path.isdir(subfolder_path):
+            continue
+        spec_files = _spec_files(subfolder_path)
+        if not spec_files:
+            continue
+        spec_hash = _spec_hash(subfolder_path, spec_files)
+        output_file = os.path.join(subfolder_path, f"DB_{subfolder}.json")
+        db_structure = _load_json(output_file) if manifest.get(subfolder) == spec_hash else None
+        entities[subfolder] = {"hash": spec_hash, "output_file": output_file, "db_structure": db_structure}
+        if db_structure is None:
+            changed.append((subfolder, subfolder_path, spec_files))
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(changed) <= 1:
+        results = [_extract_subfolder(path, files) for _, path, files in changed]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(changed))) as executor:
+            results = list(executor.map(_extract_subfolder, [path for _, path, _ in changed], [files for _, _, files in changed]))
+
+    written = []
+    for (subfolder, _, _), db_structure in zip(changed, results):
+        entities[subfolder]["db_structure"] = db_structure
+        if write_if_changed(entities[subfolder]["output_file"], db_structure):
+            written.append(entities[subfolder]["output_file"])
+        logger.debug(f"Extracted {len(db_structure['tables'])} tables for {subfolder}")
+
+    # Merge the combined structure from the per-entity results in entity order
+    combined_tables = [table for entity in entities.values() for table in entity["db_structure"]["tables"]]
+    combined_output_path = os.path.join(root_dir, COMBINED_FILE_NAME)
+    if write_if_changed(combined_output_path, {"tables": combined_tables}):
+        written.append(combined_output_path)
+
+    new_manifest = {subfolder: entity["hash"] for subfolder, entity in entities.items()}
+    if new_manifest != manifest:
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(new_manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+
+    report = {"entities": len(entities), "parsed": [subfolder for subfolder, _, _ in changed], "written": written}
+    logger.info(f"DB documentation: {len(changed)} of {len(entities)} entities parsed, {len(written)} files written")
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    report = build_db_documentation()
+    for path in report["written"]:
+        print(f"Updated {path}")
@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import json
+import mmap
+
+# Folder of the curated test set and the default location of its packed form
+TESTSET_FOLDER = "TRBK-TestSet"
+DATASET_FILE = "TRBK-TestSet.jsonl"
+# Documentation with the API spec of every domain, used to resolve endpoint templates
+DOCUMENTATION_FOLDER = "system_documentation"
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+
+# Metadata fields every record is indexed on
+INDEXED_FIELDS = ("kind", "domain", "endpoint", "method", "difficulty")
+
+# API file names: <endpoint path with "/" as "_">_<METHOD>_<difficulty>_<n>_<timestamp>.json
+_API_FILE_NAME = re.compile(r"^(?P<endpoint>.+?)_(?P<method>GET|POST|PUT|PATCH|DELETE)_(?P<difficulty>.+)_\d+_\d{8}_\d{6}\.json$")
+# SQL file names: <domain>_<difficulty>_<n>_<timestamp>.json
+_SQL_FILE_NAME = re.compile(r"^.+_(?P<difficulty>Easy|Medium|Hard|Extra Hard|Very Hard)_\d+_\d{8}_\d{6}\.json$")
+
+def index_path(dataset_path):
+    return dataset_path + INDEX_SUFFIX
+
+def spec_path_templates(domain, documentation_folder=DOCUMENTATION_FOLDER):
+    """
+    Maps the endpoint part of the domain's API file names to the spec path it was
+    generated from (the path with "/" replaced by "_", see the API generator).
+
+    Returns:
+        dict: Encoded endpoint -> path template, empty if the domain has no readable API spec.
+    """
+    domain_folder = os.path.join(documentation_folder, domain)
+    if not os.path.isdir(domain_folder):
+        return {}
+    api_file = next((f for f in os.listdir(domain_folder) if f.startswith("API_") and f.endswith(".json")), None)
+    if api_file is None:
+        return {}
+    try:
+        with open(os.path.join(domain_folder, api_file), "r", encoding="utf-8") as f:
+            paths = json.load(f).get("paths", {})
+    except (OSError, ValueError):
+        return {}
+    return {path.replace("/", "_").strip("_"): path for path in paths}
+
+def record_metadata(kind, domain, file_name, test_case, path_templates=None):
+    """
+    Returns the indexed metadata of a test case. The endpoint is the spec path
+    template the file name was generated from (e.g. "/BankAccounts/{UUID}"), so
+    all test cases of one operation share it. Without a matching template
+    (path_templates, see spec_path_templates) it is the endpoint of the test
+    case's output. Difficulty and method fall back to the file name if the
+    test case does not state them.
+    """
+    output = test_case.get("output") if isinstance(test_case.get("output"), dict) else {}
+    endpoint = method = None
+    file_difficulty = None
+    if kind == "API":
+        match = _API_FILE_NAME.match(file_name)
+        if match:
+            endpoint = (path_templates or {}).get(match.group("endpoint"))
+            method = match.group("method")
+            file_difficulty = match.group("difficulty")
+        endpoint = endpoint or output.get("endpoint") or None
+        method = str(output.get("method") or method or "").upper() or None
+    else:
+        match = _SQL_FILE_NAME.match(file_name)
+        if match:
+            file_difficulty = match.group("difficulty")
+    return {
+        "kind": kind,
+        "domain": domain,
+        "file_name": file_name,
+        "endpoint": endpoint,
+        "method": method,
+        "difficulty": test_case.get("difficulty") or file_difficulty,
+    }
+
+def export_dataset(source=TESTSET_FOLDER, target=DATASET_FILE, documentation_folder=DOCUMENTATION_FOLDER):
+    """
+    Packs a test set folder (<source>/<API|SQL>/<domain>/<file>.json) into one JSONL file plus an index.
+
+    Every line of target is one record {"kind", "domain", "file_name",
+    "endpoint", "method", "difficulty", "test_case"}. The index next to it
+    (target + ".index.json") holds the byte offset and length of every line,
+    the metadata of every record and, per indexed field, the record numbers
+    of every value. Both files are written atomically. API endpoints are
+    resolved against the specs in documentation_folder.
+
+    Returns:
+        int: Number of exported records.
+    """
+    metadata = []
+    offsets = []
+    tmp_target = target + ".tmp"
+    with open(tmp_target, "wb") as data_file:
+        for kind in sorted(os.listdir(source)):
+            kind_folder = os.path.join(source, kind)
+            if not os.path.isdir(kind_folder):
+                continue
+            for domain in sorted(os.listdir(kind_folder)):
+                domain_folder = os.path.join(kind_folder, domain)
+                if not os.path.isdir(domain_folder):
+                    continue
+                path_templates = spec_path_templates(domain, documentation_folder) if kind == "API" else None
+                for file_name in sorted(os.listdir(domain_folder)):
+                    if not file_name.endswith(".json"):
+                        continue
+                    with open(os.path.join(domain_folder, file_name), "r", encoding="utf-8") as f:
+                        test_case = json.load(f)
+                    record = record_metadata(kind, domain, file_name, test_case, path_templates)
+                    line = json.dumps({**record, "test_case": test_case}, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                    offsets.append((data_file.tell(), len(line)))
+                    metadata.append(record)
+                    data_file.write(line)
+        data_size = data_file.tell()
+
+    postings = {field: {} for field in INDEXED_FIELDS}
+    for position, record in enumerate(metadata):
+        for field in INDEXED_FIELDS:
+            if record[field] is not None:
+                postings[field].setdefault(record[field], []).append(position)
+    index = {
+        "version": INDEX_VERSION,
+        "data_size": data_size,
+        "offsets": offsets,
+        "metadata": metadata,
+        "postings": postings,
+    }
+    tmp_index = index_path(target) + ".tmp"
+    with open(tmp_index, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_target, target)
+    os.replace(tmp_index, index_path(target))
+    return len(metadata)
+
+class TestSetDataset:
+    """
+    Read-only view of a packed test set (see export_dataset).
+
+    Opening it reads only the index; the JSONL file is memory-mapped and a
+    record is parsed only when it is accessed. Filters are answered from the
+    index postings, so slicing the set never touches the folder tree.
+
+    Example:
+        with TestSetDataset() as dataset:
+            for record in dataset.records(kind="API", method="PATCH", difficulty=("Hard", "Extra Hard")):
+                ...
+    """
+
+    def __init__(self, path=DATASET_FILE):
+        self.path = path
+        with open(index_path(path), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version {index.get('version')} of {path}")
+        self.offsets = index["offsets"]
+        self.metadata = index["metadata"]
+        self.postings = index["postings"]
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size != index["data_size"]:
+            self._file.close()
+            raise ValueError(f"{path} does not match its index, export the dataset again")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, position):
+        """
+        Returns the full record at position, parsed from the memory map.
+        """
+        offset, length = self.offsets[position]
+        return json.loads(self._map[offset:offset + length])
+
+    def values(self, field):
+        """
+        Returns the indexed values of a field with their number of records.
+        """
+        return {value: len(positions) for value, positions in self.postings[field].items()}
+
+    def select(self, **filters):
+        """
+        Returns the positions of the records matching all filters, in file order.
+
+        Every filter is an indexed field with a value or a collection of accepted values,
+        e.g. select(kind="SQL", difficulty=("Hard", "Extra Hard")).
+        """
+        selected = None
+        for field, accepted in filters.items():
+            if field not in self.postings:
+                raise KeyError(f"{field} is not indexed, use one of {INDEXED_FIELDS}")
+            if isinstance(accepted, str) or accepted is None:
+                accepted = (accepted,)
+            positions = set()
+            for value in accepted:
+                positions.update(self.postings[field].get(value, ()))
+            selected = positions if selected is None else selected & positions
+        return sorted(selected) if selected is not None else list(range(len(self)))
+
+    def records(self, **filters):
+        """
+        Lazily yields the full records matching the filters (see select).
+        """
+        for position in self.select(**filters):
+            yield self[position]
+
+    def test_cases(self, **filters):
+        """
+        Lazily yields the test cases matching the filters (see select).
+        """
+        for record in self.records(**filters):
+            yield record["test_case"]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    # python testset_dataset.py [source folder] [target file]
+    source = sys.argv[1] if len(sys.argv) > 1 else TESTSET_FOLDER
+    target = sys.argv[2] if len(sys.argv) > 2 else DATASET_FILE
+    count = export_dataset(source, target)
+    print(f"Exported {count} test cases from {source} to {target} (index: {index_path(target)})")